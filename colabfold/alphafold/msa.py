@@ -39,6 +39,8 @@ def make_fixed_size(
         pad_size = [pad_size_map.get(s2, None) or s1 for (s1, s2) in zip(shape, schema)]
         padding = [(0, p - v.shape[i]) for i, p in enumerate(pad_size)]
 
-        if padding:
+        # features that already have the size are kept as they are, e.g. the read-only views
+        # of mock templates, instead of being copied by np.pad
+        if any(after for _, after in padding):
             feat[k] = np.pad(v, padding)
     return feat
\ No newline at end of file
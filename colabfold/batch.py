@@ -18,11 +18,14 @@ import time
 import zipfile
 import shutil
 import pickle
+import copy
 import gzip
+import threading
 
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from functools import lru_cache, partial
 from pathlib import Path
-from typing import Any, Callable, Dict, List, Optional, Tuple, Union, TYPE_CHECKING
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union, TYPE_CHECKING
 from io import StringIO
 
 import importlib_metadata
@@ -54,18 +57,46 @@ from alphafold.data import (
     templates,
 )
 from alphafold.data.tools import hhsearch
+from colabfold.cache import FeatureCache, MSACache, cache_key
 from colabfold.citations import write_bibtex
+from colabfold.compilation_cache import enable_compilation_cache
 from colabfold.download import default_data_dir, download_alphafold_params
+from colabfold.length_buckets import evaluate_plan, greedy_pad_lengths, plan_length_buckets
+from colabfold.mmseqs.client import close_clients, get_client
+from colabfold.mmseqs.rate_limit import RateLimiter
+from colabfold.msa_container import (
+    CONTAINER_SUFFIX,
+    BinaryMSA,
+    as_a3m,
+    is_msa_container,
+    load_msa_container,
+    save_msa_container,
+)
+from colabfold.msa_filter import MSAFilter
+from colabfold.multi_device import DevicePool
 from colabfold.utils import (
     ACCEPT_DEFAULT_TERMS,
     DEFAULT_API_SERVER,
     NO_GPU_FOUND,
     CIF_REVISION_DATE,
     get_commit,
+    input_stem,
+    input_suffix,
+    open_text,
+    read_text,
     safe_filename,
     setup_logging,
+    unique_sequences,
     CFMMCIFIO,
 )
+from colabfold.workers import (
+    create_shared_dir,
+    load_shared_arrays,
+    load_shared_msas,
+    prefetch,
+    share_arrays,
+    share_msas,
+)
 from colabfold.relax import relax_me
 
 from Bio.PDB import MMCIFParser, PDBParser, MMCIF2Dict
@@ -81,6 +112,33 @@ import jax.numpy as jnp
 logging.getLogger('jax._src.xla_bridge').addFilter(lambda _: False) # jax >=0.4.6
 logging.getLogger('jax._src.lib.xla_bridge').addFilter(lambda _: False) # jax < 0.4.5
 
+@lru_cache(maxsize=64)
+def mock_template_arrays(ln: int, num_temp: int) -> Dict[str, np.ndarray]:
+    """The arrays of mk_mock_template as read-only broadcast views, which take no memory
+    beyond a single row, shared by all mock templates of the same length"""
+    atom_type_num = templates.residue_constants.atom_type_num
+    templates_aatype = templates.residue_constants.sequence_to_onehot(
+        "A", templates.residue_constants.HHBLITS_AA_TO_ID
+    )
+    return {
+        "template_all_atom_positions": np.broadcast_to(
+            np.zeros((), dtype=np.float64), (num_temp, ln, atom_type_num, 3)
+        ),
+        "template_all_atom_masks": np.broadcast_to(
+            np.zeros((), dtype=np.float64), (num_temp, ln, atom_type_num)
+        ),
+        "template_aatype": np.broadcast_to(
+            templates_aatype, (num_temp, ln, templates_aatype.shape[-1])
+        ),
+        "template_confidence_scores": np.broadcast_to(
+            np.ones((), dtype=np.float64), (num_temp, ln)
+        ),
+        "template_sum_probs": np.broadcast_to(
+            np.zeros((), dtype=np.float32), (num_temp,)
+        ),
+    }
+
+
 def mk_mock_template(
     query_sequence: Union[List[str], str], num_temp: int = 1
 ) -> Dict[str, Any]:
@@ -89,36 +147,42 @@ def mk_mock_template(
         if isinstance(query_sequence, str)
         else sum(len(s) for s in query_sequence)
     )
-    output_templates_sequence = "A" * ln
-    output_confidence_scores = np.full(ln, 1.0)
-
-    templates_all_atom_positions = np.zeros(
-        (ln, templates.residue_constants.atom_type_num, 3)
-    )
-    templates_all_atom_masks = np.zeros((ln, templates.residue_constants.atom_type_num))
-    templates_aatype = templates.residue_constants.sequence_to_onehot(
-        output_templates_sequence, templates.residue_constants.HHBLITS_AA_TO_ID
-    )
     template_features = {
-        "template_all_atom_positions": np.tile(
-            templates_all_atom_positions[None], [num_temp, 1, 1, 1]
-        ),
-        "template_all_atom_masks": np.tile(
-            templates_all_atom_masks[None], [num_temp, 1, 1]
-        ),
+        **mock_template_arrays(ln, num_temp),
         "template_sequence": [f"none".encode()] * num_temp,
-        "template_aatype": np.tile(np.array(templates_aatype)[None], [num_temp, 1, 1]),
-        "template_confidence_scores": np.tile(
-            output_confidence_scores[None], [num_temp, 1]
-        ),
         "template_domain_names": [f"none".encode()] * num_temp,
         "template_release_date": [f"none".encode()] * num_temp,
-        "template_sum_probs": np.zeros([num_temp], dtype=np.float32),
     }
     return template_features
 
+# template features of recent searches by (hash of the MSA, template set, query sequence),
+# the MSAs themselves are not kept
+TEMPLATE_SEARCH_CACHE_SIZE = 16
+_template_searches: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+_template_searches_lock = threading.Lock()
+
 def mk_template(
     a3m_lines: str, template_path: str, query_sequence: str
+) -> Dict[str, Any]:
+    # the templates_{M} dirs of the MSA server link to a shared template set, so identical
+    # queries against the same set are only searched once
+    template_db = os.path.dirname(os.path.realpath(f"{template_path}/pdb70_a3m.ffindex"))
+    key = (cache_key(a3m_lines), template_db, query_sequence)
+    with _template_searches_lock:
+        features = _template_searches.pop(key, None)
+        if features is not None:
+            # most recently used last
+            _template_searches[key] = features
+    if features is None:
+        features = search_templates(a3m_lines, template_db, query_sequence)
+        with _template_searches_lock:
+            _template_searches[key] = features
+            while len(_template_searches) > TEMPLATE_SEARCH_CACHE_SIZE:
+                del _template_searches[next(iter(_template_searches))]
+    return {key: value.copy() for key, value in features.items()}
+
+def search_templates(
+    a3m_lines: str, template_path: str, query_sequence: str
 ) -> Dict[str, Any]:
     template_featurizer = templates.HhsearchHitFeaturizer(
         mmcif_dir=template_path,
@@ -304,23 +368,115 @@ def pad_input(
     )  # template_mask (4, 4) second value
     return input_fix
 
+# the residue axis of the multimer input features, the other features have no residue axis
+MULTIMER_RESIDUE_AXIS = {
+    "aatype": 0,
+    "residue_index": 0,
+    "seq_mask": 0,
+    "asym_id": 0,
+    "sym_id": 0,
+    "entity_id": 0,
+    "entity_mask": 0,
+    "deletion_mean": 0,
+    "all_atom_mask": 0,
+    "all_atom_positions": 0,
+    "msa": 1,
+    "msa_mask": 1,
+    "bert_mask": 1,
+    "deletion_matrix": 1,
+    "template_aatype": 1,
+    "template_all_atom_mask": 1,
+    "template_all_atom_positions": 1,
+}
+
+# the multimer model samples the MSA itself, the number of rows is rounded up to a multiple of
+# this to compile the model for a few MSA sizes (like pipeline_multimer.pad_msa, which pads to 512)
+MULTIMER_MSA_ROW_PADDING = 512
+
+def pad_input_multimer(
+    input_features: model.features.FeatureDict,
+    pad_len: int,
+    num_msa_rows: Optional[int] = None,
+) -> model.features.FeatureDict:
+    """Pads the residues of the multimer input features to pad_len and the MSA to num_msa_rows.
+
+    The padded residues and rows are masked out (seq_mask, msa_mask and the atom and template
+    masks are zero), so they do not change the prediction of the real residues. The padded
+    residues get an asym_id, sym_id and entity_id of their own. The number of templates is not
+    padded, the template embeddings are averaged over all templates.
+    """
+    seq_len = input_features["aatype"].shape[0]
+    padded = dict(input_features)
+    for key, axis in MULTIMER_RESIDUE_AXIS.items():
+        if key not in input_features:
+            continue
+        value = np.asarray(input_features[key])
+        padding = [(0, 0)] * value.ndim
+        padding[axis] = (0, pad_len - seq_len)
+        padded[key] = np.pad(value, padding)
+    for key in ["asym_id", "sym_id", "entity_id"]:
+        if key in input_features:
+            padded[key][seq_len:] = np.max(input_features[key]) + 1
+    if num_msa_rows is not None:
+        padded = pipeline_multimer.pad_msa(padded, min_num_seq=num_msa_rows)
+    return padded
+
+# the number of leading residue axes of the (nested) outputs of the multimer model
+MULTIMER_RESULT_RESIDUE_AXES = {
+    "plddt": 1,
+    "predicted_aligned_error": 2,
+    "aligned_confidence_probs": 2,
+    "distogram": {"logits": 2},
+    "experimentally_resolved": {"logits": 1},
+    "predicted_lddt": {"logits": 1},
+    "structure_module": {"final_atom_mask": 1, "final_atom_positions": 1},
+    "representations": {"single": 1, "pair": 2},
+}
+
+def crop_multimer_result(
+    result: Dict[str, Any], seq_len: int, residue_axes: Dict[str, Any] = MULTIMER_RESULT_RESIDUE_AXES
+) -> Dict[str, Any]:
+    """Crops the outputs of a padded multimer prediction back to the real residues"""
+    cropped = dict(result)
+    for key, axes in residue_axes.items():
+        if key not in result:
+            continue
+        if isinstance(axes, dict):
+            cropped[key] = crop_multimer_result(result[key], seq_len, axes)
+        else:
+            cropped[key] = result[key][(slice(0, seq_len),) * axes]
+    if "masked_msa" in result:
+        cropped["masked_msa"] = {"logits": result["masked_msa"]["logits"][:, :seq_len]}
+    return cropped
+
 class file_manager:
     def __init__(self, prefix: str, result_dir: Path):
         self.prefix = prefix
         self.result_dir = result_dir
         self.tag = None
         self.files = {}
-
-    def get(self, x: str, ext:str) -> Path:
-        if self.tag not in self.files:
-            self.files[self.tag] = []
-        file = self.result_dir.joinpath(f"{self.prefix}_{x}_{self.tag}.{ext}")
-        self.files[self.tag].append([x,ext,file])
+        # held while a file is registered and written, the recycle callbacks of a device pool
+        # run in its worker threads
+        self.lock = threading.RLock()
+
+    def get(self, x: str, ext:str, tag: Optional[str] = None) -> Path:
+        tag = self.tag if tag is None else tag
+        with self.lock:
+            if tag not in self.files:
+                self.files[tag] = []
+            file = self.result_dir.joinpath(f"{self.prefix}_{x}_{tag}.{ext}")
+            self.files[tag].append([x,ext,file])
         return file
 
     def set_tag(self, tag):
         self.tag = tag
 
+    def discard(self, tag):
+        """Removes the files of a prediction that is not part of the results"""
+        with self.lock:
+            for _, _, file in self.files.pop(tag, []):
+                file.unlink(missing_ok=True)
+
 def predict_structure(
     prefix: str,
     result_dir: Path,
@@ -346,8 +502,15 @@ def predict_structure(
     save_single_representations: bool = False,
     save_pair_representations: bool = False,
     save_recycles: bool = False,
+    device_pool: Optional[DevicePool] = None,
+    pad_msa_rows: bool = False,
 ):
-    """Predicts structure using AlphaFold for the given sequence."""
+    """Predicts structure using AlphaFold for the given sequence. With a device_pool, the
+    models and seeds are predicted on all of its devices at once. With pad_msa_rows, the MSA
+    of a multimer is padded to a multiple of MULTIMER_MSA_ROW_PADDING rows, so that queries
+    with different MSA sizes share a compiled model. The random numbers of the MSA sampling
+    depend on the number of rows, so the predictions can differ from unpadded ones for the
+    same seed."""
     mean_scores = []
     conf = []
     unrelaxed_pdb_lines = []
@@ -356,152 +519,178 @@ def predict_structure(
     files = file_manager(prefix, result_dir)
     seq_len = sum(sequences_lengths)
 
-    # iterate through random seeds
-    for seed_num, seed in enumerate(range(random_seed, random_seed+num_seeds)):
-
-        # iterate through models
-        for model_num, (model_name, model_runner, params) in enumerate(model_runner_and_params):
-
-            # swap params to avoid recompiling
-            model_runner.params = params
-
-            #########################
-            # process input features
-            #########################
+    return_representations = save_all or save_single_representations or save_pair_representations
+
+    def work_items():
+        """(tag, model runner, params, input features, seed) of each prediction, in order"""
+        # iterate through random seeds
+        for seed_num, seed in enumerate(range(random_seed, random_seed+num_seeds)):
+
+            # iterate through models
+            for model_num, (model_name, model_runner, params) in enumerate(model_runner_and_params):
+
+                #########################
+                # process input features
+                #########################
+                if "multimer" in model_type:
+                    if model_num == 0 and seed_num == 0:
+                        input_features = feature_dict
+                        input_features["asym_id"] = input_features["asym_id"] - input_features["asym_id"][...,0]
+                        padded_msa_rows = None
+                        if pad_msa_rows:
+                            num_msa_rows = len(feature_dict["msa"])
+                            padded_msa_rows = -(-num_msa_rows // MULTIMER_MSA_ROW_PADDING) * MULTIMER_MSA_ROW_PADDING
+                        if seq_len < pad_len or padded_msa_rows is not None:
+                            input_features = pad_input_multimer(feature_dict, max(pad_len, seq_len),
+                                padded_msa_rows)
+                            if seq_len < pad_len:
+                                logger.info(f"Padding length to {pad_len}")
+                else:
+                    if model_num == 0:
+                        input_features = model_runner.process_features(feature_dict, random_seed=seed)
+                        r = input_features["aatype"].shape[0]
+                        input_features["asym_id"] = np.tile(feature_dict["asym_id"],r).reshape(r,-1)
+                        if seq_len < pad_len:
+                            input_features = pad_input(input_features, model_runner,
+                                model_name, pad_len, use_templates)
+                            logger.info(f"Padding length to {pad_len}")
+
+                tag = f"{model_type}_{model_name}_seed_{seed:03d}"
+                yield tag, model_runner, params, input_features, seed
+
+    # monitor intermediate results
+    def callback(tag, input_features, result, recycles):
+        if recycles == 0: result.pop("tol",None)
+        if not is_complex: result.pop("iptm",None)
+        print_line = ""
+        for x,y in [["mean_plddt","pLDDT"],["ptm","pTM"],["iptm","ipTM"],["tol","tol"]]:
+          if x in result:
+            print_line += f" {y}={result[x]:.3g}"
+        logger.info(f"{tag} recycle={recycles}{print_line}")
+
+        if save_recycles:
             if "multimer" in model_type:
-                if model_num == 0 and seed_num == 0:
-                    # TODO: add pad_input_mulitmer()
-                    input_features = feature_dict
-                    input_features["asym_id"] = input_features["asym_id"] - input_features["asym_id"][...,0]
-            else:
-                if model_num == 0:
-                    input_features = model_runner.process_features(feature_dict, random_seed=seed)
-                    r = input_features["aatype"].shape[0]
-                    input_features["asym_id"] = np.tile(feature_dict["asym_id"],r).reshape(r,-1)
-                    if seq_len < pad_len:
-                        input_features = pad_input(input_features, model_runner,
-                            model_name, pad_len, use_templates)
-                        logger.info(f"Padding length to {pad_len}")
-
-
-            tag = f"{model_type}_{model_name}_seed_{seed:03d}"
-            model_names.append(tag)
-            files.set_tag(tag)
-
-            ########################
-            # predict
-            ########################
-            start = time.time()
-
-            # monitor intermediate results
-            def callback(result, recycles):
-                if recycles == 0: result.pop("tol",None)
-                if not is_complex: result.pop("iptm",None)
-                print_line = ""
-                for x,y in [["mean_plddt","pLDDT"],["ptm","pTM"],["iptm","ipTM"],["tol","tol"]]:
-                  if x in result:
-                    print_line += f" {y}={result[x]:.3g}"
-                logger.info(f"{tag} recycle={recycles}{print_line}")
-
-                if save_recycles:
-                    final_atom_mask = result["structure_module"]["final_atom_mask"]
-                    b_factors = result["plddt"][:, None] * final_atom_mask
-                    unrelaxed_protein = protein.from_prediction(
-                        features=input_features,
-                        result=result, b_factors=b_factors,
-                        remove_leading_feature_dimension=("multimer" not in model_type))
-                    files.get("unrelaxed",f"r{recycles}.pdb").write_text(protein.to_pdb(unrelaxed_protein))
-
-                    if save_all:
-                        with files.get("all",f"r{recycles}.pickle").open("wb") as handle:
-                            pickle.dump(result, handle)
-                    del unrelaxed_protein
-
-            return_representations = save_all or save_single_representations or save_pair_representations
-
-            # predict
-            result, recycles = \
-            model_runner.predict(input_features,
-                random_seed=seed,
-                return_representations=return_representations,
-                callback=callback)
-
-            prediction_times.append(time.time() - start)
-
-            ########################
-            # parse results
-            ########################
-
-            # summary metrics
-            mean_scores.append(result["ranking_confidence"])
-            if recycles == 0: result.pop("tol",None)
-            if not is_complex: result.pop("iptm",None)
-            print_line = ""
-            conf.append({})
-            for x,y in [["mean_plddt","pLDDT"],["ptm","pTM"],["iptm","ipTM"]]:
-              if x in result:
-                print_line += f" {y}={result[x]:.3g}"
-                conf[-1][x] = float(result[x])
-            conf[-1]["print_line"] = print_line
-            logger.info(f"{tag} took {prediction_times[-1]:.1f}s ({recycles} recycles)")
-
-            # create protein object
+                result = crop_multimer_result(result, seq_len)
             final_atom_mask = result["structure_module"]["final_atom_mask"]
             b_factors = result["plddt"][:, None] * final_atom_mask
             unrelaxed_protein = protein.from_prediction(
-                features=input_features,
-                result=result,
-                b_factors=b_factors,
+                features=input_features if "multimer" not in model_type else feature_dict,
+                result=result, b_factors=b_factors,
                 remove_leading_feature_dimension=("multimer" not in model_type))
+            with files.lock:
+                files.get("unrelaxed",f"r{recycles}.pdb",tag).write_text(protein.to_pdb(unrelaxed_protein))
+
+                if save_all:
+                    with files.get("all",f"r{recycles}.pickle",tag).open("wb") as handle:
+                        pickle.dump(result, handle)
+            del unrelaxed_protein
 
-            # callback for visualization
-            if prediction_callback is not None:
-                prediction_callback(unrelaxed_protein, sequences_lengths,
-                                    result, input_features, (tag, False))
-
-            #########################
-            # save results
-            #########################
-
-            # save pdb
-            protein_lines = protein.to_pdb(unrelaxed_protein)
-            files.get("unrelaxed","pdb").write_text(protein_lines)
-            unrelaxed_pdb_lines.append(protein_lines)
-
-            # save raw outputs
-            if save_all:
-                with files.get("all","pickle").open("wb") as handle:
-                    pickle.dump(result, handle)
-            if save_single_representations:
-                np.save(files.get("single_repr","npy"),result["representations"]["single"])
-            if save_pair_representations:
-                np.save(files.get("pair_repr","npy"),result["representations"]["pair"])
-
-            # write an easy-to-use format (pAE and pLDDT)
-            with files.get("scores","json").open("w") as handle:
-                plddt = result["plddt"][:seq_len]
-                scores = {"plddt": np.around(plddt.astype(float), 2).tolist()}
-                if "predicted_aligned_error" in result:
-                  pae   = result["predicted_aligned_error"][:seq_len,:seq_len]
-                  scores.update({"max_pae": pae.max().astype(float).item(),
-                                 "pae": np.around(pae.astype(float), 2).tolist()})
-                  for k in ["ptm","iptm"]:
-                    if k in conf[-1]: scores[k] = np.around(conf[-1][k], 2).item()
-                  del pae
-                del plddt
-                json.dump(scores, handle)
-
-            del result, unrelaxed_protein
-
-            # early stop criteria fulfilled
-            if mean_scores[-1] > stop_at_score: break
+    def predict(work_item, device=None):
+        tag, model_runner, params, input_features, seed = work_item
+        if device is None:
+            # swap params to avoid recompiling
+            model_runner.params = params
+        else:
+            # a runner of its own with the params on the device, the jitted model is shared
+            model_runner = copy.copy(model_runner)
+            model_runner.params = device_pool.put(params, device)
+        start = time.time()
+        result, recycles = model_runner.predict(input_features,
+            random_seed=seed,
+            return_representations=return_representations,
+            callback=partial(callback, tag, input_features))
+        return result, recycles, time.time() - start
+
+    ########################
+    # predict
+    ########################
+    if device_pool is None:
+        predictions = ((work_item, predict(work_item)) for work_item in work_items())
+    else:
+        predictions = device_pool.imap(predict, work_items())
+
+    for (tag, _, _, input_features, _), (result, recycles, seconds) in predictions:
+        model_names.append(tag)
+        files.set_tag(tag)
+        prediction_times.append(seconds)
+        if "multimer" in model_type:
+            # drop the outputs of the padded residues
+            result = crop_multimer_result(result, seq_len)
+
+        ########################
+        # parse results
+        ########################
+
+        # summary metrics
+        mean_scores.append(result["ranking_confidence"])
+        if recycles == 0: result.pop("tol",None)
+        if not is_complex: result.pop("iptm",None)
+        print_line = ""
+        conf.append({})
+        for x,y in [["mean_plddt","pLDDT"],["ptm","pTM"],["iptm","ipTM"]]:
+          if x in result:
+            print_line += f" {y}={result[x]:.3g}"
+            conf[-1][x] = float(result[x])
+        conf[-1]["print_line"] = print_line
+        logger.info(f"{tag} took {prediction_times[-1]:.1f}s ({recycles} recycles)")
+
+        # create protein object
+        final_atom_mask = result["structure_module"]["final_atom_mask"]
+        b_factors = result["plddt"][:, None] * final_atom_mask
+        output_features = input_features if "multimer" not in model_type else feature_dict
+        unrelaxed_protein = protein.from_prediction(
+            features=output_features,
+            result=result,
+            b_factors=b_factors,
+            remove_leading_feature_dimension=("multimer" not in model_type))
+
+        # callback for visualization
+        if prediction_callback is not None:
+            prediction_callback(unrelaxed_protein, sequences_lengths,
+                                result, output_features, (tag, False))
+
+        #########################
+        # save results
+        #########################
+
+        # save pdb
+        protein_lines = protein.to_pdb(unrelaxed_protein)
+        files.get("unrelaxed","pdb").write_text(protein_lines)
+        unrelaxed_pdb_lines.append(protein_lines)
+
+        # save raw outputs
+        if save_all:
+            with files.get("all","pickle").open("wb") as handle:
+                pickle.dump(result, handle)
+        if save_single_representations:
+            np.save(files.get("single_repr","npy"),result["representations"]["single"])
+        if save_pair_representations:
+            np.save(files.get("pair_repr","npy"),result["representations"]["pair"])
+
+        # write an easy-to-use format (pAE and pLDDT)
+        with files.get("scores","json").open("w") as handle:
+            plddt = result["plddt"][:seq_len]
+            scores = {"plddt": np.around(plddt.astype(float), 2).tolist()}
+            if "predicted_aligned_error" in result:
+              pae   = result["predicted_aligned_error"][:seq_len,:seq_len]
+              scores.update({"max_pae": pae.max().astype(float).item(),
+                             "pae": np.around(pae.astype(float), 2).tolist()})
+              for k in ["ptm","iptm"]:
+                if k in conf[-1]: scores[k] = np.around(conf[-1][k], 2).item()
+              del pae
+            del plddt
+            json.dump(scores, handle)
+
+        del result, unrelaxed_protein
 
         # early stop criteria fulfilled
         if mean_scores[-1] > stop_at_score: break
-
-        # cleanup
-        if "multimer" not in model_type: del input_features
-    if "multimer" in model_type: del input_features
+    # after an early stop, the predictions that have not started are dropped and the running
+    # ones are waited for, their recycle files are removed as in a sequential run
+    predictions.close()
+    for tag in list(files.files):
+        if tag not in model_names:
+            files.discard(tag)
 
     ###################################################
     # rerank models based on predicted confidence
@@ -571,19 +760,96 @@ def parse_fasta(fasta_string: str) -> Tuple[List[str], List[str]]:
 
     return sequences, descriptions
 
+class A3MPath(NamedTuple):
+    """An a3m file in place of the a3m lines of a query, so a directory with many large a3m
+    files is not loaded up front. unserialize_msa reads it when the job starts."""
+
+    path: Path
+    # the first line of the file, e.g. the #lengths\tcardinalities line of a complex MSA
+    first_line: str
+
+
+def read_first_record(path: Path) -> Tuple[Optional[str], Optional[str], bool]:
+    """Reads a fasta/a3m file up to its first sequence, parsed like parse_fasta.
+
+    Returns the first line of the file, the first sequence (None for an empty file) and
+    whether there are more sequences"""
+    first_line = None
+    sequence = None
+    with open_text(path) as f:
+        for line in f:
+            if first_line is None:
+                first_line = line.rstrip("\r\n")
+            line = line.strip()
+            if line.startswith("#"):
+                continue
+            if line.startswith(">"):
+                if sequence is not None:
+                    return first_line, sequence, True
+                sequence = ""
+                continue
+            elif not line:
+                continue
+            if sequence is None:
+                raise ValueError(f"{path} has a sequence before the first header")
+            sequence += line
+    return first_line, sequence, False
+
+
+def iter_query_files(input_path: Path) -> Iterator[Tuple[str, Union[str, List[str]], Union[None, A3MPath, Path]]]:
+    """Yields the queries of the fasta/a3m files (optionally .gz/.zst compressed) and MSA
+    containers of a directory. Only the first sequence of each file is read, a3m files and
+    containers are yielded by path and read when the job starts."""
+    for file in sorted(input_path.iterdir()):
+        if file.suffix == CONTAINER_SUFFIX and is_msa_container(file):
+            (_, _, query_seqs_unique, query_seqs_cardinality, _) = load_msa_container(file)
+            query_sequence = [
+                seq for seq, n in zip(query_seqs_unique, query_seqs_cardinality) for _ in range(n)
+            ]
+            yield (file.stem, query_sequence[0] if len(query_sequence) == 1 else query_sequence, file)
+            continue
+        if not file.is_file():
+            continue
+        suffix = input_suffix(file).lower()
+        if suffix not in [".a3m", ".fasta", ".faa"]:
+            logger.warning(f"non-fasta/a3m file in input directory: {file}")
+            continue
+        first_line, query_sequence, more_sequences = read_first_record(file)
+        if query_sequence is None:
+            logger.error(f"{file} is empty")
+            continue
+        if more_sequences and suffix in [".fasta", ".faa", ".fa"]:
+            logger.warning(
+                f"More than one sequence in {file}, ignoring all but the first sequence"
+            )
+
+        if suffix == ".a3m":
+            yield (input_stem(file), query_sequence.upper(), A3MPath(file, first_line))
+        else:
+            if query_sequence.count(":") == 0:
+                # Single sequence
+                yield (input_stem(file), query_sequence, None)
+            else:
+                # Complex mode
+                yield (input_stem(file), query_sequence.upper().split(":"), None)
+
+
 def get_queries(
     input_path: Union[str, Path], sort_queries_by: str = "length"
-) -> Tuple[List[Tuple[str, str, Optional[List[str]]]], bool]:
+) -> Tuple[List[Tuple[str, str, Union[None, List[str], A3MPath, Path]]], bool]:
     """Reads a directory of fasta files, a single fasta file or a csv file and returns a tuple
-    of job name, sequence and the optional a3m lines"""
+    of job name, sequence and the optional a3m lines. In a directory, the a3m files (A3MPath)
+    and binary MSA containers (`*.msa`, their path) are returned in place of the a3m lines and
+    read by unserialize_msa. Inputs can be gzip or zstd compressed."""
 
     input_path = Path(input_path)
     if not input_path.exists():
         raise OSError(f"{input_path} could not be found")
 
     if input_path.is_file():
-        if input_path.suffix == ".csv" or input_path.suffix == ".tsv":
-            sep = "\t" if input_path.suffix == ".tsv" else ","
+        suffix = input_suffix(input_path)
+        if suffix == ".csv" or suffix == ".tsv":
+            sep = "\t" if suffix == ".tsv" else ","
             df = pandas.read_csv(input_path, sep=sep)
             assert "id" in df.columns and "sequence" in df.columns
             queries = [
@@ -593,16 +859,17 @@ def get_queries(
             for i in range(len(queries)):
                 if len(queries[i][1]) == 1:
                     queries[i] = (queries[i][0], queries[i][1][0], None)
-        elif input_path.suffix == ".a3m":
-            (seqs, header) = parse_fasta(input_path.read_text())
+        elif suffix == ".a3m":
+            a3m_text = read_text(input_path)
+            (seqs, header) = parse_fasta(a3m_text)
             if len(seqs) == 0:
                 raise ValueError(f"{input_path} is empty")
             query_sequence = seqs[0]
             # Use a list so we can easily extend this to multiple msas later
-            a3m_lines = [input_path.read_text()]
-            queries = [(input_path.stem, query_sequence, a3m_lines)]
-        elif input_path.suffix in [".fasta", ".faa", ".fa"]:
-            (sequences, headers) = parse_fasta(input_path.read_text())
+            a3m_lines = [a3m_text]
+            queries = [(input_stem(input_path), query_sequence, a3m_lines)]
+        elif suffix in [".fasta", ".faa", ".fa"]:
+            (sequences, headers) = parse_fasta(read_text(input_path))
             queries = []
             for sequence, header in zip(sequences, headers):
                 sequence = sequence.upper()
@@ -613,36 +880,10 @@ def get_queries(
                     # Complex mode
                     queries.append((header, sequence.upper().split(":"), None))
         else:
-            raise ValueError(f"Unknown file format {input_path.suffix}")
+            raise ValueError(f"Unknown file format {suffix}")
     else:
         assert input_path.is_dir(), "Expected either an input file or a input directory"
-        queries = []
-        for file in sorted(input_path.iterdir()):
-            if not file.is_file():
-                continue
-            if file.suffix.lower() not in [".a3m", ".fasta", ".faa"]:
-                logger.warning(f"non-fasta/a3m file in input directory: {file}")
-                continue
-            (seqs, header) = parse_fasta(file.read_text())
-            if len(seqs) == 0:
-                logger.error(f"{file} is empty")
-                continue
-            query_sequence = seqs[0]
-            if len(seqs) > 1 and file.suffix in [".fasta", ".faa", ".fa"]:
-                logger.warning(
-                    f"More than one sequence in {file}, ignoring all but the first sequence"
-                )
-
-            if file.suffix.lower() == ".a3m":
-                a3m_lines = [file.read_text()]
-                queries.append((file.stem, query_sequence.upper(), a3m_lines))
-            else:
-                if query_sequence.count(":") == 0:
-                    # Single sequence
-                    queries.append((file.stem, query_sequence, None))
-                else:
-                    # Complex mode
-                    queries.append((file.stem, query_sequence.upper().split(":"), None))
+        queries = list(iter_query_files(input_path))
 
     # sort by seq. len
     if sort_queries_by == "length":
@@ -656,8 +897,13 @@ def get_queries(
         if isinstance(query_sequence, list):
             is_complex = True
             break
-        if a3m_lines is not None and a3m_lines[0].startswith("#"):
+        if isinstance(a3m_lines, A3MPath):
+            a3m_line = a3m_lines.first_line or ""
+        elif isinstance(a3m_lines, list) and a3m_lines[0].startswith("#"):
             a3m_line = a3m_lines[0].splitlines()[0]
+        else:
+            continue
+        if a3m_line.startswith("#"):
             tab_sep_entries = a3m_line[1:].split("\t")
             if len(tab_sep_entries) == 2:
                 query_seq_len = tab_sep_entries[0].split(",")
@@ -700,17 +946,15 @@ def pad_sequences(
     a3m_lines_combined = []
     pos = 0
     for n, seq in enumerate(query_sequences):
+        lines = [a3m_line for a3m_line in a3m_lines[n].split("\n") if len(a3m_line) > 0]
         for j in range(0, query_cardinality[n]):
-            lines = a3m_lines[n].split("\n")
+            before = "".join(_blank_seq[:pos])
+            after = "".join(_blank_seq[pos + 1 :])
             for a3m_line in lines:
-                if len(a3m_line) == 0:
-                    continue
                 if a3m_line.startswith(">"):
                     a3m_lines_combined.append(a3m_line)
                 else:
-                    a3m_lines_combined.append(
-                        "".join(_blank_seq[:pos] + [a3m_line] + _blank_seq[pos + 1 :])
-                    )
+                    a3m_lines_combined.append(before + a3m_line + after)
             pos += 1
     return "\n".join(a3m_lines_combined)
 
@@ -726,6 +970,7 @@ def get_msa_and_templates(
     pairing_strategy: str = "greedy",
     host_url: str = DEFAULT_API_SERVER,
     user_agent: str = "",
+    msa_cache: Optional[MSACache] = None,
 ) -> Tuple[
     Optional[List[str]], Optional[List[str]], List[str], List[int], List[Dict[str, Any]]
 ]:
@@ -735,17 +980,8 @@ def get_msa_and_templates(
     use_envpair = msa_mode == "mmseqs2_uniref_env_envpair"
     if isinstance(query_sequences, str): query_sequences = [query_sequences]
 
-    # remove duplicates before searching
-    query_seqs_unique = []
-    for x in query_sequences:
-        if x not in query_seqs_unique:
-            query_seqs_unique.append(x)
-
-    # determine how many times is each sequence is used
-    query_seqs_cardinality = [0] * len(query_seqs_unique)
-    for seq in query_sequences:
-        seq_idx = query_seqs_unique.index(seq)
-        query_seqs_cardinality[seq_idx] += 1
+    # remove duplicates before searching and count how often each sequence is used
+    query_seqs_unique, _, query_seqs_cardinality = unique_sequences(query_sequences)
 
     # get template features
     template_features = []
@@ -766,6 +1002,7 @@ def get_msa_and_templates(
                     use_templates=False,
                     host_url=host_url,
                     user_agent=user_agent,
+                    cache=msa_cache,
                 )
             else:
                 a3m_lines_mmseqs2 = a3m_lines
@@ -780,6 +1017,7 @@ def get_msa_and_templates(
                 use_templates=True,
                 host_url=host_url,
                 user_agent=user_agent,
+                cache=msa_cache,
             )
         if template_paths is None:
             logger.info("No template detected")
@@ -829,6 +1067,7 @@ def get_msa_and_templates(
                 use_pairing=False,
                 host_url=host_url,
                 user_agent=user_agent,
+                cache=msa_cache,
             )
     else:
         a3m_lines = None
@@ -846,6 +1085,7 @@ def get_msa_and_templates(
                 pairing_strategy=pairing_strategy,
                 host_url=host_url,
                 user_agent=user_agent,
+                cache=msa_cache,
             )
         else:
             # homooligomers
@@ -864,59 +1104,131 @@ def get_msa_and_templates(
         template_features,
     )
 
+def make_msa_features(msa: Union[str, BinaryMSA]) -> Dict[str, ndarray]:
+    """pipeline.make_msa_features([pipeline.parsers.parse_a3m(msa)]) without the per residue
+    Python lists, the features are the same"""
+    if isinstance(msa, str):
+        msa = BinaryMSA.from_a3m(msa)
+    return msa.msa_features()
+
 def build_monomer_feature(
-    sequence: str, unpaired_msa: str, template_features: Dict[str, Any]
+    sequence: str, unpaired_msa: Union[str, BinaryMSA], template_features: Dict[str, Any]
 ):
-    msa = pipeline.parsers.parse_a3m(unpaired_msa)
     # gather features
     return {
         **pipeline.make_sequence_features(
             sequence=sequence, description="none", num_res=len(sequence)
         ),
-        **pipeline.make_msa_features([msa]),
+        **make_msa_features(unpaired_msa),
         **template_features,
     }
 
-def build_multimer_feature(paired_msa: str) -> Dict[str, ndarray]:
-    parsed_paired_msa = pipeline.parsers.parse_a3m(paired_msa)
+def build_multimer_feature(paired_msa: Union[str, BinaryMSA]) -> Dict[str, ndarray]:
     return {
         f"{k}_all_seq": v
-        for k, v in pipeline.make_msa_features([parsed_paired_msa]).items()
+        for k, v in make_msa_features(paired_msa).items()
+    }
+
+def process_chain_features(
+    chain_features: Dict[str, ndarray], chain_id: str, num_chains: int
+) -> Dict[str, ndarray]:
+    """The steps of process_multimer_features that are the same for every copy of a chain:
+    convert_monomer_features, process_unmerged_features (except for the entity_mask, which
+    depends on the entity_id) and the padding row of the paired MSA"""
+    chain = pipeline_multimer.convert_monomer_features(chain_features, chain_id)
+    chain["deletion_matrix"] = np.asarray(chain.pop("deletion_matrix_int"), dtype=np.float32)
+    if "deletion_matrix_int_all_seq" in chain:
+        chain["deletion_matrix_all_seq"] = np.asarray(
+            chain.pop("deletion_matrix_int_all_seq"), dtype=np.float32
+        )
+    chain["deletion_mean"] = np.mean(chain["deletion_matrix"], axis=0)
+    chain["all_atom_mask"] = residue_constants.STANDARD_ATOM_MASK[chain["aatype"]]
+    chain["all_atom_positions"] = np.zeros(list(chain["all_atom_mask"].shape) + [3])
+    chain["assembly_num_chains"] = np.asarray(num_chains)
+
+    num_alignments_all_seq = len(chain["msa_all_seq"])
+    for feature_name in list(chain):
+        if feature_name.endswith("_all_seq"):
+            chain[feature_name] = msa_pairing.pad_features(chain[feature_name], feature_name)
+    chain["num_alignments_all_seq"] = np.asarray(num_alignments_all_seq)
+    return chain
+
+def merge_homomer_features(chain: Dict[str, ndarray], num_copies: int) -> Dict[str, ndarray]:
+    """merge_chain_features and process_final for `num_copies` copies of one chain (homomers
+    and monomers, whose MSA is not paired), built by tiling the features of the chain instead
+    of processing each copy and merging them"""
+    (chain,) = feature_processing.crop_chains(
+        [dict(chain)],
+        msa_crop_size=feature_processing.MSA_CROP_SIZE,
+        pair_msa_sequences=False,
+        max_templates=feature_processing.MAX_TEMPLATES,
+    )
+    num_res = chain["aatype"].shape[0]
+    # the MSA of the copies is concatenated along the residues, as in _merge_homomers_dense_msa
+    msa = np.take(residue_constants.MAP_HHBLITS_AATYPE_TO_OUR_AATYPE, chain["msa"], axis=0)
+    msa = np.tile(msa.astype(np.int32), (1, num_copies))
+    np_example = {
+        "msa": msa,
+        "deletion_matrix": np.tile(chain["deletion_matrix"], (1, num_copies)),
+        "msa_mask": np.ones(msa.shape, dtype=np.float32),
+        "bert_mask": np.ones(msa.shape, dtype=np.float32),
+        "cluster_bias_mask": np.zeros(msa.shape[0]),
+        "num_alignments": np.asarray(msa.shape[0], dtype=np.int32),
+        "seq_length": np.asarray(num_res * num_copies, dtype=np.int32),
+        # add_assembly_features and process_unmerged_features
+        "asym_id": np.repeat(np.arange(1, num_copies + 1, dtype=np.float64), num_res),
+        "sym_id": np.repeat(np.arange(1, num_copies + 1, dtype=np.float64), num_res),
+        "entity_id": np.ones(num_res * num_copies),
+        "entity_mask": np.ones(num_res * num_copies, dtype=np.int32),
+        "seq_mask": np.ones(num_res * num_copies, dtype=np.float32),
     }
+    np_example["cluster_bias_mask"][0] = 1
+    for feature_name in ["residue_index", "aatype", "all_atom_positions", "all_atom_mask", "deletion_mean"]:
+        feature = chain[feature_name]
+        np_example[feature_name] = np.tile(feature, (num_copies,) + (1,) * (feature.ndim - 1))
+    for feature_name in msa_pairing.TEMPLATE_FEATURES:
+        if feature_name in chain:
+            # _pad_templates
+            feature = chain[feature_name]
+            padding = [(0, feature_processing.MAX_TEMPLATES - feature.shape[0])] + [(0, 0)] * (feature.ndim - 1)
+            feature = np.pad(feature, padding, mode="constant")
+            np_example[feature_name] = np.tile(feature, (1, num_copies) + (1,) * (feature.ndim - 2))
+    for feature_name in ["num_templates", "assembly_num_chains"]:
+        if feature_name in chain:
+            np_example[feature_name] = chain[feature_name]
+    return np_example
 
 def process_multimer_features(
     features_for_chain: Dict[str, Dict[str, ndarray]],
     min_num_seq: int = 512,
 ) -> Dict[str, ndarray]:
+    # copies of a chain share their feature dict (see generate_input_feature), the features that
+    # do not depend on the copy are computed once and shared
+    processed = {}
     all_chain_features = {}
     for chain_id, chain_features in features_for_chain.items():
-        all_chain_features[chain_id] = pipeline_multimer.convert_monomer_features(
-            chain_features, chain_id
-        )
+        if id(chain_features) not in processed:
+            processed[id(chain_features)] = process_chain_features(
+                chain_features, chain_id, len(features_for_chain)
+            )
+        chain = dict(processed[id(chain_features)])
+        chain["auth_chain_id"] = np.asarray(chain_id, dtype=np.object_)
+        all_chain_features[chain_id] = chain
+
+    if len(processed) == 1:
+        (chain,) = processed.values()
+        np_example = merge_homomer_features(chain, len(features_for_chain))
+        # Pad MSA to avoid zero-sized extra_msa.
+        return pipeline_multimer.pad_msa(np_example, min_num_seq=min_num_seq)
 
     all_chain_features = pipeline_multimer.add_assembly_features(all_chain_features)
     # np_example = feature_processing.pair_and_merge(
     #    all_chain_features=all_chain_features, is_prokaryote=is_prokaryote)
-    feature_processing.process_unmerged_features(all_chain_features)
+    for chain in all_chain_features.values():
+        chain["entity_mask"] = (chain["entity_id"] != 0).astype(np.int32)
     np_chains_list = list(all_chain_features.values())
     # noinspection PyProtectedMember
     pair_msa_sequences = not feature_processing._is_homomer_or_monomer(np_chains_list)
-    chains = list(np_chains_list)
-    chain_keys = chains[0].keys()
-    updated_chains = []
-    for chain_num, chain in enumerate(chains):
-        new_chain = {k: v for k, v in chain.items() if "_all_seq" not in k}
-        for feature_name in chain_keys:
-            if feature_name.endswith("_all_seq"):
-                feats_padded = msa_pairing.pad_features(
-                    chain[feature_name], feature_name
-                )
-                new_chain[feature_name] = feats_padded
-        new_chain["num_alignments_all_seq"] = np.asarray(
-            len(np_chains_list[chain_num]["msa_all_seq"])
-        )
-        updated_chains.append(new_chain)
-    np_chains_list = updated_chains
     np_chains_list = feature_processing.crop_chains(
         np_chains_list,
         msa_crop_size=feature_processing.MSA_CROP_SIZE,
@@ -965,11 +1277,96 @@ def pair_msa(
         raise ValueError(f"Invalid pairing")
     return a3m_lines
 
+def complex_msa_features(
+    query_seqs_unique: List[str],
+    query_seqs_cardinality: List[int],
+    paired_msa: Optional[List[Union[str, BinaryMSA]]],
+    unpaired_msa: Optional[List[Union[str, BinaryMSA]]],
+) -> Dict[str, ndarray]:
+    """The MSA features of `>0\n{full sequence}\n` + pair_msa(...), the input of non-multimer
+    models for complexes. The paired and block diagonal (padded) rows are written into
+    preallocated arrays of the chain MSAs instead of being built and parsed as text."""
+    if paired_msa is None and unpaired_msa is None:
+        raise ValueError(f"Invalid pairing")
+
+    def to_binary(msas):
+        if msas is None:
+            return None
+        return [
+            msa if isinstance(msa, BinaryMSA) else BinaryMSA.from_a3m(msa)
+            for msa in msas[: len(query_seqs_unique)]
+        ]
+
+    paired, unpaired = to_binary(paired_msa), to_binary(unpaired_msa)
+    # one segment of columns per copy of each chain
+    segments = []
+    start = 0
+    for n, seq in enumerate(query_seqs_unique):
+        for _ in range(query_seqs_cardinality[n]):
+            segments.append((n, start, start + len(seq)))
+            start += len(seq)
+    full_sequence = "".join(query_seqs_unique[n] for n, _, _ in segments)
+    num_res = len(full_sequence)
+
+    num_paired = 0
+    if paired is not None:
+        num_paired = len(paired[0])
+        if any(len(msa) != num_paired for msa in paired):
+            raise ValueError("The paired MSAs of the chains have different numbers of rows")
+    num_rows = 1 + num_paired
+    if unpaired is not None:
+        num_rows += sum(len(unpaired[n]) for n, _, _ in segments)
+    gap = residue_constants.HHBLITS_AA_TO_ID["-"]
+    msa = np.full((num_rows, num_res), gap, dtype=np.int32)
+    deletion_matrix = np.zeros((num_rows, num_res), dtype=np.int32)
+    species = [np.array([b""], dtype=np.object_)]
+
+    msa[0] = BinaryMSA.from_a3m(f">0\n{full_sequence}\n").msa_features()["msa"][0]
+    row = 1
+    if paired is not None:
+        rows = slice(row, row + num_paired)
+        # insertions after the last column of a segment belong to the first column of the next
+        carry = np.zeros(num_paired, dtype=np.int32)
+        for n, start, end in segments:
+            features = paired[n].msa_features()
+            msa[rows, start:end] = features["msa"]
+            deletion_matrix[rows, start:end] = features["deletion_matrix_int"]
+            deletion_matrix[rows, start] += carry
+            carry = paired[n].deletions[:, -1]
+        # the header of a paired row joins the headers of all chains, its species is the one
+        # of the first chain with a header
+        paired_species = paired[0].species.astype(np.object_)
+        header_lengths = [np.diff(chain.header_offsets) for chain in paired]
+        for i in np.flatnonzero(header_lengths[0] == 0):
+            for chain, lengths in zip(paired[1:], header_lengths[1:]):
+                if lengths[i] > 0:
+                    paired_species[i] = bytes(chain.species[i])
+                    break
+        species.append(paired_species)
+        row += num_paired
+    if unpaired is not None:
+        for n, start, end in segments:
+            features = unpaired[n].msa_features()
+            rows = slice(row, row + len(unpaired[n]))
+            msa[rows, start:end] = features["msa"]
+            deletion_matrix[rows, start:end] = features["deletion_matrix_int"]
+            if end < num_res:
+                deletion_matrix[rows, end] = unpaired[n].deletions[:, -1]
+            species.append(unpaired[n].species.astype(np.object_))
+            row += len(unpaired[n])
+
+    return {
+        "deletion_matrix_int": deletion_matrix,
+        "msa": msa,
+        "num_alignments": np.array([num_rows] * num_res, dtype=np.int32),
+        "msa_species_identifiers": np.concatenate(species),
+    }
+
 def generate_input_feature(
     query_seqs_unique: List[str],
     query_seqs_cardinality: List[int],
-    unpaired_msa: List[str],
-    paired_msa: List[str],
+    unpaired_msa: Optional[List[Union[str, BinaryMSA]]],
+    paired_msa: Optional[List[Union[str, BinaryMSA]]],
     template_features: List[Dict[str, Any]],
     is_complex: bool,
     model_type: str,
@@ -987,11 +1384,14 @@ def generate_input_feature(
                 full_sequence += sequence
                 Ls.append(len(sequence))
 
-        # bugfix
-        a3m_lines = f">0\n{full_sequence}\n"
-        a3m_lines += pair_msa(query_seqs_unique, query_seqs_cardinality, paired_msa, unpaired_msa)
-
-        input_feature = build_monomer_feature(full_sequence, a3m_lines, mk_mock_template(full_sequence))
+        # same as build_monomer_feature with `>0\n{full_sequence}\n` + pair_msa(...) as MSA
+        input_feature = {
+            **pipeline.make_sequence_features(
+                sequence=full_sequence, description="none", num_res=len(full_sequence)
+            ),
+            **complex_msa_features(query_seqs_unique, query_seqs_cardinality, paired_msa, unpaired_msa),
+            **mk_mock_template(full_sequence),
+        }
         input_feature["residue_index"] = np.concatenate([np.arange(L) for L in Ls])
         input_feature["asym_id"] = np.concatenate([np.full(L,n) for n,L in enumerate(Ls)])
         if any(
@@ -1056,15 +1456,99 @@ def generate_input_feature(
             }
     return (input_feature, domain_names)
 
+def split_msa_row(seq: str, query_seq_len: List[int]) -> Tuple[List[str], List[bool]]:
+    """Splits a row of a serialized MSA into its chains by the number of match columns
+    (uppercase and gaps) of each chain. Insertions (lowercase) belong to the following chain."""
+    has_amino_acid = [False] * len(query_seq_len)
+    seqs_line = []
+    prev_pos = 0
+    for n, query_len in enumerate(query_seq_len):
+        paired_seq = ""
+        curr_seq_len = 0
+        for pos in range(prev_pos, len(seq)):
+            if curr_seq_len == query_len:
+                prev_pos = pos
+                break
+            paired_seq += seq[pos]
+            if seq[pos].islower():
+                continue
+            if seq[pos] != "-":
+                has_amino_acid[n] = True
+            curr_seq_len += 1
+        seqs_line.append(paired_seq)
+    return seqs_line, has_amino_acid
+
+
+def split_msa_rows(
+    seqs: List[str], query_seq_len: List[int]
+) -> Tuple[List[List[str]], np.ndarray]:
+    """split_msa_row for all rows at once. The chain boundaries are found with a cumulative
+    count of match columns over the concatenated rows instead of a loop per character.
+
+    Returns the chains of each row and a (rows, chains) mask of chains with an amino acid."""
+    has_amino_acid = np.zeros((len(seqs), len(query_seq_len)), dtype=bool)
+    text = "".join(seqs)
+    if not text.isascii():
+        # str.islower has to decide, the byte masks below only know a-z
+        chains = []
+        for i, seq in enumerate(seqs):
+            seqs_line, has_amino_acid[i] = split_msa_row(seq, query_seq_len)
+            chains.append(seqs_line)
+        return chains, has_amino_acid
+
+    buf = np.frombuffer(text.encode(), dtype=np.uint8)
+    is_match = (buf < ord("a")) | (buf > ord("z"))
+    is_amino_acid = is_match & (buf != ord("-"))
+    # number of match columns/amino acids before each position
+    matches = np.concatenate([[0], np.cumsum(is_match)])
+    amino_acids = np.concatenate([[0], np.cumsum(is_amino_acid)])
+    row_end = np.cumsum([len(seq) for seq in seqs], dtype=np.int64)
+    row_start = row_end - np.array([len(seq) for seq in seqs], dtype=np.int64)
+
+    # chain n ends after the match column that completes the first n+1 chains
+    targets = matches[row_start][:, None] + np.cumsum(query_seq_len)[None, :]
+    bounds = np.searchsorted(matches, targets, side="left")
+    starts = np.empty_like(bounds)
+    ends = np.empty_like(bounds)
+    start = row_start
+    for n in range(len(query_seq_len)):
+        # empty chains end where they start
+        end = np.maximum(bounds[:, n], start)
+        starts[:, n] = start
+        ends[:, n] = np.minimum(end, row_end)
+        start = ends[:, n]
+    has_amino_acid[:] = amino_acids[ends] > amino_acids[starts]
+    # all but the last chain have to end before the end of the row, otherwise the row is
+    # truncated and split_msa_row restarts the next chain at the start of the current one
+    regular = (np.maximum(bounds[:, :-1], starts[:, :-1]) < row_end[:, None]).all(axis=1)
+
+    chains = []
+    for i, (seq, chain_starts, chain_ends) in enumerate(
+        zip(seqs, starts.tolist(), ends.tolist())
+    ):
+        if regular[i]:
+            chains.append([text[s:e] for s, e in zip(chain_starts, chain_ends)])
+        else:
+            seqs_line, has_amino_acid[i] = split_msa_row(seq, query_seq_len)
+            chains.append(seqs_line)
+    return chains, has_amino_acid
+
+
 def unserialize_msa(
-    a3m_lines: List[str], query_sequence: Union[List[str], str]
+    a3m_lines: Union[List[str], A3MPath, Path], query_sequence: Union[List[str], str]
 ) -> Tuple[
-    Optional[List[str]],
-    Optional[List[str]],
+    Optional[List[Union[str, BinaryMSA]]],
+    Optional[List[Union[str, BinaryMSA]]],
     List[str],
     List[int],
     List[Dict[str, Any]],
 ]:
+    if isinstance(a3m_lines, Path):
+        # a binary MSA container, see colabfold.msa_container
+        return load_msa_container(a3m_lines)
+    if isinstance(a3m_lines, A3MPath):
+        # an a3m file of an input directory
+        a3m_lines = [read_text(a3m_lines.path)]
     a3m_lines = a3m_lines[0].replace("\x00", "").splitlines()
     if not a3m_lines[0].startswith("#") or len(a3m_lines[0][1:].split("\t")) != 2:
         assert isinstance(query_sequence, str)
@@ -1097,49 +1581,30 @@ def unserialize_msa(
             a3m_lines[2][prev_query_start : prev_query_start + query_len]
         )
         prev_query_start += query_len
-    paired_msa = [""] * len(query_seq_len)
-    unpaired_msa = [""] * len(query_seq_len)
-    already_in = dict()
-    for i in range(1, len(a3m_lines), 2):
-        header = a3m_lines[i]
-        seq = a3m_lines[i + 1]
-        if (header, seq) in already_in:
-            continue
-        already_in[(header, seq)] = 1
-        has_amino_acid = [False] * len(query_seq_len)
-        seqs_line = []
-        prev_pos = 0
-        for n, query_len in enumerate(query_seq_len):
-            paired_seq = ""
-            curr_seq_len = 0
-            for pos in range(prev_pos, len(seq)):
-                if curr_seq_len == query_len:
-                    prev_pos = pos
-                    break
-                paired_seq += seq[pos]
-                if seq[pos].islower():
-                    continue
-                if seq[pos] != "-":
-                    has_amino_acid[n] = True
-                curr_seq_len += 1
-            seqs_line.append(paired_seq)
-
+    # rows are deduplicated by header and sequence
+    rows = dict.fromkeys(
+        (a3m_lines[i], a3m_lines[i + 1]) for i in range(1, len(a3m_lines), 2)
+    )
+    headers = [header for header, _ in rows]
+    chains, has_amino_acid = split_msa_rows([seq for _, seq in rows], query_seq_len)
+    # at least 2 sequences are paired
+    is_paired = has_amino_acid.sum(axis=1) > 1
+    paired_msa = [[] for _ in query_seq_len]
+    unpaired_msa = [[] for _ in query_seq_len]
+    for header, seqs_line, has_aa, paired in zip(
+        headers, chains, has_amino_acid.tolist(), is_paired.tolist()
+    ):
         # if sequence is paired add them to output
-        if (
-            not is_single_protein
-            and not is_homooligomer
-            and sum(has_amino_acid) > 1 # at least 2 sequences are paired
-        ):
-            header_no_faster = header.replace(">", "")
-            header_no_faster_split = header_no_faster.split("\t")
+        if not is_single_protein and not is_homooligomer and paired:
+            header_no_faster_split = header.replace(">", "").split("\t")
             for j in range(0, len(seqs_line)):
-                paired_msa[j] += ">" + header_no_faster_split[j] + "\n"
-                paired_msa[j] += seqs_line[j] + "\n"
+                paired_msa[j].append(f">{header_no_faster_split[j]}\n{seqs_line[j]}\n")
         else:
             for j, seq in enumerate(seqs_line):
-                if has_amino_acid[j]:
-                    unpaired_msa[j] += header + "\n"
-                    unpaired_msa[j] += seq + "\n"
+                if has_aa[j]:
+                    unpaired_msa[j].append(f"{header}\n{seq}\n")
+    paired_msa = ["".join(msa) for msa in paired_msa]
+    unpaired_msa = ["".join(msa) for msa in unpaired_msa]
     if is_homooligomer:
         # homooligomers
         num = 101
@@ -1225,6 +1690,76 @@ def put_mmciffiles_into_resultdir(
                     print(f"WARNING: {pdb_id} does not exist in {local_pdb_path}.")
 
 
+def msa_hash_value(msa: MSA) -> Union[str, Dict[str, np.ndarray]]:
+    """What identifies an MSA in a cache key, the arrays of binary MSAs"""
+    if isinstance(msa, BinaryMSA):
+        return {name: getattr(msa, name) for name in MSA_ARRAYS}
+    return msa
+
+
+def featurize_job(
+    item: Tuple[Any, Optional[Tuple]],
+    is_complex: bool,
+    model_type: str,
+    max_seq: int,
+    result_dir: Path,
+    dpi: int,
+    shared: Optional[Path] = None,
+    feature_cache: Optional[FeatureCache] = None,
+    msa_filter: Optional[MSAFilter] = None,
+) -> Optional[Tuple[Dict[str, Any], Dict[str, List[str]]]]:
+    """Input features and MSA coverage plot of a job, None if it has no MSA. With a shared
+    directory, the large arrays of the features are returned in shared memory there."""
+    from colabfold.plot import plot_msa_v2
+
+    (job, msa_and_templates) = item
+    if msa_and_templates is None:
+        return None
+    (_, jobname, _, _) = job
+    (unpaired_msa, paired_msa, query_seqs_unique, query_seqs_cardinality, template_features) = msa_and_templates
+    unpaired_msa = load_shared_msas(unpaired_msa)
+    paired_msa = load_shared_msas(paired_msa)
+    cached = key = None
+    if feature_cache is not None:
+        key = feature_cache.key(
+            None if unpaired_msa is None else [msa_hash_value(msa) for msa in unpaired_msa],
+            None if paired_msa is None else [msa_hash_value(msa) for msa in paired_msa],
+            query_seqs_unique, query_seqs_cardinality, template_features, is_complex, model_type, max_seq,
+            msa_filter,
+        )
+        cached = feature_cache.get_features(key)
+    if cached is not None:
+        (feature_dict, domain_names) = cached
+        logger.info(f"Loaded the input features of {jobname} from the feature cache")
+    else:
+        if msa_filter is not None and unpaired_msa is not None:
+            unpaired_msa = [
+                msa if isinstance(msa, BinaryMSA) else BinaryMSA.from_a3m(msa) for msa in unpaired_msa
+            ]
+            num_rows = sum(len(msa) for msa in unpaired_msa)
+            unpaired_msa = msa_filter.apply(unpaired_msa)
+            logger.info(
+                f"Filtered the unpaired MSA of {jobname} from {num_rows} "
+                f"to {sum(len(msa) for msa in unpaired_msa)} rows"
+            )
+        (feature_dict, domain_names) = generate_input_feature(
+            query_seqs_unique, query_seqs_cardinality, unpaired_msa, paired_msa,
+            template_features, is_complex, model_type, max_seq=max_seq
+        )
+        if feature_cache is not None:
+            feature_cache.put_features(key, feature_dict, domain_names)
+
+    # make msa plot
+    msa_plot = plot_msa_v2(feature_dict, dpi=dpi)
+    coverage_png = result_dir.joinpath(f"{jobname}_coverage.png")
+    msa_plot.savefig(str(coverage_png), bbox_inches='tight')
+    msa_plot.close()
+
+    if shared is not None:
+        feature_dict = share_arrays(feature_dict, shared)
+    return feature_dict, domain_names
+
+
 def run(
     queries: List[Tuple[str, Union[str, List[str]], Optional[List[str]]]],
     result_dir: Union[str, Path],
@@ -1270,6 +1805,23 @@ def run(
     local_pdb_path: Optional[Path] = None,
     use_cluster_profile: bool = True,
     feature_dict_callback: Callable[[Any], Any] = None,
+    msa_prefetch: int = 0,
+    msa_cache_dir: Optional[Union[str, Path]] = None,
+    msa_cache_size: float = 10,
+    msa_db_version: str = "",
+    msa_rate_limit: Optional[float] = None,
+    msa_ticket_timeout: Optional[float] = None,
+    feature_workers: int = 0,
+    feature_cache_dir: Optional[Union[str, Path]] = None,
+    feature_cache_size: float = 10,
+    msa_min_coverage: float = 0.0,
+    msa_min_identity: float = 0.0,
+    msa_max_seq_id: float = 1.0,
+    msa_max_rows: Optional[int] = None,
+    plan_padding: bool = False,
+    compilation_cache_dir: Optional[Union[str, Path]] = None,
+    multi_device: bool = False,
+    pad_msa_rows: bool = False,
     **kwargs
 ):
     # check what device is available
@@ -1387,6 +1939,21 @@ def run(
         "pair_mode": pair_mode,
         "pairing_strategy": pairing_strategy,
         "host_url": host_url,
+        "msa_prefetch": msa_prefetch,
+        "msa_cache_dir": str(msa_cache_dir) if msa_cache_dir else None,
+        "msa_db_version": msa_db_version,
+        "msa_rate_limit": msa_rate_limit,
+        "msa_ticket_timeout": msa_ticket_timeout,
+        "feature_workers": feature_workers,
+        "feature_cache_dir": str(feature_cache_dir) if feature_cache_dir else None,
+        "msa_min_coverage": msa_min_coverage,
+        "msa_min_identity": msa_min_identity,
+        "msa_max_seq_id": msa_max_seq_id,
+        "msa_max_rows": msa_max_rows,
+        "plan_padding": plan_padding,
+        "compilation_cache_dir": str(compilation_cache_dir) if compilation_cache_dir else None,
+        "multi_device": multi_device,
+        "pad_msa_rows": pad_msa_rows,
         "user_agent": user_agent,
         "stop_at_score": stop_at_score,
         "random_seed": random_seed,
@@ -1419,10 +1986,30 @@ def run(
     if custom_template_path is not None:
         mk_hhsearch_db(custom_template_path)
 
+    # compiled models of earlier runs, by model config and padded length
+    compilation_cache_stats = None
+    if compilation_cache_dir is not None and num_models > 0:
+        compilation_cache_stats = enable_compilation_cache(compilation_cache_dir)
+
+    # the models and seeds of a query are predicted on all local devices at once
+    device_pool = DevicePool() if multi_device and num_models > 0 else None
+
+    # lengths to pad to, planned for all queries or grown with recompile_padding
+    query_lengths = [len("".join(query_sequence)) for _, query_sequence, _ in queries]
+    bucket_plan = None
+    if num_models > 0 and plan_padding:
+        bucket_plan = plan_length_buckets(query_lengths, num_models * num_seeds)
+        greedy_plan = evaluate_plan(
+            query_lengths, greedy_pad_lengths(query_lengths, recompile_padding), num_models * num_seeds
+        )
+        logger.info(f"Padding plan: {bucket_plan.describe()}")
+        logger.info(f"(--recompile-padding would need {greedy_plan.describe()})")
+
     pad_len = 0
     ranks, metrics = [],[]
     first_job = True
     job_number = 0
+    jobs = []
     for job_number, (raw_jobname, query_sequence, a3m_lines) in enumerate(queries):
         if jobname_prefix is not None:
             # pad job number based on number of queries
@@ -1446,221 +2033,308 @@ def run(
             logger.info(f"Skipping {jobname} (already done)")
             continue
 
-        seq_len = len("".join(query_sequence))
-        logger.info(f"Query {job_number + 1}/{len(queries)}: {jobname} (length {seq_len})")
+        jobs.append((job_number, jobname, query_sequence, a3m_lines))
+
+    ###########################################
+    # generate MSA (a3m_lines) and templates
+    ###########################################
+    # MSAs and template hits by sequence, shared across jobs and runs
+    msa_cache = None
+    if msa_cache_dir is not None:
+        # keyed by the database version, not by the server, so servers with the same databases
+        # share the entries and the order of the servers in host_url does not matter
+        msa_cache = MSACache(msa_cache_dir, int(msa_cache_size * 1024**3), db_version=msa_db_version)
+        if not msa_db_version:
+            logger.warning(
+                "No --msa-db-version given, cached MSAs are used even after the databases of the MSA server were updated"
+            )
 
-        ###########################################
-        # generate MSA (a3m_lines) and templates
-        ###########################################
-        try:
-            pickled_msa_and_templates = result_dir.joinpath(f"{jobname}.pickle")
-            if pickled_msa_and_templates.is_file():
-                with open(pickled_msa_and_templates, 'rb') as f:
-                    (unpaired_msa, paired_msa, query_seqs_unique, query_seqs_cardinality, template_features) = pickle.load(f)
-                logger.info(f"Loaded {pickled_msa_and_templates}")
+    # submissions per minute, shared by all processes on this host using the same server
+    rate_limiter = None
+    if msa_rate_limit is not None and "mmseqs2" in msa_mode:
+        rate_limit_file = Path(msa_cache_dir or data_dir).joinpath(f"rate_limit_{cache_key(host_url)[:16]}")
+        rate_limiter = RateLimiter(rate_limit_file, msa_rate_limit / 60)
+    if "mmseqs2" in msa_mode:
+        get_client(host_url, user_agent, rate_limiter=rate_limiter, ticket_timeout=msa_ticket_timeout)
+
+    def get_msa(job):
+        (_, jobname, query_sequence, a3m_lines) = job
+        msa_container = result_dir.joinpath(f"{jobname}{CONTAINER_SUFFIX}")
+        # written by older versions
+        pickled_msa_and_templates = result_dir.joinpath(f"{jobname}.pickle")
+        a3m_file = result_dir.joinpath(f"{jobname}.a3m")
+        loaded = True
+        if is_msa_container(msa_container):
+            (unpaired_msa, paired_msa, query_seqs_unique, query_seqs_cardinality, template_features) \
+            = load_msa_container(msa_container)
+            logger.info(f"Loaded {msa_container}")
+
+        elif pickled_msa_and_templates.is_file():
+            with open(pickled_msa_and_templates, 'rb') as f:
+                (unpaired_msa, paired_msa, query_seqs_unique, query_seqs_cardinality, template_features) = pickle.load(f)
+            logger.info(f"Loaded {pickled_msa_and_templates}")
 
-            else:
-                if a3m_lines is None:
-                    (unpaired_msa, paired_msa, query_seqs_unique, query_seqs_cardinality, template_features) \
-                    = get_msa_and_templates(jobname, query_sequence, a3m_lines, result_dir, msa_mode, use_templates,
-                        custom_template_path, pair_mode, pairing_strategy, host_url, user_agent)
-
-                elif a3m_lines is not None:
-                    (unpaired_msa, paired_msa, query_seqs_unique, query_seqs_cardinality, template_features) \
-                    = unserialize_msa(a3m_lines, query_sequence)
-                    if use_templates:
-                        (_, _, _, _, template_features) \
-                            = get_msa_and_templates(jobname, query_seqs_unique, unpaired_msa, result_dir, 'single_sequence', use_templates,
-                                custom_template_path, pair_mode, pairing_strategy, host_url, user_agent)
-
-                if num_models == 0:
-                    with open(pickled_msa_and_templates, 'wb') as f:
-                        pickle.dump((unpaired_msa, paired_msa, query_seqs_unique, query_seqs_cardinality, template_features), f)
-                    logger.info(f"Saved {pickled_msa_and_templates}")
-
-            # save a3m
-            msa = msa_to_str(unpaired_msa, paired_msa, query_seqs_unique, query_seqs_cardinality)
-            result_dir.joinpath(f"{jobname}.a3m").write_text(msa)
-
-        except Exception as e:
-            logger.exception(f"Could not get MSA/templates for {jobname}: {e}")
-            continue
+        else:
+            loaded = False
+            if a3m_lines is None:
+                (unpaired_msa, paired_msa, query_seqs_unique, query_seqs_cardinality, template_features) \
+                = get_msa_and_templates(jobname, query_sequence, a3m_lines, result_dir, msa_mode, use_templates,
+                    custom_template_path, pair_mode, pairing_strategy, host_url, user_agent, msa_cache)
+
+            elif a3m_lines is not None:
+                (unpaired_msa, paired_msa, query_seqs_unique, query_seqs_cardinality, template_features) \
+                = unserialize_msa(a3m_lines, query_sequence)
+                if use_templates:
+                    (_, _, _, _, template_features) \
+                        = get_msa_and_templates(jobname, query_seqs_unique, as_a3m(unpaired_msa), result_dir, 'single_sequence', use_templates,
+                            custom_template_path, pair_mode, pairing_strategy, host_url, user_agent, msa_cache)
+
+            if num_models == 0:
+                save_msa_container(msa_container, unpaired_msa, paired_msa, query_seqs_unique,
+                                   query_seqs_cardinality, template_features)
+                logger.info(f"Saved {msa_container}")
+
+        # save a3m, the a3m of a loaded MSA was written by the run that saved it
+        if not loaded or not a3m_file.is_file():
+            msa = msa_to_str(as_a3m(unpaired_msa), as_a3m(paired_msa), query_seqs_unique, query_seqs_cardinality)
+            a3m_file.write_text(msa)
+        return (unpaired_msa, paired_msa, query_seqs_unique, query_seqs_cardinality, template_features)
+
+    # fetch the MSAs of the next `msa_prefetch` jobs while the current one is predicted
+    msa_errors = {}
+
+    def ready_msas():
+        for job, msa_and_templates, error in prefetch(jobs, get_msa, msa_prefetch):
+            if error is not None:
+                msa_errors[job[1]] = error
+            if shared_dir is not None and msa_and_templates is not None:
+                (unpaired_msa, paired_msa, *rest) = msa_and_templates
+                msa_and_templates = (share_msas(unpaired_msa, shared_dir), share_msas(paired_msa, shared_dir), *rest)
+            yield job, msa_and_templates
+
+    # input features by MSA, templates and model configuration, shared across runs
+    feature_cache = None
+    if feature_cache_dir is not None:
+        feature_cache = FeatureCache(feature_cache_dir, int(feature_cache_size * 1024**3))
+
+    # reduces the unpaired MSAs before they are featurized
+    msa_filter = MSAFilter(msa_min_coverage, msa_min_identity, msa_max_seq_id, msa_max_rows)
+    if not msa_filter.is_active():
+        msa_filter = None
+
+    # the arrays passed to and from the feature workers, removed at the end of the run
+    shared_dir = None
+    if feature_workers > 0:
+        shared_dir = create_shared_dir()
+
+    # generate the features of the next `feature_workers` jobs in worker processes
+    featurize = partial(featurize_job, is_complex=is_complex, model_type=model_type, max_seq=max_seq,
+                        result_dir=result_dir, dpi=dpi, shared=shared_dir, feature_cache=feature_cache,
+                        msa_filter=msa_filter)
+    features = prefetch(ready_msas(), featurize, feature_workers, processes=True)
+    try:
+        for (job, msa_and_templates), features_and_domain_names, feature_error in features:
+            (job_number, jobname, query_sequence, _) = job
+            result_zip = result_dir.joinpath(jobname).with_suffix(".result.zip")
+            is_done_marker = result_dir.joinpath(jobname + ".done.txt")
 
-        #######################
-        # generate features
-        #######################
-        try:
-            (feature_dict, domain_names) \
-            = generate_input_feature(query_seqs_unique, query_seqs_cardinality, unpaired_msa, paired_msa,
-                                     template_features, is_complex, model_type, max_seq=max_seq)
+            seq_len = len("".join(query_sequence))
+            logger.info(f"Query {job_number + 1}/{len(queries)}: {jobname} (length {seq_len})")
 
-            # to allow display of MSA info during colab/chimera run (thanks tomgoddard)
-            if feature_dict_callback is not None:
-                feature_dict_callback(feature_dict)
+            error = msa_errors.pop(jobname, None)
+            if error is not None:
+                logger.error(f"Could not get MSA/templates for {jobname}: {error}", exc_info=error)
+                continue
+            (unpaired_msa, paired_msa, query_seqs_unique, query_seqs_cardinality, template_features) = msa_and_templates
 
-        except Exception as e:
-            logger.exception(f"Could not generate input features {jobname}: {e}")
-            continue
+            #######################
+            # generate features (and the msa plot)
+            #######################
+            try:
+                if feature_error is not None:
+                    raise feature_error
+                (feature_dict, domain_names) = features_and_domain_names
+                feature_dict = load_shared_arrays(feature_dict)
 
-        ###############
-        # save plots not requiring prediction
-        ###############
+                # to allow display of MSA info during colab/chimera run (thanks tomgoddard)
+                if feature_dict_callback is not None:
+                    feature_dict_callback(feature_dict)
 
-        result_files = []
+            except Exception as e:
+                logger.exception(f"Could not generate input features {jobname}: {e}")
+                continue
 
-        # make msa plot
-        msa_plot = plot_msa_v2(feature_dict, dpi=dpi)
-        coverage_png = result_dir.joinpath(f"{jobname}_coverage.png")
-        msa_plot.savefig(str(coverage_png), bbox_inches='tight')
-        msa_plot.close()
-        result_files.append(coverage_png)
+            ###############
+            # save plots not requiring prediction
+            ###############
 
-        if use_templates:
-            templates_file = result_dir.joinpath(f"{jobname}_template_domain_names.json")
-            templates_file.write_text(json.dumps(domain_names))
-            result_files.append(templates_file)
+            result_files = []
 
-        result_files.append(result_dir.joinpath(jobname + ".a3m"))
-        result_files += [bibtex_file, config_out_file]
+            coverage_png = result_dir.joinpath(f"{jobname}_coverage.png")
+            result_files.append(coverage_png)
 
-        ######################
-        # predict structures
-        ######################
-        if num_models > 0:
-            try:
-                # get list of lengths
-                query_sequence_len_array = sum([[len(x)] * y
-                    for x,y in zip(query_seqs_unique, query_seqs_cardinality)],[])
-
-                # decide how much to pad (to avoid recompiling)
-                if seq_len > pad_len:
-                    if isinstance(recompile_padding, float):
-                        pad_len = math.ceil(seq_len * recompile_padding)
-                    else:
-                        pad_len = seq_len + recompile_padding
-                    pad_len = min(pad_len, max_len)
-
-                # prep model and params
-                if first_job:
-                    # if one job input adjust max settings
-                    if len(queries) == 1 and msa_mode != "single_sequence":
-                        # get number of sequences
-                        if "msa_mask" in feature_dict:
-                            num_seqs = int(sum(feature_dict["msa_mask"].max(-1) == 1))
-                        else:
-                            num_seqs = int(len(feature_dict["msa"]))
+            if use_templates:
+                templates_file = result_dir.joinpath(f"{jobname}_template_domain_names.json")
+                templates_file.write_text(json.dumps(domain_names))
+                result_files.append(templates_file)
 
-                        if use_templates: num_seqs += 4
+            result_files.append(result_dir.joinpath(jobname + ".a3m"))
+            result_files += [bibtex_file, config_out_file]
 
-                        # adjust max settings
-                        max_seq = min(num_seqs, max_seq)
-                        max_extra_seq = max(min(num_seqs - max_seq, max_extra_seq), 1)
-                        logger.info(f"Setting max_seq={max_seq}, max_extra_seq={max_extra_seq}")
+            ######################
+            # predict structures
+            ######################
+            if num_models > 0:
+                try:
+                    # get list of lengths
+                    query_sequence_len_array = sum([[len(x)] * y
+                        for x,y in zip(query_seqs_unique, query_seqs_cardinality)],[])
+
+                    # decide how much to pad (to avoid recompiling)
+                    if bucket_plan is not None:
+                        pad_len = bucket_plan.pad_len(seq_len)
+                    elif seq_len > pad_len:
+                        if isinstance(recompile_padding, float):
+                            pad_len = math.ceil(seq_len * recompile_padding)
+                        else:
+                            pad_len = seq_len + recompile_padding
+                        pad_len = min(pad_len, max_len)
+
+                    # prep model and params
+                    if first_job:
+                        # if one job input adjust max settings
+                        if len(queries) == 1 and msa_mode != "single_sequence":
+                            # get number of sequences
+                            if "msa_mask" in feature_dict:
+                                num_seqs = int(sum(feature_dict["msa_mask"].max(-1) == 1))
+                            else:
+                                num_seqs = int(len(feature_dict["msa"]))
+
+                            if use_templates: num_seqs += 4
+
+                            # adjust max settings
+                            max_seq = min(num_seqs, max_seq)
+                            max_extra_seq = max(min(num_seqs - max_seq, max_extra_seq), 1)
+                            logger.info(f"Setting max_seq={max_seq}, max_extra_seq={max_extra_seq}")
+
+                        model_runner_and_params = load_models_and_params(
+                            num_models=num_models,
+                            use_templates=use_templates,
+                            num_recycles=num_recycles,
+                            num_ensemble=num_ensemble,
+                            model_order=model_order,
+                            model_type=model_type,
+                            data_dir=data_dir,
+                            stop_at_score=stop_at_score,
+                            rank_by=rank_by,
+                            use_dropout=use_dropout,
+                            max_seq=max_seq,
+                            max_extra_seq=max_extra_seq,
+                            use_cluster_profile=use_cluster_profile,
+                            recycle_early_stop_tolerance=recycle_early_stop_tolerance,
+                            use_fuse=use_fuse,
+                            use_bfloat16=use_bfloat16,
+                            save_all=save_all,
+                        )
+                        first_job = False
 
-                    model_runner_and_params = load_models_and_params(
-                        num_models=num_models,
+                    results = predict_structure(
+                        prefix=jobname,
+                        result_dir=result_dir,
+                        feature_dict=feature_dict,
+                        is_complex=is_complex,
                         use_templates=use_templates,
-                        num_recycles=num_recycles,
-                        num_ensemble=num_ensemble,
-                        model_order=model_order,
+                        sequences_lengths=query_sequence_len_array,
+                        pad_len=pad_len,
                         model_type=model_type,
-                        data_dir=data_dir,
-                        stop_at_score=stop_at_score,
+                        model_runner_and_params=model_runner_and_params,
+                        num_relax=num_relax,
+                        relax_max_iterations=relax_max_iterations,
+                        relax_tolerance=relax_tolerance,
+                        relax_stiffness=relax_stiffness,
+                        relax_max_outer_iterations=relax_max_outer_iterations,
                         rank_by=rank_by,
-                        use_dropout=use_dropout,
-                        max_seq=max_seq,
-                        max_extra_seq=max_extra_seq,
-                        use_cluster_profile=use_cluster_profile,
-                        recycle_early_stop_tolerance=recycle_early_stop_tolerance,
-                        use_fuse=use_fuse,
-                        use_bfloat16=use_bfloat16,
+                        stop_at_score=stop_at_score,
+                        prediction_callback=prediction_callback,
+                        use_gpu_relax=use_gpu_relax,
+                        random_seed=random_seed,
+                        num_seeds=num_seeds,
                         save_all=save_all,
+                        save_single_representations=save_single_representations,
+                        save_pair_representations=save_pair_representations,
+                        save_recycles=save_recycles,
+                        device_pool=device_pool,
+                        # the MSA rows are only padded along with the length
+                        pad_msa_rows=pad_msa_rows and (bucket_plan is not None or seq_len < pad_len),
                     )
-                    first_job = False
-
-                results = predict_structure(
-                    prefix=jobname,
-                    result_dir=result_dir,
-                    feature_dict=feature_dict,
-                    is_complex=is_complex,
-                    use_templates=use_templates,
-                    sequences_lengths=query_sequence_len_array,
-                    pad_len=pad_len,
-                    model_type=model_type,
-                    model_runner_and_params=model_runner_and_params,
-                    num_relax=num_relax,
-                    relax_max_iterations=relax_max_iterations,
-                    relax_tolerance=relax_tolerance,
-                    relax_stiffness=relax_stiffness,
-                    relax_max_outer_iterations=relax_max_outer_iterations,
-                    rank_by=rank_by,
-                    stop_at_score=stop_at_score,
-                    prediction_callback=prediction_callback,
-                    use_gpu_relax=use_gpu_relax,
-                    random_seed=random_seed,
-                    num_seeds=num_seeds,
-                    save_all=save_all,
-                    save_single_representations=save_single_representations,
-                    save_pair_representations=save_pair_representations,
-                    save_recycles=save_recycles,
-                )
-                result_files += results["result_files"]
-                ranks.append(results["rank"])
-                metrics.append(results["metric"])
-
-            except RuntimeError as e:
-                # This normally happens on OOM. TODO: Filter for the specific OOM error message
-                logger.error(f"Could not predict {jobname}. Not Enough GPU memory? {e}")
-                continue
+                    result_files += results["result_files"]
+                    ranks.append(results["rank"])
+                    metrics.append(results["metric"])
 
-            ###############
-            # save prediction plots
-            ###############
+                except RuntimeError as e:
+                    # This normally happens on OOM. TODO: Filter for the specific OOM error message
+                    logger.error(f"Could not predict {jobname}. Not Enough GPU memory? {e}")
+                    continue
 
-            # load the scores
-            scores = []
-            for r in results["rank"][:5]:
-                scores_file = result_dir.joinpath(f"{jobname}_scores_{r}.json")
-                with scores_file.open("r") as handle:
-                    scores.append(json.load(handle))
-
-            # write alphafold-db format (pAE)
-            if "pae" in scores[0]:
-                af_pae_file = result_dir.joinpath(f"{jobname}_predicted_aligned_error_v1.json")
-                af_pae_file.write_text(json.dumps({
-                    "predicted_aligned_error":scores[0]["pae"],
-                    "max_predicted_aligned_error":scores[0]["max_pae"]}))
-                result_files.append(af_pae_file)
-
-                # make pAE plots
-                paes_plot = plot_paes([np.asarray(x["pae"]) for x in scores],
+                ###############
+                # save prediction plots
+                ###############
+
+                # load the scores
+                scores = []
+                for r in results["rank"][:5]:
+                    scores_file = result_dir.joinpath(f"{jobname}_scores_{r}.json")
+                    with scores_file.open("r") as handle:
+                        scores.append(json.load(handle))
+
+                # write alphafold-db format (pAE)
+                if "pae" in scores[0]:
+                    af_pae_file = result_dir.joinpath(f"{jobname}_predicted_aligned_error_v1.json")
+                    af_pae_file.write_text(json.dumps({
+                        "predicted_aligned_error":scores[0]["pae"],
+                        "max_predicted_aligned_error":scores[0]["max_pae"]}))
+                    result_files.append(af_pae_file)
+
+                    # make pAE plots
+                    paes_plot = plot_paes([np.asarray(x["pae"]) for x in scores],
+                        Ls=query_sequence_len_array, dpi=dpi)
+                    pae_png = result_dir.joinpath(f"{jobname}_pae.png")
+                    paes_plot.savefig(str(pae_png), bbox_inches='tight')
+                    paes_plot.close()
+                    result_files.append(pae_png)
+
+                # make pLDDT plot
+                plddt_plot = plot_plddts([np.asarray(x["plddt"]) for x in scores],
                     Ls=query_sequence_len_array, dpi=dpi)
-                pae_png = result_dir.joinpath(f"{jobname}_pae.png")
-                paes_plot.savefig(str(pae_png), bbox_inches='tight')
-                paes_plot.close()
-                result_files.append(pae_png)
-
-            # make pLDDT plot
-            plddt_plot = plot_plddts([np.asarray(x["plddt"]) for x in scores],
-                Ls=query_sequence_len_array, dpi=dpi)
-            plddt_png = result_dir.joinpath(f"{jobname}_plddt.png")
-            plddt_plot.savefig(str(plddt_png), bbox_inches='tight')
-            plddt_plot.close()
-            result_files.append(plddt_png)
-
-        if zip_results:
-            with zipfile.ZipFile(result_zip, "w") as result_zip:
-                for file in result_files:
-                    result_zip.write(file, arcname=file.name)
+                plddt_png = result_dir.joinpath(f"{jobname}_plddt.png")
+                plddt_plot.savefig(str(plddt_png), bbox_inches='tight')
+                plddt_plot.close()
+                result_files.append(plddt_png)
 
-            # Delete only after the zip was successful, and also not the bibtex and config because we need those again
-            for file in result_files:
-                if file != bibtex_file and file != config_out_file:
-                    file.unlink()
-        else:
-            if num_models > 0:
-                is_done_marker.touch()
+            if zip_results:
+                with zipfile.ZipFile(result_zip, "w") as result_zip:
+                    for file in result_files:
+                        result_zip.write(file, arcname=file.name)
 
+                # Delete only after the zip was successful, and also not the bibtex and config because we need those again
+                for file in result_files:
+                    if file != bibtex_file and file != config_out_file:
+                        file.unlink()
+            else:
+                if num_models > 0:
+                    is_done_marker.touch()
+
+    finally:
+        # the workers finish before the shared arrays are removed
+        features.close()
+        if shared_dir is not None:
+            shutil.rmtree(shared_dir, ignore_errors=True)
+        if device_pool is not None:
+            device_pool.shutdown()
+        # the connections and threads of the MSA server clients of this run
+        close_clients()
+    if compilation_cache_stats is not None:
+        logger.info(f"Compilation cache: {compilation_cache_stats.summary()}")
     logger.info("Done")
     return {"rank":ranks,"metric":metrics}
 
@@ -1979,6 +2653,93 @@ def main():
         "--host-url",
         default=DEFAULT_API_SERVER,
         help="Which MSA server should be queried. By default, the free public MSA server hosted by the ColabFold team is queried. "
+        "Several servers can be given comma separated, tickets are then spread over them and failing servers are skipped.",
+    )
+    adv_group.add_argument(
+        "--msa-prefetch",
+        type=int,
+        default=0,
+        help="Number of upcoming queries for which MSAs and templates are fetched in the background "
+        "while the current query is predicted. Set to 0 to fetch each MSA just before its prediction.",
+    )
+    adv_group.add_argument(
+        "--msa-cache-dir",
+        type=Path,
+        default=None,
+        help="Directory for caching MSAs and template hits by sequence across jobs and runs. "
+        "The same directory can be shared by several colabfold_batch processes.",
+    )
+    adv_group.add_argument(
+        "--msa-cache-size",
+        type=float,
+        default=10,
+        help="Maximum size of the MSA cache in GB. The least recently used entries are removed first.",
+    )
+    adv_group.add_argument(
+        "--msa-db-version",
+        type=str,
+        default="",
+        help="Version of the databases of the MSA server (e.g. the date of its last update). Cached MSAs and "
+        "template hits are only used for the same version, change it when the server databases are updated.",
+    )
+    adv_group.add_argument(
+        "--msa-rate-limit",
+        type=float,
+        default=None,
+        help="Maximum number of MSA server submissions per minute, shared by all colabfold_batch processes "
+        "on this host (coordinated through a lock file in the MSA cache or data directory).",
+    )
+    adv_group.add_argument(
+        "--msa-ticket-timeout",
+        type=float,
+        default=None,
+        help="Give up an MSA server ticket (and the query) this many seconds after it was submitted, "
+        "instead of polling it until it finishes.",
+    )
+    adv_group.add_argument(
+        "--feature-workers",
+        type=int,
+        default=0,
+        help="Number of worker processes that generate the input features (and MSA plots) of upcoming "
+        "queries while the current query is predicted. Set to 0 to generate them just before each prediction.",
+    )
+    adv_group.add_argument(
+        "--feature-cache-dir",
+        default=None,
+        help="Directory to cache the input features in, keyed by the MSA, templates, model type and max-seq. "
+        "Reruns with the same MSAs (e.g. other seeds or recycles) skip the feature generation.",
+    )
+    adv_group.add_argument(
+        "--feature-cache-size",
+        type=float,
+        default=10,
+        help="Maximum size of the feature cache in GB. The least recently used entries are removed first.",
+    )
+    adv_group.add_argument(
+        "--msa-min-coverage",
+        type=float,
+        default=0.0,
+        help="Remove rows of the unpaired MSAs that cover less than this fraction of the query.",
+    )
+    adv_group.add_argument(
+        "--msa-min-identity",
+        type=float,
+        default=0.0,
+        help="Remove rows of the unpaired MSAs with less than this sequence identity to the query.",
+    )
+    adv_group.add_argument(
+        "--msa-max-seq-id",
+        type=float,
+        default=1.0,
+        help="Remove rows of the unpaired MSAs that are more similar than this to an earlier row "
+        "(like hhfilter -id, as a fraction). 1.0 keeps redundant rows.",
+    )
+    adv_group.add_argument(
+        "--msa-max-rows",
+        type=int,
+        default=None,
+        help="Keep at most this many rows of each unpaired MSA (after the other filters). "
+        "Filtering reduces memory and featurization time for very deep MSAs.",
     )
     adv_group.add_argument(
         "--disable-unified-memory",
@@ -1996,6 +2757,36 @@ def main():
         "but overall performance increases due to not recompiling. "
         "Set to 0 to disable.",
     )
+    adv_group.add_argument(
+        "--plan-padding",
+        default=False,
+        action="store_true",
+        help="Instead of --recompile-padding, choose the lengths to pad to from the lengths of all queries, "
+        "trading the (estimated) compile time of each length against the time spent on padding. "
+        "The plan is logged before the first prediction.",
+    )
+    adv_group.add_argument(
+        "--pad-msa-rows",
+        default=False,
+        action="store_true",
+        help="When the length of a complex is padded, also pad its MSA to a multiple of 512 rows, "
+        "so that complexes with different MSA sizes do not recompile the model. "
+        "The MSA sampling depends on the number of rows, so predictions can differ from unpadded ones with the same seed.",
+    )
+    adv_group.add_argument(
+        "--compilation-cache",
+        default=False,
+        action="store_true",
+        help="Keep the compiled models in {data}/xla_cache, so later runs skip compiling lengths "
+        "that were compiled before (GPU/TPU). Cache hits and the compile time saved are logged at the end.",
+    )
+    adv_group.add_argument(
+        "--multi-device",
+        default=False,
+        action="store_true",
+        help="Predict the models and seeds of each query on all local GPUs/TPUs at once, "
+        "with a copy of the params on each device. The results are ranked and written as with one device.",
+    )
 
     args = parser.parse_args()
 
@@ -2070,6 +2861,10 @@ def main():
         num_seeds=args.num_seeds,
         stop_at_score=args.stop_at_score,
         recompile_padding=args.recompile_padding,
+        plan_padding=args.plan_padding,
+        compilation_cache_dir=data_dir.joinpath("xla_cache") if args.compilation_cache else None,
+        multi_device=args.multi_device,
+        pad_msa_rows=args.pad_msa_rows,
         zip_results=args.zip,
         save_single_representations=args.save_single_representations,
         save_pair_representations=args.save_pair_representations,
@@ -2084,6 +2879,19 @@ def main():
         jobname_prefix=args.jobname_prefix,
         save_all=args.save_all,
         save_recycles=args.save_recycles,
+        msa_prefetch=args.msa_prefetch,
+        msa_cache_dir=args.msa_cache_dir,
+        msa_cache_size=args.msa_cache_size,
+        msa_db_version=args.msa_db_version,
+        msa_rate_limit=args.msa_rate_limit,
+        msa_ticket_timeout=args.msa_ticket_timeout,
+        feature_workers=args.feature_workers,
+        feature_cache_dir=args.feature_cache_dir,
+        feature_cache_size=args.feature_cache_size,
+        msa_min_coverage=args.msa_min_coverage,
+        msa_min_identity=args.msa_min_identity,
+        msa_max_seq_id=args.msa_max_seq_id,
+        msa_max_rows=args.msa_max_rows,
     )
 
 if __name__ == "__main__":
@@ -0,0 +1,285 @@
+"""
+Persistent on-disk caches shared across runs and processes.
+
+Entries are stored under `{cache_dir}/{key[:2]}/{key}`. Writes are atomic renames, so
+several processes can use the same cache directory. When the total size exceeds
+`max_size` bytes, the least recently used entries are evicted.
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import shutil
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# A3M blocks are stored without their query header (e.g. ">101"), so the same MSA can be
+# used for any position of the sequence in a job. This marks where the header has to be
+# put back.
+QUERY_HEADER = "\x01"
+
+
+def cache_key(*parts: str) -> str:
+    """sha1 over all parts, the same hash as colabfold.colabfold.get_hash"""
+    return hashlib.sha1("\n".join(parts).encode()).hexdigest()
+
+
+def entry_size(path: Path) -> int:
+    if path.is_dir():
+        return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+    return path.stat().st_size
+
+
+class DiskCache:
+    def __init__(self, cache_dir: Union[str, Path], max_size: int):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.size: Optional[int] = None
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        # caches are passed to worker processes, they get their own lock
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def path(self, key: str) -> Path:
+        return self.cache_dir.joinpath(key[:2], key)
+
+    def get_path(self, key: str) -> Optional[Path]:
+        """Returns the path of the entry and marks it as recently used"""
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self.get_path(key)
+        if path is None:
+            return None
+        try:
+            return path.read_bytes()
+        except FileNotFoundError:
+            # evicted by another process in the meantime
+            return None
+
+    def _tmp_path(self, key: str) -> Path:
+        path = self.path(key)
+        path.parent.mkdir(exist_ok=True)
+        return path.with_name(f".{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+    def put(self, key: str, data: bytes):
+        tmp = self._tmp_path(key)
+        tmp.write_bytes(data)
+        os.replace(tmp, self.path(key))
+        self._added(len(data))
+
+    def put_path(self, key: str, src: Union[str, Path]):
+        """Moves a file or a directory into the cache"""
+        src = Path(src)
+        size = entry_size(src)
+        tmp = self._tmp_path(key)
+        shutil.move(str(src), str(tmp))
+        try:
+            os.replace(tmp, self.path(key))
+        except OSError:
+            # a directory with the same key was added concurrently
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        self._added(size)
+
+    def _entries(self) -> List[Path]:
+        return [
+            entry
+            for shard in self.cache_dir.iterdir()
+            # other data can live next to the entries, e.g. the template store
+            if shard.is_dir() and len(shard.name) == 2
+            for entry in shard.iterdir()
+            if not entry.name.startswith(".")
+        ]
+
+    def _added(self, size: int):
+        with self.lock:
+            if self.size is None:
+                self.size = sum(entry_size(entry) for entry in self._entries())
+            else:
+                self.size += size
+            if self.size > self.max_size:
+                self.evict()
+
+    def evict(self):
+        """Removes least recently used entries until the cache is 10% below max_size"""
+        entries = []
+        for entry in self._entries():
+            try:
+                entries.append((entry.stat().st_mtime, entry_size(entry), entry))
+            except FileNotFoundError:
+                continue
+        entries.sort()
+        self.size = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, entry in entries:
+            if self.size <= 0.9 * self.max_size:
+                break
+            if entry.is_dir():
+                shutil.rmtree(entry, ignore_errors=True)
+            else:
+                entry.unlink(missing_ok=True)
+            self.size -= size
+            removed += 1
+        logger.info(f"Evicted {removed} entries from cache {self.cache_dir}")
+
+
+def split_a3m_blocks(a3m: str) -> List[str]:
+    """Splits null separated a3m text into blocks without their query headers"""
+    blocks = []
+    for block in a3m.split("\x00"):
+        if block.startswith(">"):
+            header, _, rest = block.partition("\n")
+            blocks.append(QUERY_HEADER + rest)
+        else:
+            blocks.append(block)
+    return blocks
+
+
+def join_a3m_blocks(blocks: Sequence[str], M: int, sep: str = "") -> str:
+    """Inverse of split_a3m_blocks, puts back `>{M}` as query header"""
+    return sep.join(
+        f">{M}\n{block[1:]}" if block.startswith(QUERY_HEADER) else block
+        for block in blocks
+    )
+
+
+class MSACache(DiskCache):
+    """Caches MSAs and template hits by the hash of the query sequence(s), the search
+    mode (including the pairing mode) and the database version.
+
+    kind is e.g. "a3m" for unpaired MSAs, "m8" for template hits or "pair{n}" for the
+    n-th chain of a paired MSA. Paired MSAs depend on all chains, so they are keyed by
+    all sequences."""
+
+    def __init__(
+        self, cache_dir: Union[str, Path], max_size: int, db_version: str = ""
+    ):
+        super().__init__(cache_dir, max_size)
+        self.db_version = db_version
+
+    def key(self, kind: str, mode: str, seqs: Sequence[str]) -> str:
+        return cache_key(kind, mode, self.db_version, *seqs)
+
+    def get_blocks(
+        self, kind: str, mode: str, seqs: Sequence[str]
+    ) -> Optional[List[str]]:
+        data = self.get(self.key(kind, mode, seqs))
+        if data is None:
+            return None
+        return data.decode().split("\x00")
+
+    def put_blocks(self, kind: str, mode: str, seqs: Sequence[str], blocks: List[str]):
+        self.put(self.key(kind, mode, seqs), "\x00".join(blocks).encode())
+
+    @property
+    def template_store_dir(self) -> Path:
+        """The colabfold.mmseqs.templates.TemplateStore of the cache"""
+        return self.cache_dir.joinpath("templates")
+
+    def _entries(self) -> List[Path]:
+        # the templates, template sets and unavailable markers of the template store are
+        # evicted with the MSAs, within the same max_size
+        entries = super()._entries()
+        if self.template_store_dir.is_dir():
+            entries += [
+                entry
+                for kind in self.template_store_dir.iterdir()
+                if kind.is_dir()
+                for entry in kind.iterdir()
+                if not entry.name.startswith(".")
+            ]
+        return entries
+
+
+def _hash_value(h, value: Any):
+    if isinstance(value, np.ndarray):
+        h.update(f"a{value.dtype}{value.shape}".encode())
+        if value.dtype.kind == "O":
+            _hash_value(h, value.tolist())
+        else:
+            h.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, str):
+        h.update(f"s{len(value)}:".encode() + value.encode())
+    elif isinstance(value, bytes):
+        h.update(f"b{len(value)}:".encode() + value)
+    elif isinstance(value, dict):
+        h.update(f"d{len(value)}".encode())
+        for key in sorted(value):
+            _hash_value(h, key)
+            _hash_value(h, value[key])
+    elif isinstance(value, (list, tuple)):
+        h.update(f"l{len(value)}".encode())
+        for item in value:
+            _hash_value(h, item)
+    else:
+        h.update(f"r{value!r}".encode())
+
+
+def value_key(*parts: Any) -> str:
+    """sha1 over nested lists, dicts, strings and arrays"""
+    h = hashlib.sha1()
+    _hash_value(h, parts)
+    return h.hexdigest()
+
+
+class FeatureCache(DiskCache):
+    """Caches the input features (and template domain names) of generate_input_feature.
+
+    An entry is a directory with the numeric arrays as uncompressed .npy files, which
+    are memory mapped (copy on write) when loaded, and a pickle of all other
+    features."""
+
+    def key(self, *parts: Any) -> str:
+        return value_key("features", *parts)
+
+    def get_features(
+        self, key: str
+    ) -> Optional[Tuple[Dict[str, Any], Dict[str, List[str]]]]:
+        path = self.get_path(key)
+        if path is None:
+            return None
+        try:
+            with path.joinpath("other.pickle").open("rb") as f:
+                features, domain_names = pickle.load(f)
+            for file in path.glob("*.npy"):
+                features[file.stem] = np.load(file, mmap_mode="c")
+        except FileNotFoundError:
+            # evicted by another process in the meantime
+            return None
+        return features, domain_names
+
+    def put_features(
+        self, key: str, features: Dict[str, Any], domain_names: Dict[str, List[str]]
+    ):
+        tmp = self._tmp_path(key).with_suffix(".build")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir()
+        other = {}
+        for name, value in features.items():
+            if isinstance(value, np.ndarray) and value.dtype.kind in "biuf":
+                np.save(tmp.joinpath(f"{name}.npy"), value)
+            else:
+                other[name] = value
+        with tmp.joinpath("other.pickle").open("wb") as f:
+            pickle.dump((other, domain_names), f)
+        self.put_path(key, tmp)
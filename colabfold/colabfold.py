@@ -7,7 +7,6 @@
 import jax
 import requests
 import hashlib
-import tarfile
 import time
 import os
 from typing import Tuple, List
@@ -31,6 +30,12 @@ except:
 
 from string import ascii_uppercase,ascii_lowercase
 
+from colabfold.cache import MSACache, join_a3m_blocks
+from colabfold.mmseqs.client import (MMseqs2Client, SearchJob, get_client, extract_members,
+  index_a3m, read_a3m_blocks, TQDM_BAR_FORMAT)
+from colabfold.mmseqs.templates import TemplateStore
+from colabfold.utils import unique_sequences
+
 pymol_color_list = ["#33ff33","#00ffff","#ff33cc","#ffff00","#ff9999","#e5e5e5","#7f7fff","#ff7f00",
                     "#7fff7f","#199999","#ff007f","#ffdd5e","#8c3f99","#b2b2b2","#007fff","#c4b200",
                     "#8cb266","#00bfbf","#b27f7f","#fcd1a5","#ff7f7f","#ffbfdd","#7fffff","#ffff7f",
@@ -64,94 +69,15 @@ def clear_mem(device="gpu"):
 # call mmseqs2
 ##########################################
 
-TQDM_BAR_FORMAT = '{l_bar}{bar}| {n_fmt}/{total_fmt} [elapsed: {elapsed} remaining: {remaining}]'
-
 def run_mmseqs2(x, prefix, use_env=True, use_filter=True,
                 use_templates=False, filter=None, use_pairing=False, pairing_strategy="greedy",
                 host_url="https://api.colabfold.com",
-                user_agent: str = "") -> Tuple[List[str], List[str]]:
-  submission_endpoint = "ticket/pair" if use_pairing else "ticket/msa"
+                user_agent: str = "", client: MMseqs2Client = None,
+                cache: MSACache = None) -> Tuple[List[str], List[str]]:
 
-  headers = {}
-  if user_agent != "":
-    headers['User-Agent'] = user_agent
-  else:
-    logger.warning("No user agent specified. Please set a user agent (e.g., 'toolname/version contact@email') to help us debug in case of problems. This warning will become an error in the future.")
-
-  def submit(seqs, mode, N=101):
-    n, query = N, ""
-    for seq in seqs:
-      query += f">{n}\n{seq}\n"
-      n += 1
-
-    while True:
-      error_count = 0
-      try:
-        # https://requests.readthedocs.io/en/latest/user/advanced/#advanced
-        # "good practice to set connect timeouts to slightly larger than a multiple of 3"
-        res = requests.post(f'{host_url}/{submission_endpoint}', data={ 'q': query, 'mode': mode }, timeout=6.02, headers=headers)
-      except requests.exceptions.Timeout:
-        logger.warning("Timeout while submitting to MSA server. Retrying...")
-        continue
-      except Exception as e:
-        error_count += 1
-        logger.warning(f"Error while fetching result from MSA server. Retrying... ({error_count}/5)")
-        logger.warning(f"Error: {e}")
-        time.sleep(5)
-        if error_count > 5:
-          raise
-        continue
-      break
-
-    try:
-      out = res.json()
-    except ValueError:
-      logger.error(f"Server didn't reply with json: {res.text}")
-      out = {"status":"ERROR"}
-    return out
-
-  def status(ID):
-    while True:
-      error_count = 0
-      try:
-        res = requests.get(f'{host_url}/ticket/{ID}', timeout=6.02, headers=headers)
-      except requests.exceptions.Timeout:
-        logger.warning("Timeout while fetching status from MSA server. Retrying...")
-        continue
-      except Exception as e:
-        error_count += 1
-        logger.warning(f"Error while fetching result from MSA server. Retrying... ({error_count}/5)")
-        logger.warning(f"Error: {e}")
-        time.sleep(5)
-        if error_count > 5:
-          raise
-        continue
-      break
-    try:
-      out = res.json()
-    except ValueError:
-      logger.error(f"Server didn't reply with json: {res.text}")
-      out = {"status":"ERROR"}
-    return out
-
-  def download(ID, path):
-    error_count = 0
-    while True:
-      try:
-        res = requests.get(f'{host_url}/result/download/{ID}', timeout=6.02, headers=headers)
-      except requests.exceptions.Timeout:
-        logger.warning("Timeout while fetching result from MSA server. Retrying...")
-        continue
-      except Exception as e:
-        error_count += 1
-        logger.warning(f"Error while fetching result from MSA server. Retrying... ({error_count}/5)")
-        logger.warning(f"Error: {e}")
-        time.sleep(5)
-        if error_count > 5:
-          raise
-        continue
-      break
-    with open(path,"wb") as out: out.write(res.content)
+  # all calls to the same server share one pooled client
+  if client is None:
+    client = get_client(host_url, user_agent)
 
   # process input x
   seqs = [x] if isinstance(x, str) else x
@@ -183,63 +109,11 @@ def run_mmseqs2(x, prefix, use_env=True, use_filter=True,
 
   # call mmseqs2 api
   tar_gz_file = f'{path}/out.tar.gz'
-  N,REDO = 101,True
+  N = 101
 
   # deduplicate and keep track of order
-  seqs_unique = []
-  #TODO this might be slow for large sets
-  [seqs_unique.append(x) for x in seqs if x not in seqs_unique]
-  Ms = [N + seqs_unique.index(seq) for seq in seqs]
-  # lets do it!
-  if not os.path.isfile(tar_gz_file):
-    TIME_ESTIMATE = 150 * len(seqs_unique)
-    with tqdm(total=TIME_ESTIMATE, bar_format=TQDM_BAR_FORMAT) as pbar:
-      while REDO:
-        pbar.set_description("SUBMIT")
-
-        # Resubmit job until it goes through
-        out = submit(seqs_unique, mode, N)
-        while out["status"] in ["UNKNOWN", "RATELIMIT"]:
-          sleep_time = 5 + random.randint(0, 5)
-          logger.error(f"Sleeping for {sleep_time}s. Reason: {out['status']}")
-          # resubmit
-          time.sleep(sleep_time)
-          out = submit(seqs_unique, mode, N)
-
-        if out["status"] == "ERROR":
-          raise Exception(f'MMseqs2 API is giving errors. Please confirm your input is a valid protein sequence. If error persists, please try again an hour later.')
-
-        if out["status"] == "MAINTENANCE":
-          raise Exception(f'MMseqs2 API is undergoing maintenance. Please try again in a few minutes.')
-
-        # wait for job to finish
-        ID,TIME = out["id"],0
-        pbar.set_description(out["status"])
-        while out["status"] in ["UNKNOWN","RUNNING","PENDING"]:
-          t = 5 + random.randint(0,5)
-          logger.error(f"Sleeping for {t}s. Reason: {out['status']}")
-          time.sleep(t)
-          out = status(ID)
-          pbar.set_description(out["status"])
-          if out["status"] == "RUNNING":
-            TIME += t
-            pbar.update(n=t)
-          #if TIME > 900 and out["status"] != "COMPLETE":
-          #  # something failed on the server side, need to resubmit
-          #  N += 1
-          #  break
-
-        if out["status"] == "COMPLETE":
-          if TIME < TIME_ESTIMATE:
-            pbar.update(n=(TIME_ESTIMATE-TIME))
-          REDO = False
-
-        if out["status"] == "ERROR":
-          REDO = False
-          raise Exception(f'MMseqs2 API is giving errors. Please confirm your input is a valid protein sequence. If error persists, please try again an hour later.')
-
-      # Download results
-      download(ID, tar_gz_file)
+  seqs_unique, seqs_index, _ = unique_sequences(seqs)
+  Ms = [N + i for i in seqs_index]
 
   # prep list of a3m files
   if use_pairing:
@@ -248,74 +122,98 @@ def run_mmseqs2(x, prefix, use_env=True, use_filter=True,
     a3m_files = [f"{path}/uniref.a3m"]
     if use_env: a3m_files.append(f"{path}/bfd.mgnify30.metaeuk30.smag30.a3m")
 
-  # extract a3m files
-  if any(not os.path.isfile(a3m_file) for a3m_file in a3m_files):
-    with tarfile.open(tar_gz_file) as tar_gz:
-      tar_gz.extractall(path)
+  # paired MSAs depend on all sequences of the job, unpaired MSAs only on one
+  if use_pairing:
+    cache_keys = {N + n: (f"pair{n}", seqs_unique) for n in range(len(seqs_unique))}
+  else:
+    cache_keys = {N + n: ("a3m", [seq]) for n, seq in enumerate(seqs_unique)}
+
+  # a3m blocks without query header and template hits without the M column by M
+  a3m_blocks, m8_rows = {}, {}
+  if cache is not None:
+    for M, (kind, key_seqs) in cache_keys.items():
+      blocks = cache.get_blocks(kind, mode, key_seqs)
+      rows = cache.get_blocks("m8", mode, key_seqs) if use_templates else []
+      if blocks is not None and rows is not None:
+        a3m_blocks[M], m8_rows[M] = blocks, [row for row in rows if row]
+    if use_pairing and len(a3m_blocks) < len(seqs_unique):
+      a3m_blocks, m8_rows = {}, {}
+    logger.info(f"Found {len(a3m_blocks)}/{len(seqs_unique)} {'paired' if use_pairing else 'unpaired'} MSAs in cache")
+
+  # only the a3m files and template hits are needed from the archive
+  members = [os.path.basename(a3m_file) for a3m_file in a3m_files]
+  if not use_pairing and (use_templates or cache is not None):
+    members.append("pdb70.m8")
+
+  def read_result(missing, extract):
+    # extract a3m files
+    if extract or any(not os.path.isfile(f"{path}/{member}") for member in members):
+      extract_members(tar_gz_file, path, members)
+    # gather a3m blocks of the missing queries by their offsets
+    result = {}
+    for a3m_file in a3m_files:
+      for M, blocks in read_a3m_blocks(a3m_file, index_a3m(a3m_file), missing).items():
+        result.setdefault(M, []).extend(blocks)
+    # templates
+    rows = {}
+    if "pdb70.m8" in members and os.path.isfile(f"{path}/pdb70.m8"):
+      for line in open(f"{path}/pdb70.m8", "r"):
+        p = line.rstrip().split(maxsplit=1)
+        if len(p) == 2:
+          rows.setdefault(int(p[0]), []).append(p[1])
+    for M in missing:
+      if M in result:
+        a3m_blocks[M], m8_rows[M] = result[M], rows.get(M, [])
+        if cache is not None:
+          kind, key_seqs = cache_keys[M]
+          cache.put_blocks(kind, mode, key_seqs, a3m_blocks[M])
+          if not use_pairing:
+            cache.put_blocks("m8", mode, key_seqs, m8_rows[M])
+
+  # a result of a previous run of this job
+  missing = [M for M in cache_keys if M not in a3m_blocks]
+  if missing and os.path.isfile(tar_gz_file):
+    read_result(missing, extract=False)
+    missing = [M for M in cache_keys if M not in a3m_blocks]
+    if missing:
+      os.remove(tar_gz_file)
+
+  # lets do it!
+  if missing:
+    search_job = SearchJob([seqs_unique[M - N] for M in missing], mode, use_pairing, tar_gz_file, N, ids=missing)
+    [job] = client.search([search_job])
+    if job.error is not None:
+      raise job.error
+    read_result(missing, extract=True)
 
   # templates
   if use_templates:
     templates = {}
     #print("seq\tpdb\tcid\tevalue")
-    for line in open(f"{path}/pdb70.m8","r"):
-      p = line.rstrip().split()
-      M,pdb,qid,e_value = p[0],p[1],p[2],p[10]
-      M = int(M)
-      if M not in templates: templates[M] = []
-      templates[M].append(pdb)
-      #if len(templates[M]) <= 20:
-      #  print(f"{int(M)-N}\t{pdb}\t{qid}\t{e_value}")
+    for M in cache_keys:
+      for row in m8_rows.get(M, []):
+        pdb = row.split()[0]
+        if M not in templates: templates[M] = []
+        templates[M].append(pdb)
+
+    # templates are stored once by PDB ID, shared across runs when caching
+    if cache is not None:
+      store = TemplateStore(cache.template_store_dir, on_added=cache._added)
+    else:
+      store = TemplateStore(f"{path}/templates")
+    # the links of a previous run can point into a template set that was evicted since
+    missing_templates = [TMPL[:20] for k,TMPL in templates.items() if not store.is_linked(f"{prefix}_{mode}/templates_{k}")]
+    store.fetch(client, [pdb for TMPL in missing_templates for pdb in TMPL])
 
     template_paths = {}
     for k,TMPL in templates.items():
       TMPL_PATH = f"{prefix}_{mode}/templates_{k}"
-      if not os.path.isdir(TMPL_PATH):
-        os.mkdir(TMPL_PATH)
-        TMPL_LINE = ",".join(TMPL[:20])
-        response = None
-        while True:
-          error_count = 0
-          try:
-            # https://requests.readthedocs.io/en/latest/user/advanced/#advanced
-            # "good practice to set connect timeouts to slightly larger than a multiple of 3"
-            response = requests.get(f"{host_url}/template/{TMPL_LINE}", stream=True, timeout=6.02, headers=headers)
-          except requests.exceptions.Timeout:
-            logger.warning("Timeout while submitting to template server. Retrying...")
-            continue
-          except Exception as e:
-            error_count += 1
-            logger.warning(f"Error while fetching result from template server. Retrying... ({error_count}/5)")
-            logger.warning(f"Error: {e}")
-            time.sleep(5)
-            if error_count > 5:
-              raise
-            continue
-          break
-        with tarfile.open(fileobj=response.raw, mode="r|gz") as tar:
-          tar.extractall(path=TMPL_PATH)
-        os.symlink("pdb70_a3m.ffindex", f"{TMPL_PATH}/pdb70_cs219.ffindex")
-        with open(f"{TMPL_PATH}/pdb70_cs219.ffdata", "w") as f:
-          f.write("")
+      store.link_set(TMPL[:20], TMPL_PATH)
       template_paths[k] = TMPL_PATH
 
-  # gather a3m lines
-  a3m_lines = {}
-  for a3m_file in a3m_files:
-    update_M,M = True,None
-    for line in open(a3m_file,"r"):
-      if len(line) > 0:
-        if "\x00" in line:
-          line = line.replace("\x00","")
-          update_M = True
-        if line.startswith(">") and update_M:
-          M = int(line[1:].rstrip())
-          update_M = False
-          if M not in a3m_lines: a3m_lines[M] = []
-        a3m_lines[M].append(line)
-
   # return results
 
-  a3m_lines = ["".join(a3m_lines[n]) for n in Ms]
+  a3m_lines = [join_a3m_blocks(a3m_blocks[n], n) for n in Ms]
 
   if use_templates:
     template_paths_ = []
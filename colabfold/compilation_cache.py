@@ -0,0 +1,84 @@
+"""Persistent cache of the compiled model, shared by all processes that use the same
+directory.
+
+This enables the persistent compilation cache of JAX. The cached executables are keyed
+by the hash of the lowered computation, which covers the model config and the (padded)
+input shapes, together with the compile options, the jax and jaxlib versions, the
+backend and the devices, so one directory can be shared by different versions, models
+and machines. JAX supports the cache on GPU and TPU (on CPU only with
+XLA_FLAGS=--xla_cpu_use_xla_runtime=true).
+"""
+
+import logging
+import threading
+from pathlib import Path
+from typing import Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# events of jax._src.monitoring
+CACHE_HIT_EVENT = "/jax/compilation_cache/cache_hits"
+CACHE_MISS_EVENT = "/jax/compilation_cache/cache_misses"
+COMPILE_TIME_SAVED_EVENT = "/jax/compilation_cache/compile_time_saved_sec"
+BACKEND_COMPILE_EVENT = "/jax/core/compile/backend_compile_duration"
+
+
+class CompilationCacheStats:
+    """Counts the cache hits and misses of this process"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        # compiling, or loading from the cache on a hit
+        self.compile_seconds = 0.0
+        self.saved_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def record_event(self, event: str, **kwargs):
+        with self.lock:
+            if event == CACHE_HIT_EVENT:
+                self.hits += 1
+            elif event == CACHE_MISS_EVENT:
+                self.misses += 1
+
+    def record_duration(self, event: str, duration: float, **kwargs):
+        with self.lock:
+            if event == BACKEND_COMPILE_EVENT:
+                self.compile_seconds += duration
+            elif event == COMPILE_TIME_SAVED_EVENT:
+                self.saved_seconds += duration
+
+    def summary(self) -> str:
+        return (
+            f"{self.hits} hits, {self.misses} misses, "
+            f"{self.compile_seconds:.1f}s compiling, "
+            f"{max(self.saved_seconds, 0.0):.1f}s compile time saved"
+        )
+
+
+_stats: Optional[CompilationCacheStats] = None
+
+
+def enable_compilation_cache(
+    cache_dir: Union[str, Path], min_compile_time_secs: float = 1.0
+) -> CompilationCacheStats:
+    """Caches every computation that takes at least min_compile_time_secs to compile in
+    cache_dir. Call this before the first computation is compiled."""
+    global _stats
+    import jax
+    from jax._src import compilation_cache, monitoring
+
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    jax.config.update("jax_compilation_cache_dir", str(cache_dir))
+    jax.config.update(
+        "jax_persistent_cache_min_compile_time_secs", min_compile_time_secs
+    )
+    # the cache is set up on the first compilation, which might have happened before
+    compilation_cache.reset_cache()
+    if _stats is None:
+        _stats = CompilationCacheStats()
+        monitoring.register_event_listener(_stats.record_event)
+        monitoring.register_event_duration_secs_listener(_stats.record_duration)
+    logger.info(f"Using the compilation cache in {cache_dir}")
+    return _stats
@@ -0,0 +1,156 @@
+"""Plans the lengths that queries are padded to, so that the model is compiled for a
+few lengths.
+
+Every new input length means a new XLA compilation, padding to a longer length makes
+each prediction slower. Instead of growing the padded length greedily while the (sorted)
+queries are predicted (--recompile-padding), the planner looks at all lengths up front
+and picks the bucket lengths that minimize the estimated compile time plus prediction
+time:
+
+    cost = sum over buckets b of compile_seconds(b)
+         + sum over queries q of predictions_per_query * prediction_seconds(bucket of q)
+
+The optimal buckets are found by dynamic programming over the sorted distinct lengths, a
+bucket always ends at a query length, so nothing is padded beyond the longest query. The
+default estimates are rough numbers for a single modern GPU, only their ratio matters
+for the plan.
+"""
+
+import bisect
+import math
+from collections import Counter
+from typing import Callable, Iterable, List, NamedTuple, Union
+
+import numpy as np
+
+
+def estimated_compile_seconds(length: np.ndarray) -> np.ndarray:
+    """Estimated time to compile the model for an input length"""
+    return 30 + 0.05 * np.asarray(length, dtype=np.float64)
+
+
+def estimated_prediction_seconds(length: np.ndarray) -> np.ndarray:
+    """Estimated time of one prediction (one model and seed) of the given length, the
+    pair representation is quadratic and the triangle updates are cubic in the length"""
+    length = np.asarray(length, dtype=np.float64)
+    return 2e-5 * length**2 + 1e-7 * length**3
+
+
+class BucketPlan(NamedTuple):
+    buckets: List[int]
+    # estimated prediction time of the padded over the unpadded lengths, minus one
+    padding_overhead: float
+    estimated_seconds: float
+
+    @property
+    def compiles(self) -> int:
+        return len(self.buckets)
+
+    def pad_len(self, length: int) -> int:
+        """The bucket of a query, the shortest bucket that is at least as long"""
+        index = bisect.bisect_left(self.buckets, length)
+        if index == len(self.buckets):
+            raise ValueError(
+                f"Length {length} is longer than the longest bucket {self.buckets[-1]}"
+            )
+        return self.buckets[index]
+
+    def describe(self) -> str:
+        return (
+            f"{self.compiles} length buckets {self.buckets}, "
+            f"{self.padding_overhead:.1%} padding overhead, estimated "
+            f"{self.estimated_seconds / 60:.1f} min"
+        )
+
+
+def evaluate_plan(
+    lengths: Iterable[int],
+    pad_lengths: Iterable[int],
+    predictions_per_query: int = 1,
+    compile_seconds: Callable[[np.ndarray], np.ndarray] = estimated_compile_seconds,
+    prediction_seconds: Callable[
+        [np.ndarray], np.ndarray
+    ] = estimated_prediction_seconds,
+) -> BucketPlan:
+    """The plan of the given padded length of each query"""
+    lengths = np.asarray(list(lengths))
+    pad_lengths = np.asarray(list(pad_lengths))
+    buckets = sorted(set(pad_lengths.tolist()))
+    unpadded = predictions_per_query * prediction_seconds(lengths).sum()
+    padded = predictions_per_query * prediction_seconds(pad_lengths).sum()
+    return BucketPlan(
+        buckets=buckets,
+        padding_overhead=float(padded / unpadded - 1) if unpadded > 0 else 0.0,
+        estimated_seconds=float(compile_seconds(np.asarray(buckets)).sum() + padded),
+    )
+
+
+def greedy_pad_lengths(
+    lengths: Iterable[int], recompile_padding: Union[int, float]
+) -> List[int]:
+    """The padded lengths of --recompile-padding, for queries in the given order"""
+    lengths = list(lengths)
+    max_len = max(lengths, default=0)
+    pad_len = 0
+    pad_lengths = []
+    for length in lengths:
+        if length > pad_len:
+            if isinstance(recompile_padding, float):
+                pad_len = math.ceil(length * recompile_padding)
+            else:
+                pad_len = length + recompile_padding
+            pad_len = min(pad_len, max_len)
+        pad_lengths.append(pad_len if length < pad_len else length)
+    return pad_lengths
+
+
+def plan_length_buckets(
+    lengths: Iterable[int],
+    predictions_per_query: int = 1,
+    compile_seconds: Callable[[np.ndarray], np.ndarray] = estimated_compile_seconds,
+    prediction_seconds: Callable[
+        [np.ndarray], np.ndarray
+    ] = estimated_prediction_seconds,
+) -> BucketPlan:
+    """Bucket lengths with the minimal estimated compile plus prediction time"""
+    counts = Counter(lengths)
+    if not counts:
+        return BucketPlan([], 0.0, 0.0)
+    distinct = np.array(sorted(counts))
+    # queries up to (excluding) each distinct length
+    queries_before = np.concatenate(
+        [[0], np.cumsum([counts[length] for length in distinct])]
+    )
+    compile_cost = compile_seconds(distinct)
+    prediction_cost = predictions_per_query * prediction_seconds(distinct)
+
+    # best[j]: minimal cost of the queries shorter than distinct[j], with a bucket
+    # ending at distinct[j - 1]. The bucket of distinct[i:j + 1] costs compile_cost[j] +
+    # prediction_cost[j] * (queries_before[j + 1] - queries_before[i])
+    best = np.zeros(len(distinct) + 1)
+    start = np.zeros(len(distinct), dtype=np.int64)
+    for j in range(len(distinct)):
+        candidates = best[: j + 1] - prediction_cost[j] * queries_before[: j + 1]
+        start[j] = np.argmin(candidates)
+        best[j + 1] = (
+            candidates[start[j]]
+            + compile_cost[j]
+            + prediction_cost[j] * queries_before[j + 1]
+        )
+
+    buckets = []
+    j = len(distinct) - 1
+    while j >= 0:
+        buckets.append(int(distinct[j]))
+        j = start[j] - 1
+    buckets.reverse()
+
+    plan = BucketPlan(buckets, 0.0, 0.0)
+    all_lengths = [length for length, count in counts.items() for _ in range(count)]
+    return evaluate_plan(
+        all_lengths,
+        [plan.pad_len(length) for length in all_lengths],
+        predictions_per_query,
+        compile_seconds,
+        prediction_seconds,
+    )
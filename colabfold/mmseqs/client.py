@@ -0,0 +1,711 @@
+"""Client for the MSA server API (ticket/msa, ticket/pair, ticket/{id}, result/download
+and template).
+
+All requests of a client go through one pooled keep-alive session, so connections are
+reused across submits, status polls and downloads. Many tickets can be submitted, polled
+and downloaded concurrently with `MMseqs2Client.search`. The tickets of all searches of
+a client, e.g. of several threads using the client of `get_client`, are polled by one
+scheduler thread, on one schedule with the backoff of the client.
+
+`host_url` can also be a comma separated list of servers. Tickets are then spread over
+the servers with the fewest outstanding tickets and the lowest latency, and servers that
+fail repeatedly are skipped for a while, with their tickets resubmitted to the others.
+"""
+
+import atexit
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import mmap
+import os
+import random
+import tarfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
+
+from colabfold.cache import split_a3m_blocks
+from colabfold.mmseqs.rate_limit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+# https://requests.readthedocs.io/en/latest/user/advanced/#advanced
+# "good practice to set connect timeouts to slightly larger than a multiple of 3"
+REQUEST_TIMEOUT = 6.02
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+TQDM_BAR_FORMAT = (
+    "{l_bar}{bar}| {n_fmt}/{total_fmt} [elapsed: {elapsed} remaining: {remaining}]"
+)
+
+
+class SearchJob:
+    """One ticket: the unique query sequences, the server mode and the result path"""
+
+    def __init__(
+        self,
+        seqs: List[str],
+        mode: str,
+        use_pairing: bool,
+        tar_gz_file: Union[str, Path],
+        N: int = 101,
+        ids: Optional[List[int]] = None,
+    ):
+        self.seqs = seqs
+        self.mode = mode
+        self.use_pairing = use_pairing
+        self.tar_gz_file = Path(tar_gz_file)
+        self.N = N
+        # query headers, only the missing sequences of a job might be submitted
+        self.ids = ids if ids is not None else [N + n for n in range(len(seqs))]
+        self.ticket_id: Optional[str] = None
+        self.status = "UNKNOWN"
+        self.error: Optional[Exception] = None
+        # number of requests since the last status change, for the backoff
+        self.attempt = 0
+        self.retry_after: Optional[float] = None
+        self.deadline: Optional[float] = None
+        # ticket loaded from a previous run, not yet confirmed by the server
+        self.resumed = False
+        # the server the ticket was submitted to
+        self.endpoint: Optional[Endpoint] = None
+        # time.monotonic() of the first submit and when the result was downloaded
+        self.submitted: Optional[float] = None
+        self.finished: Optional[float] = None
+        # set when the result was downloaded or the ticket failed
+        self.done = threading.Event()
+
+    @property
+    def ticket_file(self) -> Path:
+        """The submitted ticket is stored next to the result, so a restarted run can
+        resume it"""
+        return self.tar_gz_file.with_name(self.tar_gz_file.name + ".ticket.json")
+
+    def query_hash(self) -> str:
+        query = "".join(f">{M}\n{seq}\n" for M, seq in zip(self.ids, self.seqs))
+        return hashlib.sha1(
+            f"{self.mode}\n{self.use_pairing}\n{query}".encode()
+        ).hexdigest()
+
+    def load_ticket(self) -> Optional[Dict[str, str]]:
+        try:
+            ticket = json.loads(self.ticket_file.read_text())
+        except (OSError, ValueError):
+            return None
+        if ticket.get("query_hash") != self.query_hash():
+            return None
+        return ticket
+
+    def save_ticket(self):
+        tmp_file = self.ticket_file.with_suffix(".tmp")
+        ticket = {
+            "id": self.ticket_id,
+            "host_url": self.endpoint.url,
+            "query_hash": self.query_hash(),
+        }
+        tmp_file.write_text(json.dumps(ticket))
+        os.replace(tmp_file, self.ticket_file)
+
+    def remove_ticket(self):
+        self.ticket_file.unlink(missing_ok=True)
+
+
+class Backoff:
+    """Exponentially growing delays with jitter between the submits/polls of a ticket.
+
+    A delay requested by the server (Retry-After) is always honoured."""
+
+    def __init__(
+        self,
+        initial: float = 5.0,
+        maximum: float = 30.0,
+        factor: float = 1.5,
+        jitter: float = 0.2,
+    ):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        delay = min(self.maximum, self.initial * self.factor**attempt)
+        delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+
+class EndpointUnavailable(Exception):
+    """The server of a ticket failed, while other servers are available"""
+
+
+class Endpoint:
+    """One MSA server of the pool, with its outstanding tickets, latency and health"""
+
+    # consecutive failures after which the server is skipped for `cooldown` seconds
+    max_failures = 3
+    cooldown = 60.0
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.outstanding = 0
+        self.latency: Optional[float] = None
+        self.failures = 0
+        self.unhealthy_until = 0.0
+
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.unhealthy_until
+
+    def succeeded(self, latency: float):
+        self.failures = 0
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency = 0.8 * self.latency + 0.2 * latency
+
+    def failed(self):
+        self.failures += 1
+        if self.failures >= self.max_failures:
+            self.mark_unhealthy()
+
+    def mark_unhealthy(self):
+        if self.healthy():
+            logger.warning(
+                f"MSA server {self.url} is unavailable, skipping it for "
+                f"{self.cooldown:.0f}s"
+            )
+        self.unhealthy_until = time.monotonic() + self.cooldown
+
+
+class MMseqs2Client:
+    # retries of a failed request, with the backoff in between
+    max_request_retries = 5
+
+    def __init__(
+        self,
+        host_url: Union[str, List[str]] = "https://api.colabfold.com",
+        user_agent: str = "",
+        max_workers: int = 8,
+        backoff: Optional[Backoff] = None,
+        ticket_timeout: Optional[float] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+    ):
+        """host_url: one server, or several as list or comma separated string
+        ticket_timeout: seconds after the first submit until a ticket is given up, no
+            limit if None
+        rate_limiter: limits the submits, e.g. shared by all processes on the host"""
+        self.host_url = host_url
+        self.rate_limiter = rate_limiter
+        urls = host_url.split(",") if isinstance(host_url, str) else host_url
+        self.endpoints = [Endpoint(url.strip()) for url in urls if url.strip()]
+        self.endpoints_lock = threading.Lock()
+        self.backoff = backoff if backoff is not None else Backoff()
+        self.ticket_timeout = ticket_timeout
+        self.headers = {}
+        if user_agent != "":
+            self.headers["User-Agent"] = user_agent
+        else:
+            logger.warning(
+                "No user agent specified. Please set a user agent (e.g., "
+                "'toolname/version contact@email') to help us debug in case of "
+                "problems. This warning will become an error in the future."
+            )
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=max(4, len(self.endpoints)), pool_maxsize=max_workers
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="mmseqs2-client"
+        )
+        # (time of next request, order, job) of the outstanding tickets of all searches,
+        # and the thread that requests them while there are any
+        self.schedule: List[Tuple[float, int, SearchJob]] = []
+        self.schedule_order = itertools.count()
+        self.schedule_changed = threading.Condition()
+        self.scheduler: Optional[threading.Thread] = None
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+    def __enter__(self) -> "MMseqs2Client":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def choose_endpoint(self, exclude: Optional[Endpoint] = None) -> Endpoint:
+        """The healthy server with the fewest outstanding tickets and lowest latency"""
+        with self.endpoints_lock:
+            candidates = [e for e in self.endpoints if e is not exclude and e.healthy()]
+            if not candidates:
+                candidates = [
+                    e for e in self.endpoints if e is not exclude
+                ] or self.endpoints
+            return min(candidates, key=lambda e: (e.outstanding, e.latency or 0.0))
+
+    def has_alternative(self, endpoint: Endpoint) -> bool:
+        return any(e is not endpoint and e.healthy() for e in self.endpoints)
+
+    def get_endpoint(self, url: str) -> Optional[Endpoint]:
+        return next((e for e in self.endpoints if e.url == url.rstrip("/")), None)
+
+    def _request(
+        self,
+        method: str,
+        path: str,
+        what: str,
+        endpoint: Optional[Endpoint] = None,
+        deadline: Optional[float] = None,
+        **kwargs,
+    ) -> requests.Response:
+        """Requests on tickets need their server (endpoint), all others go to any
+        server.
+
+        Failed requests are retried with the backoff of the client, but not beyond the
+        deadline (time.monotonic()) of a ticket. Timeouts and connection errors are
+        retried until then (without a deadline as long as it takes, like a network
+        outage), other errors at most `max_request_retries` times."""
+        error_count = 0
+        network_errors = (
+            requests.exceptions.Timeout,
+            requests.exceptions.ConnectionError,
+        )
+        while True:
+            server = endpoint if endpoint is not None else self.choose_endpoint()
+            start = time.monotonic()
+            try:
+                res = self.session.request(
+                    method,
+                    f"{server.url}/{path}",
+                    timeout=REQUEST_TIMEOUT,
+                    headers=self.headers,
+                    **kwargs,
+                )
+                server.succeeded(time.monotonic() - start)
+                return res
+            except Exception as e:
+                server.failed()
+                error_count += 1
+                if isinstance(e, network_errors):
+                    kind = (
+                        "Timeout"
+                        if isinstance(e, requests.exceptions.Timeout)
+                        else "Connection error"
+                    )
+                    logger.warning(f"{kind} while {what}. Retrying... ({error_count})")
+                else:
+                    logger.warning(
+                        f"Error while {what}. Retrying... "
+                        f"({error_count}/{self.max_request_retries})"
+                    )
+                    logger.warning(f"Error: {e}")
+                    if error_count > self.max_request_retries:
+                        raise
+                if (
+                    endpoint is not None
+                    and not endpoint.healthy()
+                    and self.has_alternative(endpoint)
+                ):
+                    raise EndpointUnavailable(
+                        f"MSA server {endpoint.url} is unavailable"
+                    )
+                delay = self.backoff.delay(error_count - 1)
+                if deadline is not None and time.monotonic() + delay > deadline:
+                    raise TimeoutError(
+                        f"Gave up {what}, the deadline of the ticket has passed"
+                    ) from e
+                time.sleep(delay)
+
+    @staticmethod
+    def _json(res: requests.Response) -> Dict[str, Any]:
+        try:
+            out = res.json()
+        except ValueError:
+            logger.error(f"Server didn't reply with json: {res.text}")
+            return {"status": "ERROR"}
+        # the server can ask us to wait, e.g. when rate limiting
+        try:
+            out["retry_after"] = float(res.headers["Retry-After"])
+        except (KeyError, ValueError):
+            pass
+        return out
+
+    def submit(
+        self,
+        seqs: List[str],
+        mode: str,
+        use_pairing: bool = False,
+        N: int = 101,
+        ids: Optional[List[int]] = None,
+        endpoint: Optional[Endpoint] = None,
+        deadline: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        if ids is None:
+            ids = [N + n for n in range(len(seqs))]
+        query = "".join(f">{M}\n{seq}\n" for M, seq in zip(ids, seqs))
+        res = self._request(
+            "POST",
+            "ticket/pair" if use_pairing else "ticket/msa",
+            "submitting to MSA server",
+            endpoint,
+            deadline,
+            data={"q": query, "mode": mode},
+        )
+        return self._json(res)
+
+    def status(
+        self,
+        ticket_id: str,
+        endpoint: Optional[Endpoint] = None,
+        deadline: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        res = self._request(
+            "GET",
+            f"ticket/{ticket_id}",
+            "fetching status from MSA server",
+            endpoint,
+            deadline,
+        )
+        return self._json(res)
+
+    def download(
+        self,
+        ticket_id: str,
+        path: Union[str, Path],
+        endpoint: Optional[Endpoint] = None,
+        deadline: Optional[float] = None,
+    ):
+        """Streams the result archive to disk, never leaving a partial file at path"""
+        res = self._request(
+            "GET",
+            f"result/download/{ticket_id}",
+            "fetching result from MSA server",
+            endpoint,
+            deadline,
+            stream=True,
+        )
+        tmp_path = f"{path}.tmp"
+        with res, open(tmp_path, "wb") as out:
+            for chunk in res.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                out.write(chunk)
+        os.replace(tmp_path, path)
+
+    def request_templates(self, pdb_ids: List[str]) -> requests.Response:
+        """Streams the mmCIF files and hhsearch database of the templates (tar.gz)"""
+        return self._request(
+            "GET",
+            f"template/{','.join(pdb_ids)}",
+            "fetching templates from template server",
+            stream=True,
+        )
+
+    def download_templates(self, pdb_ids: List[str], path: Union[str, Path]):
+        """Downloads the mmCIF files and the hhsearch database for the given templates
+        into path"""
+        with self.request_templates(pdb_ids) as response:
+            with tarfile.open(fileobj=response.raw, mode="r|gz") as tar:
+                tar.extractall(path=path)
+
+    @staticmethod
+    def _check_status(job: SearchJob, out: Dict[str, Any]):
+        job.status = out["status"]
+        if out["status"] == "ERROR":
+            raise Exception(
+                "MMseqs2 API is giving errors. Please confirm your input is a valid "
+                "protein sequence. If error persists, please try again an hour later."
+            )
+        if out["status"] == "MAINTENANCE":
+            raise Exception(
+                "MMseqs2 API is undergoing maintenance. Please try again in a few "
+                "minutes."
+            )
+
+    def _assign(self, job: SearchJob, endpoint: Optional[Endpoint]):
+        with self.endpoints_lock:
+            if job.endpoint is not None:
+                job.endpoint.outstanding -= 1
+            job.endpoint = endpoint
+            if endpoint is not None:
+                endpoint.outstanding += 1
+
+    def _step(self, job: SearchJob):
+        """Submits the ticket or polls its status"""
+        try:
+            if job.submitted is None:
+                job.submitted = time.monotonic()
+            if job.ticket_id is None:
+                if self.rate_limiter is not None:
+                    self.rate_limiter.acquire("submitting to MSA server")
+                self._assign(job, self.choose_endpoint(exclude=job.endpoint))
+                out = self.submit(
+                    job.seqs,
+                    job.mode,
+                    job.use_pairing,
+                    ids=job.ids,
+                    endpoint=job.endpoint,
+                    deadline=job.deadline,
+                )
+                if out["status"] not in ["UNKNOWN", "RATELIMIT"]:
+                    job.ticket_id = out.get("id")
+                    if job.ticket_id is not None:
+                        job.save_ticket()
+                    else:
+                        # e.g. ERROR or MAINTENANCE, there is no ticket to resume
+                        job.remove_ticket()
+            else:
+                out = self.status(job.ticket_id, job.endpoint, job.deadline)
+                if job.resumed and out["status"] in ["UNKNOWN", "ERROR"]:
+                    # the ticket of a previous run expired on the server
+                    logger.info(
+                        f"Ticket {job.ticket_id} of a previous run is gone, "
+                        "resubmitting"
+                    )
+                    out = {"status": "UNKNOWN"}
+                    job.ticket_id = None
+                elif out["status"] not in ["UNKNOWN", "RUNNING", "PENDING", "COMPLETE"]:
+                    # something failed on the server side, need to resubmit
+                    job.ticket_id = None
+                job.resumed = False
+            if out["status"] == "MAINTENANCE" and self.has_alternative(job.endpoint):
+                job.endpoint.mark_unhealthy()
+                raise EndpointUnavailable(
+                    f"MSA server {job.endpoint.url} is undergoing maintenance"
+                )
+            if out["status"] != job.status:
+                job.attempt = 0
+            job.retry_after = out.get("retry_after")
+            self._check_status(job, out)
+        except EndpointUnavailable as e:
+            # fail over, the ticket is submitted again to another server
+            logger.warning(f"{e}, resubmitting to another server")
+            job.ticket_id = None
+            job.status = "UNKNOWN"
+            job.attempt = 0
+            job.retry_after = None
+        except Exception as e:
+            job.error = e
+
+    def _run_schedule(self):
+        """Requests the due tickets of all searches until no ticket is outstanding"""
+        while True:
+            with self.schedule_changed:
+                while True:
+                    if not self.schedule:
+                        self.scheduler = None
+                        return
+                    now = time.monotonic()
+                    if self.schedule[0][0] <= now:
+                        break
+                    t = self.schedule[0][0] - now
+                    statuses = ",".join(
+                        sorted(set(job.status for _, _, job in self.schedule))
+                    )
+                    logger.error(f"Sleeping for {t:.1f}s. Reason: {statuses}")
+                    # woken up early when another search adds its tickets
+                    self.schedule_changed.wait(t)
+                due = []
+                while self.schedule and self.schedule[0][0] <= now:
+                    due.append(heapq.heappop(self.schedule)[2])
+
+            try:
+                list(self.executor.map(self._step, due))
+            except Exception as e:
+                # the client was closed
+                for job in due:
+                    job.error = e
+                    job.done.set()
+                continue
+
+            now = time.monotonic()
+            later = []
+            for job in due:
+                if job.error is not None:
+                    job.done.set()
+                elif job.status == "COMPLETE":
+                    try:
+                        self.executor.submit(self._download_job, job)
+                    except RuntimeError as e:
+                        job.error = e
+                        job.done.set()
+                elif job.deadline is not None and now > job.deadline:
+                    job.error = TimeoutError(
+                        "MMseqs2 API did not finish the ticket in "
+                        f"{self.ticket_timeout}s. Last status: {job.status}"
+                    )
+                    job.done.set()
+                else:
+                    delay = self.backoff.delay(job.attempt, job.retry_after)
+                    job.attempt += 1
+                    later.append((now + delay, next(self.schedule_order), job))
+            with self.schedule_changed:
+                for entry in later:
+                    heapq.heappush(self.schedule, entry)
+
+    def search(self, jobs: List[SearchJob]) -> List[SearchJob]:
+        """Submits all jobs, polls the outstanding tickets and downloads finished
+        results.
+
+        Each ticket is polled on its own schedule with exponential backoff, so finished
+        tickets are picked up quickly and long running ones are polled less often. The
+        tickets of concurrent searches are requested by the same scheduler thread. A
+        failing ticket does not stop the others, its exception is stored in
+        `job.error`."""
+        time_estimate = 150 * sum(len(job.seqs) for job in jobs)
+
+        start = time.monotonic()
+        for job in jobs:
+            job.done = threading.Event()
+            ticket = job.load_ticket() if job.ticket_id is None else None
+            if (
+                ticket is not None
+                and self.get_endpoint(ticket.get("host_url", "")) is not None
+            ):
+                logger.info(f"Resuming ticket {ticket['id']} of a previous run")
+                job.ticket_id = ticket["id"]
+                job.resumed = True
+                self._assign(job, self.get_endpoint(ticket["host_url"]))
+            if self.ticket_timeout is not None:
+                job.deadline = start + self.ticket_timeout
+        with self.schedule_changed:
+            for job in jobs:
+                heapq.heappush(self.schedule, (start, next(self.schedule_order), job))
+            if self.scheduler is None:
+                self.scheduler = threading.Thread(
+                    target=self._run_schedule, name="mmseqs2-scheduler", daemon=True
+                )
+                self.scheduler.start()
+            self.schedule_changed.notify()
+
+        with tqdm(total=time_estimate, bar_format=TQDM_BAR_FORMAT) as pbar:
+            pbar.set_description("SUBMIT")
+            elapsed = 0
+            last = start
+            for job in jobs:
+                while not job.done.wait(1.0):
+                    now = time.monotonic()
+                    outstanding = [other for other in jobs if not other.done.is_set()]
+                    pbar.set_description(
+                        ",".join(sorted(set(other.status for other in outstanding)))
+                    )
+                    if any(other.status == "RUNNING" for other in outstanding):
+                        pbar.update(n=min(now - last, max(time_estimate - elapsed, 0)))
+                        elapsed += now - last
+                    last = time.monotonic()
+
+            for job in jobs:
+                self._assign(job, None)
+            if self.rate_limiter is not None and self.rate_limiter.waited > 0:
+                logger.info(
+                    f"Waited {self.rate_limiter.waited:.1f}s in total for the shared "
+                    "MSA submission rate limit"
+                )
+            if elapsed < time_estimate:
+                pbar.update(n=(time_estimate - elapsed))
+        return jobs
+
+    def _download_job(self, job: SearchJob):
+        try:
+            self.download(job.ticket_id, job.tar_gz_file, job.endpoint, job.deadline)
+            job.finished = time.monotonic()
+            job.remove_ticket()
+        except Exception as e:
+            job.error = e
+        finally:
+            job.done.set()
+
+
+def extract_members(
+    tar_gz_file: Union[str, Path], path: Union[str, Path], names: List[str]
+):
+    """Extracts only the given members, reading the archive as a stream"""
+    with tarfile.open(tar_gz_file, mode="r|gz") as tar:
+        for member in tar:
+            if os.path.normpath(member.name) in names:
+                tar.extract(member, path)
+
+
+def index_a3m(a3m_file: Union[str, Path]) -> Dict[int, List[Tuple[int, int]]]:
+    """Offsets and lengths of the null separated blocks of an a3m file by their query
+    header (`>101`, `>102`, ...). Blocks without header belong to the previous query."""
+    index, M = {}, None
+    with open(a3m_file, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return index
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = 0
+            while start < size:
+                end = mm.find(b"\x00", start)
+                if end == -1:
+                    end = size
+                if end > start:
+                    if mm[start : start + 1] == b">":
+                        header_end = mm.find(b"\n", start, end)
+                        M = int(mm[start + 1 : end if header_end == -1 else header_end])
+                    index.setdefault(M, []).append((start, end - start))
+                start = end + 1
+    return index
+
+
+def read_a3m_blocks(
+    a3m_file: Union[str, Path], index: Dict[int, List[Tuple[int, int]]], Ms: List[int]
+) -> Dict[int, List[str]]:
+    """Reads the blocks of the given queries, see colabfold.cache.split_a3m_blocks"""
+    blocks = {}
+    with open(a3m_file, "rb") as f:
+        for M in Ms:
+            for offset, length in index.get(M, []):
+                f.seek(offset)
+                blocks.setdefault(M, []).extend(
+                    split_a3m_blocks(f.read(length).decode())
+                )
+    return blocks
+
+
+_clients: Dict[Tuple[str, str], MMseqs2Client] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(
+    host_url: str,
+    user_agent: str = "",
+    rate_limiter: Optional[RateLimiter] = None,
+    ticket_timeout: Optional[float] = None,
+) -> MMseqs2Client:
+    """Returns a process-wide client per server, so all callers share one connection
+    pool.
+
+    If given, the rate limiter and the ticket timeout replace those of the client."""
+    with _clients_lock:
+        key = (host_url, user_agent)
+        if key not in _clients:
+            _clients[key] = MMseqs2Client(host_url, user_agent)
+        if rate_limiter is not None:
+            _clients[key].rate_limiter = rate_limiter
+        if ticket_timeout is not None:
+            _clients[key].ticket_timeout = ticket_timeout
+        return _clients[key]
+
+
+@atexit.register
+def close_clients():
+    """Closes the sessions and worker threads of the process-wide clients, the next
+    get_client creates a new client"""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
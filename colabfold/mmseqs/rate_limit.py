@@ -0,0 +1,79 @@
+"""Token bucket shared by all processes on a host, so parallel colabfold_batch workers
+together stay below the submission rate of an MSA server instead of running into
+RATELIMIT responses.
+
+The bucket state lives in a small file that is updated under an exclusive lock.
+"""
+
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Union
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    def __init__(self, path: Union[str, Path], rate: float, burst: int = 1):
+        """rate: tokens per second, burst: maximum number of tokens saved up"""
+        if fcntl is None:
+            raise RuntimeError(
+                "The shared rate limiter requires fcntl (Linux or macOS)"
+            )
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.rate = rate
+        self.burst = burst
+        # total time this process waited for tokens
+        self.waited = 0.0
+        self.lock = threading.Lock()
+
+    def _take(self) -> float:
+        """Takes a token if there is one and returns 0, otherwise the time until there
+        is one"""
+        with open(self.path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                now = time.time()
+                try:
+                    tokens, last = map(float, f.read().split())
+                except ValueError:
+                    tokens, last = float(self.burst), now
+                tokens = min(self.burst, tokens + max(now - last, 0) * self.rate)
+                wait = 0.0
+                if tokens >= 1:
+                    tokens -= 1
+                else:
+                    wait = (1 - tokens) / self.rate
+                f.seek(0)
+                f.truncate()
+                f.write(f"{tokens} {now}")
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return wait
+
+    def acquire(self, what: str = "submitting") -> float:
+        """Blocks until a token is available, returns the time waited"""
+        start = time.monotonic()
+        while True:
+            wait = self._take()
+            if wait == 0:
+                break
+            time.sleep(wait)
+        waited = time.monotonic() - start
+        with self.lock:
+            self.waited += waited
+        if waited >= 1:
+            logger.info(
+                f"Waited {waited:.1f}s for the shared rate limit before {what} "
+                f"({self.waited:.1f}s in total)"
+            )
+        return waited
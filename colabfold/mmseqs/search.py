@@ -11,10 +11,11 @@ import shutil
 import subprocess
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 from pathlib import Path
-from typing import List, Union
+from typing import List, Tuple, Union
 
 from colabfold.batch import get_queries, msa_to_str
-from colabfold.utils import safe_filename
+from colabfold.cache import MSACache, join_a3m_blocks, split_a3m_blocks
+from colabfold.utils import safe_filename, unique_sequences
 
 logger = logging.getLogger(__name__)
 
@@ -237,6 +238,147 @@ def mmseqs_search_pair(
     # @formatter:on
     # fmt: on
 
+def create_query_db(mmseqs: Path, base: Path, queries_unique: List[Tuple[str, List[str]]]):
+    """Writes the query db, each job gets its own file number in qdb.lookup for pairing"""
+    query_file = base.joinpath("query.fas")
+    with query_file.open("w") as f:
+        for raw_jobname, query_sequences in queries_unique:
+            for j, seq in enumerate(query_sequences):
+                # The header of first sequence set as 101
+                query_seq_headername = 101 + j
+                f.write(f">{query_seq_headername}\n{seq}\n")
+
+    run_mmseqs(
+        mmseqs,
+        ["createdb", query_file, base.joinpath("qdb"), "--shuffle", "0"],
+    )
+    with base.joinpath("qdb.lookup").open("w") as f:
+        id = 0
+        file_number = 0
+        for raw_jobname, query_sequences in queries_unique:
+            for seq in query_sequences:
+                raw_jobname_first = raw_jobname.split()[0]
+                f.write(f"{id}\t{raw_jobname_first}\t{file_number}\n")
+                id += 1
+            file_number += 1
+
+
+def remove_query_db(mmseqs: Path, base: Path):
+    base.joinpath("query.fas").unlink()
+    run_mmseqs(mmseqs, ["rmdb", base.joinpath("qdb")])
+    run_mmseqs(mmseqs, ["rmdb", base.joinpath("qdb_h")])
+
+
+def local_db_version(dbbase: Path, dbs: List[Path]) -> str:
+    """Identifies the database release by name and modification time"""
+    version = []
+    for db in dbs:
+        dbtype = dbbase.joinpath(f"{db}.dbtype")
+        if dbtype.is_file():
+            version.append(f"{db}@{int(dbtype.stat().st_mtime)}")
+    return ",".join(version)
+
+
+def search_cached(args, cache: MSACache, queries_unique: List, is_complex: bool):
+    """Like the search in main, but only searches sequences (and complexes for pairing)
+    that are not in the cache. Writes one a3m file per job."""
+    monomer_params = ["use_env", "filter", "expand_eval", "align_eval", "diff", "qsc", "max_accept", "prefilter_mode", "s"]
+    mode = "local:" + ",".join(f"{param}={getattr(args, param)}" for param in monomer_params)
+    pair_params = ["use_env_pairing", "pairing_strategy", "prefilter_mode", "s"]
+    pair_mode = "local-pair:" + ",".join(f"{param}={getattr(args, param)}" for param in pair_params)
+
+    seqs = list(dict.fromkeys(seq for _, query_sequences, _ in queries_unique for seq in query_sequences))
+    unpaired = {seq: cache.get_blocks("a3m", mode, [seq]) for seq in seqs}
+    missing = [seq for seq, blocks in unpaired.items() if blocks is None]
+    logger.info(f"Found {len(seqs) - len(missing)}/{len(seqs)} unpaired MSAs in cache")
+    if missing:
+        create_query_db(args.mmseqs, args.base, [(str(id), [seq]) for id, seq in enumerate(missing)])
+        mmseqs_search_monomer(
+            mmseqs=args.mmseqs,
+            dbbase=args.dbbase,
+            base=args.base,
+            uniref_db=args.db1,
+            template_db=args.db2,
+            metagenomic_db=args.db3,
+            use_env=args.use_env,
+            use_templates=False,
+            filter=args.filter,
+            expand_eval=args.expand_eval,
+            align_eval=args.align_eval,
+            diff=args.diff,
+            qsc=args.qsc,
+            max_accept=args.max_accept,
+            prefilter_mode=args.prefilter_mode,
+            s=args.s,
+            db_load_mode=args.db_load_mode,
+            threads=args.threads,
+        )
+        for id, seq in enumerate(missing):
+            a3m_file = args.base.joinpath(f"{id}.a3m")
+            unpaired[seq] = split_a3m_blocks(a3m_file.read_text())
+            cache.put_blocks("a3m", mode, [seq], unpaired[seq])
+            a3m_file.unlink()
+        remove_query_db(args.mmseqs, args.base)
+
+    # paired MSAs depend on all chains of a complex
+    paired = {}
+    if is_complex:
+        complexes = list(dict.fromkeys(
+            tuple(query_sequences)
+            for _, query_sequences, query_seqs_cardinality in queries_unique
+            if len(query_seqs_cardinality) > 1
+        ))
+        for query_sequences in complexes:
+            blocks = [cache.get_blocks(f"pair{j}", pair_mode, query_sequences) for j in range(len(query_sequences))]
+            if all(block is not None for block in blocks):
+                paired[query_sequences] = blocks
+        missing = [query_sequences for query_sequences in complexes if query_sequences not in paired]
+        logger.info(f"Found {len(complexes) - len(missing)}/{len(complexes)} paired MSAs in cache")
+        if missing:
+            create_query_db(args.mmseqs, args.base, [(str(id), list(query_sequences)) for id, query_sequences in enumerate(missing)])
+            for pair_env in [False, True] if args.use_env_pairing else [False]:
+                mmseqs_search_pair(
+                    mmseqs=args.mmseqs,
+                    dbbase=args.dbbase,
+                    base=args.base,
+                    uniref_db=args.db1,
+                    spire_db=args.db4,
+                    prefilter_mode=args.prefilter_mode,
+                    s=args.s,
+                    db_load_mode=args.db_load_mode,
+                    threads=args.threads,
+                    pairing_strategy=args.pairing_strategy,
+                    pair_env=pair_env,
+                )
+            id = 0
+            for query_sequences in missing:
+                paired[query_sequences] = []
+                for j in range(len(query_sequences)):
+                    a3m = ""
+                    for suffix in [".paired.a3m", ".env.paired.a3m"] if args.use_env_pairing else [".paired.a3m"]:
+                        a3m += args.base.joinpath(f"{id}{suffix}").read_text()
+                        args.base.joinpath(f"{id}{suffix}").unlink()
+                    blocks = split_a3m_blocks(a3m)
+                    cache.put_blocks(f"pair{j}", pair_mode, query_sequences, blocks)
+                    paired[query_sequences].append(blocks)
+                    id += 1
+            remove_query_db(args.mmseqs, args.base)
+
+    for raw_jobname, query_sequences, query_seqs_cardinality in queries_unique:
+        unpaired_msa = [join_a3m_blocks(unpaired[seq], 101 + j, "\x00") for j, seq in enumerate(query_sequences)]
+        if is_complex:
+            paired_msa = None
+            if len(query_seqs_cardinality) > 1:
+                paired_msa = [
+                    join_a3m_blocks(blocks, 101 + j, "\x00")
+                    for j, blocks in enumerate(paired[tuple(query_sequences)])
+                ]
+            msa = msa_to_str(unpaired_msa, paired_msa, query_sequences, query_seqs_cardinality)
+        else:
+            msa = unpaired_msa[0]
+        args.base.joinpath(f"{safe_filename(raw_jobname)}.a3m").write_text(msa)
+
+
 def main():
     parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
     parser.add_argument(
@@ -343,6 +485,18 @@ def main():
     parser.add_argument(
         "--threads", type=int, default=64, help="Number of threads to use."
     )
+    parser.add_argument(
+        "--msa-cache-dir",
+        type=Path,
+        default=None,
+        help="Directory for caching MSAs by sequence across runs, only sequences and complexes missing from it are searched.",
+    )
+    parser.add_argument(
+        "--msa-cache-size",
+        type=float,
+        default=10,
+        help="Maximum size of the MSA cache in GB. The least recently used entries are removed first.",
+    )
     args = parser.parse_args()
 
     logging.basicConfig(level = logging.INFO)
@@ -355,47 +509,26 @@ def main():
         query_sequences = (
             [query_sequences] if isinstance(query_sequences, str) else query_sequences
         )
-        query_seqs_unique = []
-        for x in query_sequences:
-            if x not in query_seqs_unique:
-                query_seqs_unique.append(x)
-        query_seqs_cardinality = [0] * len(query_seqs_unique)
-        for seq in query_sequences:
-            seq_idx = query_seqs_unique.index(seq)
-            query_seqs_cardinality[seq_idx] += 1
+        query_seqs_unique, _, query_seqs_cardinality = unique_sequences(query_sequences)
 
         queries_unique.append([raw_jobname, query_seqs_unique, query_seqs_cardinality])
 
     args.base.mkdir(exist_ok=True, parents=True)
-    query_file = args.base.joinpath("query.fas")
-    with query_file.open("w") as f:
-        for job_number, (
-            raw_jobname,
-            query_sequences,
-            query_seqs_cardinality,
-        ) in enumerate(queries_unique):
-            for j, seq in enumerate(query_sequences):
-                # The header of first sequence set as 101
-                query_seq_headername = 101 + j
-                f.write(f">{query_seq_headername}\n{seq}\n")
 
-    run_mmseqs(
+    if args.msa_cache_dir is not None:
+        if args.use_templates:
+            logger.warning("The MSA cache does not support --use-templates, searching all sequences")
+        else:
+            db_version = local_db_version(args.dbbase, [args.db1, args.db3, args.db4])
+            cache = MSACache(args.msa_cache_dir, int(args.msa_cache_size * 1024**3), db_version)
+            search_cached(args, cache, queries_unique, is_complex)
+            return
+
+    create_query_db(
         args.mmseqs,
-        ["createdb", query_file, args.base.joinpath("qdb"), "--shuffle", "0"],
+        args.base,
+        [(raw_jobname, query_sequences) for raw_jobname, query_sequences, _ in queries_unique],
     )
-    with args.base.joinpath("qdb.lookup").open("w") as f:
-        id = 0
-        file_number = 0
-        for job_number, (
-            raw_jobname,
-            query_sequences,
-            query_seqs_cardinality,
-        ) in enumerate(queries_unique):
-            for seq in query_sequences:
-                raw_jobname_first = raw_jobname.split()[0]
-                f.write(f"{id}\t{raw_jobname_first}\t{file_number}\n")
-                id += 1
-            file_number += 1
 
     mmseqs_search_monomer(
         mmseqs=args.mmseqs,
@@ -497,9 +630,7 @@ def main():
                     os.remove(args.base.joinpath(f"{id}.m8"))
                     id += 1
 
-    query_file.unlink()
-    run_mmseqs(args.mmseqs, ["rmdb", args.base.joinpath("qdb")])
-    run_mmseqs(args.mmseqs, ["rmdb", args.base.joinpath("qdb_h")])
+    remove_query_db(args.mmseqs, args.base)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,200 @@
+"""
+Local store for the templates of the MSA server (`template/{ids}` endpoint).
+
+mmCIF files and the hhsearch a3m entries are kept once per PDB ID, so a template that is
+a hit for many queries is downloaded and unpacked only once. The hhsearch database
+(pdb70_*) of a template set is built once per unique set of IDs, the `templates_{M}`
+directories of the queries only link to it. IDs that the server did not return are
+remembered for a day, so they are not requested again for every query.
+
+A store inside an MSA cache directory is evicted together with the MSAs (see MSACache),
+the template sets hard link their mmCIF files so that they stay usable when a file is
+evicted. The links of a query to an evicted set are rebuilt when the query is run again.
+"""
+
+import logging
+import os
+import shutil
+import tarfile
+import threading
+import time
+from pathlib import Path
+from typing import IO, Callable, List, Optional, Union
+
+from colabfold.cache import cache_key
+
+logger = logging.getLogger(__name__)
+
+# the server returns the templates for at most this many IDs per request
+TEMPLATE_BATCH_SIZE = 20
+# IDs that the server did not return are requested again after this many seconds
+UNAVAILABLE_RETRY_SECONDS = 24 * 60 * 60
+
+
+class TemplateStore:
+    def __init__(
+        self, root: Union[str, Path], on_added: Optional[Callable[[int], None]] = None
+    ):
+        """on_added: called with the bytes added to the store, e.g. DiskCache._added"""
+        self.root = Path(root)
+        self.on_added = on_added
+        self.mmcif_dir = self.root.joinpath("mmcif")
+        self.a3m_dir = self.root.joinpath("a3m")
+        self.sets_dir = self.root.joinpath("sets")
+        self.unavailable_dir = self.root.joinpath("unavailable")
+        for path in [self.mmcif_dir, self.a3m_dir, self.sets_dir, self.unavailable_dir]:
+            path.mkdir(parents=True, exist_ok=True)
+
+    def _added(self, size: int):
+        if self.on_added is not None:
+            self.on_added(size)
+
+    def _tmp_path(self, path: Path) -> Path:
+        return path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+    def _write(self, path: Path, data: bytes):
+        tmp = self._tmp_path(path)
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        self._added(len(data))
+
+    def is_unavailable(self, pdb_id: str) -> bool:
+        """The server did not return the template recently"""
+        try:
+            marked = self.unavailable_dir.joinpath(pdb_id).stat().st_mtime
+        except FileNotFoundError:
+            return False
+        return time.time() - marked < UNAVAILABLE_RETRY_SECONDS
+
+    def missing(self, pdb_ids: List[str]) -> List[str]:
+        """The IDs that are neither in the store nor known to be unavailable"""
+        return [
+            pdb_id
+            for pdb_id in dict.fromkeys(pdb_ids)
+            if not self.a3m_dir.joinpath(f"{pdb_id}.a3m").is_file()
+            and not self.is_unavailable(pdb_id)
+        ]
+
+    def add_archive(self, fileobj: IO[bytes]):
+        """Unpacks a template archive of the server from a stream into the store"""
+        ffdata, ffindex = b"", b""
+        with tarfile.open(fileobj=fileobj, mode="r|gz") as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                name = os.path.basename(member.name)
+                data = tar.extractfile(member).read()
+                if name.endswith(".cif"):
+                    self._write(self.mmcif_dir.joinpath(name), data)
+                elif name == "pdb70_a3m.ffdata":
+                    ffdata = data
+                elif name == "pdb70_a3m.ffindex":
+                    ffindex = data
+        for line in ffindex.decode().splitlines():
+            pdb_id, offset, length = line.split("\t")
+            entry = ffdata[int(offset) : int(offset) + int(length)]
+            self._write(self.a3m_dir.joinpath(f"{pdb_id}.a3m"), entry)
+
+    def fetch(self, client, pdb_ids: List[str]):
+        """Downloads the templates that are not in the store yet, concurrently"""
+        missing = self.missing(pdb_ids)
+        if not missing:
+            return
+        logger.info(f"Downloading {len(missing)} templates")
+        batches = [
+            missing[i : i + TEMPLATE_BATCH_SIZE]
+            for i in range(0, len(missing), TEMPLATE_BATCH_SIZE)
+        ]
+
+        def fetch_batch(batch: List[str]):
+            response = client.request_templates(batch)
+            with response:
+                self.add_archive(response.raw)
+
+        list(client.executor.map(fetch_batch, batches))
+
+        unavailable = self.missing(missing)
+        if unavailable:
+            logger.warning(
+                f"The template server did not return {len(unavailable)} templates: "
+                f"{' '.join(unavailable)}"
+            )
+            for pdb_id in unavailable:
+                self.unavailable_dir.joinpath(pdb_id).touch()
+
+    def template_set(self, pdb_ids: List[str]) -> Path:
+        """The hhsearch database and mmCIF files of the given templates, built once per
+        set.
+
+        Templates that are not in the store are left out, the set is stored under the
+        IDs it contains, so it is built again with all of them once they are
+        available."""
+        pdb_ids = sorted(set(pdb_ids))
+        available = [
+            pdb_id
+            for pdb_id in pdb_ids
+            if self.a3m_dir.joinpath(f"{pdb_id}.a3m").is_file()
+        ]
+        if len(available) < len(pdb_ids):
+            logger.warning(
+                "Templates not available: "
+                f"{' '.join(sorted(set(pdb_ids) - set(available)))}"
+            )
+        path = self.sets_dir.joinpath(cache_key(*available))
+        if path.is_dir():
+            # recently used, for the eviction
+            os.utime(path)
+            return path
+
+        tmp = self._tmp_path(path)
+        tmp.mkdir()
+        ffdata, ffindex, offset = [], [], 0
+        for pdb_id in available:
+            a3m_file = self.a3m_dir.joinpath(f"{pdb_id}.a3m")
+            entry = a3m_file.read_bytes()
+            os.utime(a3m_file)
+            ffdata.append(entry)
+            ffindex.append(f"{pdb_id}\t{offset}\t{len(entry)}\n")
+            offset += len(entry)
+            cif_file = self.mmcif_dir.joinpath(f"{pdb_id.split('_')[0]}.cif")
+            link = tmp.joinpath(cif_file.name)
+            if cif_file.is_file() and not link.exists():
+                try:
+                    os.link(cif_file, link)
+                except OSError:
+                    shutil.copyfile(cif_file, link)
+        tmp.joinpath("pdb70_a3m.ffdata").write_bytes(b"".join(ffdata))
+        tmp.joinpath("pdb70_a3m.ffindex").write_text("".join(ffindex))
+        os.symlink("pdb70_a3m.ffindex", tmp.joinpath("pdb70_cs219.ffindex"))
+        tmp.joinpath("pdb70_cs219.ffdata").write_text("")
+        size = sum(f.stat().st_size for f in tmp.iterdir() if not f.is_symlink())
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # built concurrently by another process
+            shutil.rmtree(tmp, ignore_errors=True)
+            return path
+        self._added(size)
+        return path
+
+    @staticmethod
+    def is_linked(target: Union[str, Path]) -> bool:
+        """The template directory of a query exists and none of its links points into an
+        evicted template set"""
+        target = Path(target)
+        return target.joinpath("pdb70_a3m.ffindex").exists() and all(
+            file.exists() for file in target.iterdir()
+        )
+
+    def link_set(self, pdb_ids: List[str], target: Union[str, Path]):
+        """Populates the template directory of a query with links to its template set,
+        the links are replaced if the set they point to was evicted"""
+        target = Path(target)
+        if self.is_linked(target):
+            return
+        if target.is_dir():
+            shutil.rmtree(target)
+        template_set = self.template_set(pdb_ids)
+        target.mkdir()
+        for file in template_set.iterdir():
+            os.symlink(file.absolute(), target.joinpath(file.name))
@@ -0,0 +1,303 @@
+"""
+Binary container for the MSAs and templates of a job, replacing the pickled A3M strings.
+
+A container is a directory (`{jobname}.msa`) with
+
+    meta.json                      query sequences, cardinalities and number of MSAs
+    {kind}_{n}.residues.npy        (rows, L) uint8, the match columns as ASCII
+                                   (uppercase and "-")
+    {kind}_{n}.deletions.npy       (rows, L + 1) int32, number of insertions before
+                                   each column, the last column counts the insertions
+                                   after the last column
+    {kind}_{n}.insertions.npy      uint8, the inserted (lowercase) residues of all rows
+    {kind}_{n}.headers.npy         uint8, the headers of all rows (without ">")
+    {kind}_{n}.header_offsets.npy  (rows + 1,) int64, start of each header in headers
+    {kind}_{n}.species.npy         (rows,) bytes, species identifiers of the headers
+    templates.pickle               the template features of each unique sequence
+
+where kind is "unpaired" or "paired" and n the index of the MSA. The arrays are opened
+with mmap_mode="r", so loading even a large MSA does not parse anything. The MSA
+features of AlphaFold are computed from the arrays directly, A3M text is only built when
+requested.
+"""
+
+import json
+import os
+import pickle
+import shutil
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from alphafold.common import residue_constants
+from alphafold.data import msa_identifiers, parsers
+
+CONTAINER_SUFFIX = ".msa"
+
+# ASCII code -> HHblits residue id, -1 for characters that are not allowed in an MSA
+HHBLITS_ID = np.full(256, -1, dtype=np.int32)
+for _residue, _id in residue_constants.HHBLITS_AA_TO_ID.items():
+    HHBLITS_ID[ord(_residue)] = _id
+
+LOWERCASE = bytes(range(ord("a"), ord("z") + 1))
+NOT_LOWERCASE = bytes(c for c in range(256) if c not in LOWERCASE)
+
+ARRAYS = ["residues", "deletions", "insertions", "headers", "header_offsets", "species"]
+
+
+def parse_fasta(a3m: str) -> Tuple[List[str], List[str]]:
+    """parsers.parse_fasta, without the loop when every sequence is on a single line"""
+    lines = [line for line in map(str.strip, a3m.splitlines()) if line]
+    headers = lines[::2]
+    if (
+        len(lines) % 2 == 0
+        and all(line.startswith(">") for line in headers)
+        and not any(line.startswith(">") for line in lines[1::2])
+    ):
+        return lines[1::2], [header[1:] for header in headers]
+    return parsers.parse_fasta(a3m)
+
+
+def species_id(description: str) -> bytes:
+    """msa_identifiers.get_identifiers(description).species_id, which only UniProtKB
+    identifiers (tr|...|... or sp|...|...) have"""
+    if not description.lstrip().startswith(("tr|", "sp|")):
+        return b""
+    return msa_identifiers.get_identifiers(description).species_id.encode()
+
+
+class BinaryMSA:
+    """One alignment (what an A3M file holds) as arrays"""
+
+    def __init__(
+        self,
+        residues: np.ndarray,
+        deletions: np.ndarray,
+        insertions: np.ndarray,
+        headers: np.ndarray,
+        header_offsets: np.ndarray,
+        species: np.ndarray,
+    ):
+        self.residues = residues
+        self.deletions = deletions
+        self.insertions = insertions
+        self.headers = headers
+        self.header_offsets = header_offsets
+        self.species = species
+
+    def __len__(self) -> int:
+        return self.residues.shape[0]
+
+    @classmethod
+    def from_a3m(cls, a3m: str) -> "BinaryMSA":
+        """Parses A3M text into arrays, with the rows and descriptions of
+        parsers.parse_a3m. The residues are separated from the insertions with
+        bytes.translate and the deletion counts are differences of a cumulative
+        insertion count, no loop per residue."""
+        sequences, descriptions = parse_fasta(a3m)
+        if not sequences:
+            raise ValueError("MSA must contain at least one sequence")
+        text = "".join(sequences)
+        if not text.isascii():
+            raise ValueError("MSA contains non-ASCII characters")
+        data = text.encode()
+        buf = np.frombuffer(data, dtype=np.uint8)
+        is_insertion = (buf >= ord("a")) & (buf <= ord("z"))
+        lengths = np.array([len(seq) for seq in sequences], dtype=np.int64)
+        row_end = np.cumsum(lengths)
+        row_start = row_end - lengths
+
+        residues = np.frombuffer(data.translate(None, LOWERCASE), dtype=np.uint8)
+        if len(residues) % len(sequences) != 0:
+            raise ValueError("Rows of the MSA have different numbers of match columns")
+        length = len(residues) // len(sequences)
+        match_positions = np.flatnonzero(~is_insertion)
+        # the first match column of each row has to be the (row * length)-th one overall
+        if (
+            np.searchsorted(match_positions, row_start)
+            != np.arange(len(sequences)) * length
+        ).any():
+            raise ValueError("Rows of the MSA have different numbers of match columns")
+        residues = residues.reshape(len(sequences), length)
+
+        # insertions before each match column and at the end of each row
+        insertions_before = np.concatenate([[0], np.cumsum(is_insertion)])
+        bounds = np.concatenate(
+            [
+                insertions_before[row_start][:, None],
+                insertions_before[match_positions].reshape(len(sequences), length),
+                insertions_before[row_end][:, None],
+            ],
+            axis=1,
+        )
+        deletions = np.diff(bounds, axis=1).astype(np.int32)
+
+        encoded = [description.encode() for description in descriptions]
+        header_offsets = np.concatenate(
+            [[0], np.cumsum([len(h) for h in encoded])]
+        ).astype(np.int64)
+        species = np.array(
+            [species_id(description) for description in descriptions], dtype=bytes
+        )
+        return cls(
+            residues,
+            deletions,
+            np.frombuffer(data.translate(None, NOT_LOWERCASE), dtype=np.uint8),
+            np.frombuffer(b"".join(encoded), dtype=np.uint8),
+            header_offsets,
+            species,
+        )
+
+    def select(self, rows: np.ndarray) -> "BinaryMSA":
+        """The MSA of the given rows (indices, in the given order)"""
+        rows = np.asarray(rows, dtype=np.int64)
+
+        def gather(data: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+            # concatenates data[offsets[i]:offsets[i + 1]] of the selected rows
+            lengths = offsets[rows + 1] - offsets[rows]
+            starts = np.repeat(offsets[rows] - np.cumsum(lengths) + lengths, lengths)
+            return data[starts + np.arange(lengths.sum())]
+
+        insertion_offsets = np.concatenate([[0], np.cumsum(self.deletions.sum(axis=1))])
+        return BinaryMSA(
+            self.residues[rows],
+            self.deletions[rows],
+            gather(self.insertions, insertion_offsets),
+            gather(self.headers, self.header_offsets),
+            np.concatenate([[0], np.cumsum(np.diff(self.header_offsets)[rows])]).astype(
+                np.int64
+            ),
+            self.species[rows],
+        )
+
+    def descriptions(self) -> List[str]:
+        headers = self.headers.tobytes()
+        offsets = self.header_offsets.tolist()
+        return [headers[start:end].decode() for start, end in zip(offsets, offsets[1:])]
+
+    def to_a3m(self) -> str:
+        rows, length = self.residues.shape
+        cumulative = np.cumsum(self.deletions, axis=1)
+        row_length = length + cumulative[:, -1]
+        row_offset = np.concatenate([[0], np.cumsum(row_length)])
+        out = np.empty(row_offset[-1], dtype=np.uint8)
+        # each residue is shifted by the insertions before it
+        residue_positions = (
+            row_offset[:-1, None] + np.arange(length)[None, :] + cumulative[:, :length]
+        )
+        is_insertion = np.ones(len(out), dtype=bool)
+        is_insertion[residue_positions.ravel()] = False
+        out[residue_positions.ravel()] = self.residues.ravel()
+        out[is_insertion] = self.insertions
+        text = out.tobytes().decode()
+        offsets = row_offset.tolist()
+        return "".join(
+            f">{description}\n{text[start:end]}\n"
+            for description, start, end in zip(
+                self.descriptions(), offsets, offsets[1:]
+            )
+        )
+
+    def msa_features(self) -> Dict[str, np.ndarray]:
+        """Same as
+        pipeline.make_msa_features([pipeline.parsers.parse_a3m(self.to_a3m())])"""
+        msa = HHBLITS_ID[self.residues]
+        if (msa < 0).any():
+            raise ValueError(
+                "Unknown residues in MSA: "
+                f"{set(self.residues[msa < 0].tobytes().decode())}"
+            )
+        rows, length = self.residues.shape
+        return {
+            "deletion_matrix_int": np.array(self.deletions[:, :length], dtype=np.int32),
+            "msa": msa,
+            "num_alignments": np.array([rows] * length, dtype=np.int32),
+            "msa_species_identifiers": self.species.astype(np.object_),
+        }
+
+    def save(self, path: Path, prefix: str):
+        for name in ARRAYS:
+            np.save(path.joinpath(f"{prefix}.{name}.npy"), getattr(self, name))
+
+    @classmethod
+    def load(cls, path: Path, prefix: str) -> "BinaryMSA":
+        return cls(
+            *[
+                np.load(path.joinpath(f"{prefix}.{name}.npy"), mmap_mode="r")
+                for name in ARRAYS
+            ]
+        )
+
+
+MSA = Union[str, BinaryMSA]
+
+
+def as_a3m(msas: Optional[List[MSA]]) -> Optional[List[str]]:
+    """A3M text of MSAs that might be binary, e.g. for msa_to_str or hhsearch"""
+    if msas is None:
+        return None
+    return [msa.to_a3m() if isinstance(msa, BinaryMSA) else msa for msa in msas]
+
+
+def is_msa_container(path: Union[str, Path]) -> bool:
+    return Path(path).joinpath("meta.json").is_file()
+
+
+def save_msa_container(
+    path: Union[str, Path],
+    unpaired_msa: Optional[List[MSA]],
+    paired_msa: Optional[List[MSA]],
+    query_seqs_unique: List[str],
+    query_seqs_cardinality: List[int],
+    template_features: List[Dict[str, Any]],
+):
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    for kind, msas in [("unpaired", unpaired_msa), ("paired", paired_msa)]:
+        for n, msa in enumerate(msas or []):
+            if isinstance(msa, str):
+                msa = BinaryMSA.from_a3m(msa)
+            msa.save(tmp, f"{kind}_{n}")
+    with tmp.joinpath("templates.pickle").open("wb") as f:
+        pickle.dump(template_features, f)
+    meta = {
+        "query_seqs_unique": query_seqs_unique,
+        "query_seqs_cardinality": query_seqs_cardinality,
+        # number of MSAs, e.g. homooligomers have one paired MSA per copy
+        "unpaired": None if unpaired_msa is None else len(unpaired_msa),
+        "paired": None if paired_msa is None else len(paired_msa),
+    }
+    tmp.joinpath("meta.json").write_text(json.dumps(meta))
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(tmp, path)
+
+
+def load_msa_container(path: Union[str, Path]) -> Tuple[
+    Optional[List[BinaryMSA]],
+    Optional[List[BinaryMSA]],
+    List[str],
+    List[int],
+    List[Dict[str, Any]],
+]:
+    """Memory maps a container, returns the same tuple as unserialize_msa"""
+    path = Path(path)
+    meta = json.loads(path.joinpath("meta.json").read_text())
+    query_seqs_unique = meta["query_seqs_unique"]
+    msas = {}
+    for kind in ["unpaired", "paired"]:
+        msas[kind] = None
+        if meta[kind] is not None:
+            msas[kind] = [
+                BinaryMSA.load(path, f"{kind}_{n}") for n in range(meta[kind])
+            ]
+    with path.joinpath("templates.pickle").open("rb") as f:
+        template_features = pickle.load(f)
+    return (
+        msas["unpaired"],
+        msas["paired"],
+        query_seqs_unique,
+        meta["query_seqs_cardinality"],
+        template_features,
+    )
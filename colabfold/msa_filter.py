@@ -0,0 +1,148 @@
+"""
+Reduces large MSAs before they are featurized.
+
+The filters work on the residue arrays of BinaryMSA, there is no loop per row or residue
+except for the greedy redundancy reduction within a block of rows:
+
+    min_coverage    fraction of the query columns that a row has to cover (non-gap)
+    min_identity    fraction of the covered columns that are identical to the query
+    max_seq_id      rows more similar than this to an earlier (kept) row are removed,
+                    like hhfilter -id. The identity of two rows is the fraction of
+                    identical residues over the columns both of them cover. Rows are
+                    compared with at most MAX_REPRESENTATIVES kept rows, the first ones
+    max_rows        number of rows (including the query) that are kept at most
+
+The query (first row) is always kept and the order of the rows is preserved, so the rows
+with the best hits come first as in the MSAs of the server.
+"""
+
+import logging
+from typing import List, NamedTuple, Optional, Union
+
+import numpy as np
+
+from colabfold.msa_container import HHBLITS_ID, BinaryMSA
+
+logger = logging.getLogger(__name__)
+
+GAP = ord("-")
+# residues (20 amino acids and X) of the one-hot encoding, the gap (21) is left out
+NUM_RESIDUE_TYPES = 21
+# rows of the MSA that are compared at once
+BLOCK_SIZE = 256
+# kept rows that the other rows are compared with in the redundancy reduction
+MAX_REPRESENTATIVES = 1024
+
+
+def coverage_and_identity(residues: np.ndarray, block_size: int = BLOCK_SIZE):
+    """Coverage of the query columns and identity to the query (row 0) of each row"""
+    rows, length = residues.shape
+    coverage = np.empty(rows, dtype=np.float64)
+    identity = np.empty(rows, dtype=np.float64)
+    query = np.asarray(residues[0])
+    for start in range(0, rows, block_size):
+        block = np.asarray(residues[start : start + block_size])
+        covered = block != GAP
+        num_covered = covered.sum(axis=1)
+        coverage[start : start + block_size] = num_covered / length
+        matches = ((block == query) & covered).sum(axis=1)
+        identity[start : start + block_size] = matches / np.maximum(num_covered, 1)
+    return coverage, identity
+
+
+def one_hot(residues: np.ndarray) -> np.ndarray:
+    """(rows, L * 21) float32, all zero for gaps"""
+    encoding = np.eye(NUM_RESIDUE_TYPES + 1, NUM_RESIDUE_TYPES, dtype=np.float32)
+    rows, length = residues.shape
+    return encoding[HHBLITS_ID[residues]].reshape(rows, length * NUM_RESIDUE_TYPES)
+
+
+def reduce_redundancy(
+    residues: np.ndarray,
+    candidates: np.ndarray,
+    max_seq_id: float,
+    max_rows: Optional[int] = None,
+    block_size: int = BLOCK_SIZE,
+    max_representatives: Optional[int] = MAX_REPRESENTATIVES,
+) -> np.ndarray:
+    """Greedily keeps the candidate rows (in order) that are at most max_seq_id
+    identical to every row kept before them. The identities are matrix products of
+    one-hot encodings.
+
+    A row is compared with the first max_representatives kept rows (the best hits) and
+    the earlier rows of its block, which bounds the work per row to
+    O(max_representatives * L). The representatives are kept as residues (uint8) and
+    encoded per block of rows."""
+    kept = []
+    representatives = []
+    num_kept = 0
+    num_representatives = 0
+    for start in range(0, len(candidates), block_size):
+        if max_rows is not None and num_kept >= max_rows:
+            break
+        rows = candidates[start : start + block_size]
+        block = np.asarray(residues[rows])
+        block_one_hot = one_hot(block)
+        block_covered = (block != GAP).astype(np.float32)
+
+        keep = np.ones(len(rows), dtype=bool)
+        for previous in representatives:
+            matches = block_one_hot @ one_hot(previous).T
+            overlap = block_covered @ (previous != GAP).astype(np.float32).T
+            keep &= ~(matches > max_seq_id * np.maximum(overlap, 1)).any(axis=1)
+
+        # rows of the same block are compared with each other, in order
+        similar = block_one_hot @ block_one_hot.T > max_seq_id * np.maximum(
+            block_covered @ block_covered.T, 1
+        )
+        for i in range(len(rows)):
+            if keep[i]:
+                keep[i + 1 :] &= ~similar[i, i + 1 :]
+
+        keep = np.flatnonzero(keep)
+        kept.append(rows[keep])
+        num_kept += len(keep)
+        if max_representatives is None or num_representatives < max_representatives:
+            new = block[keep]
+            if max_representatives is not None:
+                new = new[: max_representatives - num_representatives]
+            representatives.append(new)
+            num_representatives += len(new)
+
+    kept = np.concatenate(kept) if kept else candidates[:0]
+    return kept[:max_rows]
+
+
+class MSAFilter(NamedTuple):
+    min_coverage: float = 0.0
+    min_identity: float = 0.0
+    max_seq_id: float = 1.0
+    max_rows: Optional[int] = None
+
+    def is_active(self) -> bool:
+        return self != MSAFilter()
+
+    def __call__(self, msa: Union[str, BinaryMSA]) -> BinaryMSA:
+        if isinstance(msa, str):
+            msa = BinaryMSA.from_a3m(msa)
+        if not self.is_active():
+            return msa
+        coverage, identity = coverage_and_identity(msa.residues)
+        passed = (coverage >= self.min_coverage) & (identity >= self.min_identity)
+        passed[0] = True
+        candidates = np.flatnonzero(passed)
+        if self.max_seq_id < 1.0:
+            rows = reduce_redundancy(
+                msa.residues, candidates, self.max_seq_id, self.max_rows
+            )
+        else:
+            rows = candidates[: self.max_rows]
+        logger.debug(f"Kept {len(rows)} of {len(msa)} rows of the MSA")
+        return msa.select(rows)
+
+    def apply(
+        self, msas: Optional[List[Union[str, BinaryMSA]]]
+    ) -> Optional[List[BinaryMSA]]:
+        if msas is None:
+            return None
+        return [self(msa) for msa in msas]
@@ -0,0 +1,84 @@
+"""
+Runs the predictions (models and seeds) of a query on all local devices at once.
+
+Each device gets its own copy of the params, placed once and reused for all queries, a
+jitted function is compiled once per device and runs on the device of its (committed)
+params. One prediction runs per device at a time, the results are returned in the order
+of the work items, so they are ranked and written exactly as in a sequential run.
+
+On CPU, XLA_FLAGS=--xla_force_host_platform_device_count=N splits the host into N
+devices.
+"""
+
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Callable, Iterable, Iterator, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class DevicePool:
+    """One worker thread per device"""
+
+    def __init__(self, devices: Optional[Sequence[Any]] = None):
+        import jax
+
+        self.devices = list(devices) if devices is not None else jax.local_devices()
+        if not self.devices:
+            raise ValueError("No devices to run the predictions on")
+        self.executor = ThreadPoolExecutor(
+            max_workers=len(self.devices), thread_name_prefix="device"
+        )
+        # (id of the params, device id) -> (params, params on the device), the params
+        # are kept so that their id is not reused
+        self.placed = {}
+        self.lock = threading.Lock()
+        logger.info(
+            f"Running the predictions on {len(self.devices)} devices: {self.devices}"
+        )
+
+    def put(self, params: Any, device: Any) -> Any:
+        """The params (a pytree) on the device, transferred on first use"""
+        import jax
+
+        key = (id(params), device.id)
+        with self.lock:
+            if key not in self.placed:
+                self.placed[key] = (params, jax.device_put(params, device))
+            return self.placed[key][1]
+
+    def imap(
+        self, fn: Callable[[Any, Any], Any], items: Iterable[Any]
+    ) -> Iterator[Tuple[Any, Any]]:
+        """Yields (item, fn(item, device)) in the order of the items. Item n runs on
+        device n % len(devices), once the previous item of that device has been yielded.
+        An exception of fn is raised when its item is reached. When the iterator is
+        closed early, the items not started yet are dropped and the running ones are
+        waited for, so that fn does not outlive the iteration."""
+        futures = deque()
+        try:
+            for n, item in enumerate(items):
+                if len(futures) == len(self.devices):
+                    previous, future = futures.popleft()
+                    yield previous, future.result()
+                device = self.devices[n % len(self.devices)]
+                futures.append((item, self.executor.submit(fn, item, device)))
+            while futures:
+                item, future = futures.popleft()
+                yield item, future.result()
+        finally:
+            for _, future in futures:
+                future.cancel()
+            wait([future for _, future in futures])
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+        self.placed.clear()
+
+    def __enter__(self) -> "DevicePool":
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
@@ -1,8 +1,9 @@
+import gzip
 import json
 import logging
 import warnings
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Iterable, List, Optional, TextIO, Tuple
 
 from absl import logging as absl_logging
 from importlib_metadata import distribution
@@ -64,6 +65,63 @@ def safe_filename(file: str) -> str:
     return "".join([c if c.isalnum() or c in ["_", ".", "-"] else "_" for c in file])
 
 
+# compressed inputs are read transparently
+COMPRESSION_SUFFIXES = [".gz", ".zst"]
+
+
+def open_text(path: Path) -> TextIO:
+    """Opens a plain, gzip or zstd compressed text file"""
+    path = Path(path)
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt")
+    if path.suffix == ".zst":
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError(f"Reading {path} requires zstandard, please run `pip install zstandard`")
+        return zstandard.open(path, "rt")
+    return path.open()
+
+
+def read_text(path: Path) -> str:
+    with open_text(path) as f:
+        return f.read()
+
+
+def input_suffix(path: Path) -> str:
+    """The suffix of a possibly compressed input, e.g. .a3m for 5AWL_1.a3m.gz"""
+    path = Path(path)
+    if path.suffix in COMPRESSION_SUFFIXES:
+        path = path.with_suffix("")
+    return path.suffix
+
+
+def input_stem(path: Path) -> str:
+    path = Path(path)
+    if path.suffix in COMPRESSION_SUFFIXES:
+        path = path.with_suffix("")
+    return path.stem
+
+
+def canonical_sequence(sequence: str) -> str:
+    return sequence.strip().upper()
+
+
+def unique_sequences(
+    sequences: Iterable[str],
+) -> Tuple[List[str], List[int], List[int]]:
+    """Deduplicates sequences in linear time, in order of first occurrence.
+
+    Returns the unique (canonical) sequences, the index into them for each input sequence and
+    how often each unique sequence occurs."""
+    ids: Dict[str, int] = {}
+    index = [ids.setdefault(canonical_sequence(seq), len(ids)) for seq in sequences]
+    cardinality = [0] * len(ids)
+    for i in index:
+        cardinality[i] += 1
+    return list(ids), index, cardinality
+
+
 def get_commit() -> Optional[str]:
     text = distribution("colabfold").read_text("direct_url.json")
     if not text:
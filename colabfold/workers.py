@@ -0,0 +1,212 @@
+"""
+Runs the MSA and feature generation of upcoming jobs in worker threads and processes.
+
+prefetch computes a function of the next items in a thread or process pool while the
+current item is used. Worker processes are spawned (jax and tensorflow are not fork
+safe) and send their log records to the handlers of the main process.
+
+Large numeric arrays (input features, binary MSAs) are passed to and from the worker
+processes as files in shared memory, /dev/shm if available, instead of being pickled.
+The files are removed when the arrays are loaded. The run removes its create_shared_dir
+directory when its workers have finished.
+"""
+
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+
+from colabfold.msa_container import ARRAYS as MSA_ARRAYS, MSA, BinaryMSA
+
+logger = logging.getLogger(__name__)
+
+
+def prefetch(
+    items: Iterable[Any],
+    fn: Callable[[Any], Any],
+    lookahead: int,
+    processes: bool = False,
+) -> Iterator[Tuple[Any, Any, Optional[Exception]]]:
+    """Yields (item, fn(item), exception) in order, computing fn for up to `lookahead`
+    upcoming items in background threads (or worker processes, then fn has to be
+    picklable). An exception only affects its own item."""
+
+    def result(future):
+        try:
+            return future.result(), None
+        except Exception as e:
+            return None, e
+
+    if lookahead <= 0:
+        for item in items:
+            try:
+                value, error = fn(item), None
+            except Exception as e:
+                value, error = None, e
+            yield item, value, error
+        return
+
+    log_listener = None
+    if processes:
+        # the log records of the workers are handled by the handlers of this process
+        context = multiprocessing.get_context("spawn")
+        log_queue = context.Queue()
+        log_listener = logging.handlers.QueueListener(
+            log_queue, *logging.getLogger().handlers, respect_handler_level=True
+        )
+        log_listener.start()
+        # jax and tensorflow are not fork safe
+        executor = ProcessPoolExecutor(
+            max_workers=lookahead,
+            mp_context=context,
+            initializer=init_worker_logging,
+            initargs=(log_queue, logging.getLogger().getEffectiveLevel()),
+        )
+    else:
+        executor = ThreadPoolExecutor(max_workers=lookahead)
+    futures = deque()
+    try:
+        with executor:
+            try:
+                items = iter(items)
+                for item in items:
+                    futures.append((item, executor.submit(fn, item)))
+                    if len(futures) > lookahead:
+                        item, future = futures.popleft()
+                        yield (item, *result(future))
+                while futures:
+                    item, future = futures.popleft()
+                    yield (item, *result(future))
+            finally:
+                # closed early, the items that have not started are dropped, the
+                # executor waits for the running ones
+                for _, future in futures:
+                    future.cancel()
+    finally:
+        if log_listener is not None:
+            log_listener.stop()
+
+
+def init_worker_logging(log_queue, level: int):
+    """Sends the log records of a worker process to the queue of prefetch"""
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+
+
+class SharedArray(NamedTuple):
+    """A feature array that a worker process left in shared memory"""
+
+    path: str
+
+
+# numeric feature arrays from this size on are passed in shared memory
+SHARED_ARRAY_MIN_SIZE = 64 * 1024
+
+
+def shared_memory_dir() -> Path:
+    """/dev/shm if available, otherwise the temporary directory"""
+    shm = Path("/dev/shm")
+    return shm if shm.is_dir() else Path(tempfile.gettempdir())
+
+
+def create_shared_dir() -> Path:
+    """A new directory in shared memory for the arrays of one run"""
+    return Path(tempfile.mkdtemp(prefix="colabfold_", dir=shared_memory_dir()))
+
+
+def share_arrays(
+    features: Dict[str, Any], directory: Optional[Path] = None
+) -> Dict[str, Any]:
+    """Moves the large numeric arrays to files in shared memory (/dev/shm if available),
+    so they are mapped instead of pickled when sent to or from a worker process"""
+    directory = shared_memory_dir() if directory is None else directory
+    shared = {}
+    for key, value in features.items():
+        if (
+            isinstance(value, np.ndarray)
+            and value.dtype.kind in "biuf"
+            and value.nbytes >= SHARED_ARRAY_MIN_SIZE
+        ):
+            fd, path = tempfile.mkstemp(
+                prefix="colabfold_", suffix=".npy", dir=directory
+            )
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, value)
+            value = SharedArray(path)
+        shared[key] = value
+    return shared
+
+
+def load_shared_arrays(features: Dict[str, Any]) -> Dict[str, Any]:
+    """Maps the arrays of share_arrays (copy on write) and removes their files"""
+    loaded = {}
+    for key, value in features.items():
+        if isinstance(value, SharedArray):
+            array = np.load(value.path, mmap_mode="c")
+            # the mapping stays valid until the array is freed
+            os.unlink(value.path)
+            value = array
+        loaded[key] = value
+    return loaded
+
+
+class SharedMSA(NamedTuple):
+    """A binary MSA with its arrays in shared memory, see share_arrays"""
+
+    arrays: Dict[str, Any]
+
+
+def share_msas(
+    msas: Optional[List[MSA]], directory: Path
+) -> Optional[List[Union[MSA, SharedMSA]]]:
+    """The binary MSAs of a job as SharedMSA, to be sent to a worker process"""
+    if msas is None:
+        return None
+    return [
+        (
+            SharedMSA(
+                share_arrays(
+                    {name: getattr(msa, name) for name in MSA_ARRAYS}, directory
+                )
+            )
+            if isinstance(msa, BinaryMSA)
+            else msa
+        )
+        for msa in msas
+    ]
+
+
+def load_shared_msas(
+    msas: Optional[List[Union[MSA, SharedMSA]]],
+) -> Optional[List[MSA]]:
+    if msas is None:
+        return None
+    return [
+        (
+            BinaryMSA(**load_shared_arrays(msa.arrays))
+            if isinstance(msa, SharedMSA)
+            else msa
+        )
+        for msa in msas
+    ]
@@ -0,0 +1,134 @@
+"""
+Throughput of the MSA server client against the local stand-in server.
+
+    python -m tests.benchmark_msa_client --tickets 200 --latency 0.02 --error-rate 0.01
+
+Reports tickets/s, downloaded bytes/s and the latency percentiles of the tickets (first
+submit until the result is on disk). With --archive a real out.tar.gz is replayed for
+every ticket.
+"""
+
+import logging
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+from colabfold.mmseqs.client import Backoff, MMseqs2Client, SearchJob
+from tests.mock_server import MockMSAServer
+
+
+def benchmark(
+    tickets: int,
+    seqs_per_ticket: int,
+    workers: int,
+    polls_until_complete: int,
+    latency: float,
+    error_rate: float,
+    ratelimit_rate: float,
+    poll_interval: float,
+    archive: bytes = None,
+) -> dict:
+    with tempfile.TemporaryDirectory() as tmp_dir, MockMSAServer(
+        polls_until_complete=polls_until_complete,
+        latency=latency,
+        error_rate=error_rate,
+        ratelimit_rate=ratelimit_rate,
+        archive=archive,
+    ) as server:
+        backoff = Backoff(initial=poll_interval, maximum=10 * poll_interval)
+        with MMseqs2Client(
+            server.url, "colabfold/benchmark", max_workers=workers, backoff=backoff
+        ) as client:
+            jobs: List[SearchJob] = [
+                SearchJob(
+                    ["MRILPISTIKGKLNEVLKAAG"] * seqs_per_ticket,
+                    "env",
+                    False,
+                    Path(tmp_dir).joinpath(f"{i}.tar.gz"),
+                )
+                for i in range(tickets)
+            ]
+            start = time.monotonic()
+            client.search(jobs)
+            elapsed = time.monotonic() - start
+
+        done = [job for job in jobs if job.error is None]
+        size = sum(job.tar_gz_file.stat().st_size for job in done)
+        latencies = np.array([job.finished - job.submitted for job in done])
+        return {
+            "tickets": len(done),
+            "failed": len(jobs) - len(done),
+            "seconds": elapsed,
+            "tickets/s": len(done) / elapsed,
+            "bytes/s": size / elapsed,
+            "p50": np.percentile(latencies, 50),
+            "p95": np.percentile(latencies, 95),
+            "p99": np.percentile(latencies, 99),
+            "max": latencies.max(),
+            "requests": dict(server.requests),
+            "connections": server.connections,
+        }
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tickets", type=int, default=200)
+    parser.add_argument("--seqs-per-ticket", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--polls-until-complete", type=int, default=2)
+    parser.add_argument(
+        "--latency", type=float, default=0.01, help="seconds per request"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="fraction of dropped requests"
+    )
+    parser.add_argument(
+        "--ratelimit-rate",
+        type=float,
+        default=0.0,
+        help="fraction of RATELIMIT submits",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=0.05,
+        help="initial poll interval in seconds",
+    )
+    parser.add_argument(
+        "--archive", type=Path, default=None, help="result archive to replay"
+    )
+    args = parser.parse_args()
+    # retries are logged as warnings, keep the report readable
+    logging.basicConfig(level=logging.ERROR)
+
+    result = benchmark(
+        args.tickets,
+        args.seqs_per_ticket,
+        args.workers,
+        args.polls_until_complete,
+        args.latency,
+        args.error_rate,
+        args.ratelimit_rate,
+        args.poll_interval,
+        args.archive.read_bytes() if args.archive else None,
+    )
+    print(
+        f"{result['tickets']} tickets ({result['failed']} failed) in "
+        f"{result['seconds']:.2f}s"
+    )
+    print(
+        f"{result['tickets/s']:.1f} tickets/s, {result['bytes/s'] / 1024**2:.2f} MB/s"
+    )
+    print(
+        f"ticket latency p50 {result['p50']:.3f}s p95 {result['p95']:.3f}s "
+        f"p99 {result['p99']:.3f}s max {result['max']:.3f}s"
+    )
+    print(f"requests {result['requests']} over {result['connections']} connections")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Speed of the MSA featurization of build_monomer_feature on a synthetic deep MSA.
+
+    python -m tests.benchmark_msa_features --rows 20000 --length 500
+
+Compares colabfold.batch.make_msa_features against AlphaFold's parse_a3m +
+make_msa_features and checks that the features are identical.
+"""
+
+import random
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+from alphafold.data import pipeline
+
+from colabfold.batch import make_msa_features
+from tests.benchmark_unserialize_msa import random_row
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--length", type=int, default=500)
+    parser.add_argument("--insertion-rate", type=float, default=0.02)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    query = random_row(rng, args.length, 0).replace("-", "A")
+    a3m = f">101\n{query}\n" + "".join(
+        f">UniRef100_{i}\n{random_row(rng, args.length, args.insertion_rate)}\n"
+        for i in range(args.rows)
+    )
+    print(f"{args.rows} rows of length {args.length}, {len(a3m) / 1024**2:.1f} MB")
+
+    start = time.perf_counter()
+    features = make_msa_features(a3m)
+    fast = time.perf_counter() - start
+
+    start = time.perf_counter()
+    expected = pipeline.make_msa_features([pipeline.parsers.parse_a3m(a3m)])
+    alphafold = time.perf_counter() - start
+
+    for key in expected:
+        np.testing.assert_array_equal(features[key], expected[key])
+    print(
+        f"make_msa_features {fast:.2f}s, alphafold {alphafold:.2f}s "
+        f"({alphafold / fast:.0f}x)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Speed of process_multimer_features for a homomer.
+
+    python -m tests.benchmark_multimer_features --copies 24 --length 300 --rows 2000
+
+The copies of a chain share one feature dict (as in generate_input_feature) and are
+merged by tiling. Passing a separate dict per copy instead processes each copy and
+merges them with AlphaFold's merge_chain_features. The benchmark checks that both give
+the same features.
+"""
+
+import random
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from colabfold.batch import (
+    build_monomer_feature,
+    build_multimer_feature,
+    mk_mock_template,
+    process_multimer_features,
+)
+from tests.benchmark_unserialize_msa import random_row
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--copies", type=int, default=24)
+    parser.add_argument("--length", type=int, default=300)
+    parser.add_argument("--rows", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    query = random_row(rng, args.length, 0).replace("-", "A")
+    unpaired = f">101\n{query}\n" + "".join(
+        f">U{i}\n{random_row(rng, args.length, 0.02)}\n" for i in range(args.rows)
+    )
+    feature_dict = build_monomer_feature(query, unpaired, mk_mock_template(query))
+    feature_dict.update(build_multimer_feature(f">101\n{query}\n"))
+    chain_ids = [f"C{n}" for n in range(args.copies)]
+
+    start = time.perf_counter()
+    shared = process_multimer_features({chain: feature_dict for chain in chain_ids})
+    tiled = time.perf_counter() - start
+
+    start = time.perf_counter()
+    merged = process_multimer_features(
+        {chain: dict(feature_dict) for chain in chain_ids}
+    )
+    per_copy = time.perf_counter() - start
+
+    assert shared.keys() == merged.keys()
+    for key in merged:
+        np.testing.assert_array_equal(shared[key], merged[key])
+    print(f"{args.copies} copies of length {args.length}, {args.rows} rows")
+    print(f"shared {tiled:.2f}s, per copy {per_copy:.2f}s ({per_copy / tiled:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Speed of unserialize_msa on synthetic paired MSAs.
+
+    python -m tests.benchmark_unserialize_msa --rows 30000 --lengths 800,900,800
+
+Compares the vectorized chain split (split_msa_rows) against the per-character loop
+(split_msa_row) and checks that both give the same chains.
+"""
+
+import random
+import time
+from argparse import ArgumentParser
+from typing import List
+
+from colabfold.batch import msa_to_str, split_msa_row, split_msa_rows, unserialize_msa
+
+
+def random_row(rng: random.Random, length: int, insertion_rate: float) -> str:
+    row = []
+    for _ in range(length):
+        if rng.random() < insertion_rate:
+            row.append(
+                "".join(rng.choices("acdefghiklmnpqrstvwy", k=rng.randint(1, 5)))
+            )
+        row.append(rng.choice("ACDEFGHIKLMNPQRSTVWY-"))
+    return "".join(row)
+
+
+def synthetic_msa(
+    rows: int, lengths: List[int], insertion_rate: float, seed: int = 0
+) -> str:
+    rng = random.Random(seed)
+    queries = [random_row(rng, length, 0).replace("-", "A") for length in lengths]
+    paired = [
+        f">{101 + n}\n{query}\n"
+        + "".join(
+            f">P{i}\n{random_row(rng, length, insertion_rate)}\n" for i in range(rows)
+        )
+        for n, (query, length) in enumerate(zip(queries, lengths))
+    ]
+    unpaired = [
+        f">{101 + n}\n{query}\n"
+        + "".join(
+            f">U{n}_{i}\n{random_row(rng, length, insertion_rate)}\n"
+            for i in range(rows // 10)
+        )
+        for n, (query, length) in enumerate(zip(queries, lengths))
+    ]
+    return msa_to_str(unpaired, paired, queries, [1] * len(queries))
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=3000, help="paired rows")
+    parser.add_argument("--lengths", default="800,900,800", help="chain lengths")
+    parser.add_argument("--insertion-rate", type=float, default=0.02)
+    args = parser.parse_args()
+
+    lengths = list(map(int, args.lengths.split(",")))
+    msa = synthetic_msa(args.rows, lengths, args.insertion_rate)
+    lines = msa.splitlines()
+    seqs = lines[2::2]
+    print(f"{len(seqs)} rows, {len(msa) / 1024**2:.1f} MB")
+
+    start = time.perf_counter()
+    chains, _ = split_msa_rows(seqs, lengths)
+    vectorized = time.perf_counter() - start
+
+    start = time.perf_counter()
+    reference = [split_msa_row(seq, lengths)[0] for seq in seqs]
+    loop = time.perf_counter() - start
+    assert chains == reference
+
+    start = time.perf_counter()
+    unserialize_msa([msa], ["A"] * len(lengths))
+    total = time.perf_counter() - start
+
+    print(
+        f"split_msa_rows {vectorized:.2f}s, split_msa_row loop {loop:.2f}s "
+        f"({loop / vectorized:.0f}x)"
+    )
+    print(f"unserialize_msa {total:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -147,6 +147,7 @@ class MMseqs2Mock:
     pairing_strategy="greedy",
     host_url="https://a3m.mmseqs.com",
     user_agent="colabfold/test",
+    cache=None,
   ):
     assert prefix
     config = {
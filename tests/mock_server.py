@@ -0,0 +1,243 @@
+"""Local stand-in for the MSA server API, so the HTTP client can be tested without
+network access"""
+
+import io
+import json
+import random
+import tarfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+
+def parse_query(query: str) -> List[Tuple[int, str]]:
+    """Parses the `>101\\nSEQ\\n>102\\nSEQ` query sent by the client"""
+    lines = query.strip().splitlines()
+    return [(int(lines[i][1:]), lines[i + 1]) for i in range(0, len(lines), 2)]
+
+
+def make_result_archive(query: str, mode: str, use_pairing: bool) -> bytes:
+    """Builds an out.tar.gz like the server, one null separated a3m block per query"""
+    entries = parse_query(query)
+    if use_pairing:
+        files = {"pair.a3m": "UP"}
+    else:
+        files = {"uniref.a3m": "UniRef100_"}
+        if mode.startswith("env"):
+            files["bfd.mgnify30.metaeuk30.smag30.a3m"] = "ENV_"
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for name, prefix in files.items():
+            content = "".join(
+                f">{M}\n{seq}\n>{prefix}{M}\n{seq.lower()[:1]}{seq[1:]}\n\x00"
+                for M, seq in entries
+            )
+            add_file(tar, name, content.encode())
+        if not use_pairing:
+            m8 = "".join(
+                f"{M}\t{M - 100}abc_A\t1.0\t10\t0\t0\t1\t10\t1\t10\t1e-10\t100\t10M\n"
+                for M, _ in entries
+            )
+            add_file(tar, "pdb70.m8", m8.encode())
+    return buffer.getvalue()
+
+
+def make_template_archive(pdb_ids: List[str]) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        ffdata, ffindex, offset = "", "", 0
+        for pdb_id in pdb_ids:
+            add_file(tar, f"{pdb_id[:4]}.cif", f"data_{pdb_id[:4]}\n".encode())
+            entry = f">{pdb_id}\nAAAA\n\0"
+            ffindex += f"{pdb_id}\t{offset}\t{len(entry)}\n"
+            ffdata += entry
+            offset += len(entry)
+        add_file(tar, "pdb70_a3m.ffdata", ffdata.encode())
+        add_file(tar, "pdb70_a3m.ffindex", ffindex.encode())
+    return buffer.getvalue()
+
+
+def add_file(tar: tarfile.TarFile, name: str, content: bytes):
+    info = tarfile.TarInfo(name)
+    info.size = len(content)
+    tar.addfile(info, io.BytesIO(content))
+
+
+class MockMSAServer:
+    """Serves the ticket/msa, ticket/pair, ticket/{id}, result/download and template
+    endpoints.
+
+    `polls_until_complete` is the number of status requests that answer RUNNING before a
+    ticket is COMPLETE, with 0 tickets are already COMPLETE when submitted. While `down`
+    is set, all connections are closed without an answer.
+
+    To simulate a loaded server, every request is delayed by `latency` seconds, a
+    fraction `error_rate` of the requests is dropped without an answer and a fraction
+    `ratelimit_rate` of the submits is answered with RATELIMIT (and a Retry-After header
+    if `retry_after` is set). `archive` replays a canned result archive (e.g. a real
+    out.tar.gz) for every download."""
+
+    def __init__(
+        self,
+        polls_until_complete: int = 0,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        ratelimit_rate: float = 0.0,
+        retry_after: Optional[float] = None,
+        archive: Optional[bytes] = None,
+        seed: int = 0,
+    ):
+        self.polls_until_complete = polls_until_complete
+        self.latency = latency
+        self.error_rate = error_rate
+        self.ratelimit_rate = ratelimit_rate
+        self.retry_after = retry_after
+        self.archive = archive
+        self.random = random.Random(seed)
+        self.tickets: Dict[str, Dict] = {}
+        self.requests: Dict[str, int] = {}
+        self.connections = 0
+        self.bytes_sent = 0
+        self.down = False
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep-alive, so we can check that the client reuses connections
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with server.lock:
+                    server.connections += 1
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                server.handle(self, "GET", b"")
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                server.handle(self, "POST", self.rfile.read(length))
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def __enter__(self) -> "MockMSAServer":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def count(self, endpoint: str):
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def chance(self, rate: float) -> bool:
+        with self.lock:
+            return self.random.random() < rate
+
+    def handle(self, handler: BaseHTTPRequestHandler, method: str, body: bytes):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.down or self.chance(self.error_rate):
+            self.count("dropped")
+            handler.close_connection = True
+            return
+        parts = handler.path.strip("/").split("/")
+        if method == "POST" and parts[0] == "ticket" and parts[1] in ["msa", "pair"]:
+            if self.chance(self.ratelimit_rate):
+                self.count("ratelimit")
+                headers = (
+                    {}
+                    if self.retry_after is None
+                    else {"Retry-After": str(self.retry_after)}
+                )
+                self.send_json(handler, {"status": "RATELIMIT"}, headers)
+                return
+            self.count(f"ticket/{parts[1]}")
+            form = {k: v[0] for k, v in parse_qs(body.decode()).items()}
+            ticket_id = str(uuid.uuid4())
+            with self.lock:
+                self.tickets[ticket_id] = {
+                    "query": form["q"],
+                    "mode": form.get("mode", ""),
+                    "use_pairing": parts[1] == "pair",
+                    "polls": 0,
+                }
+            self.send_json(
+                handler,
+                {"id": ticket_id, "status": self.ticket_status(ticket_id, False)},
+            )
+        elif method == "GET" and parts[0] == "ticket":
+            self.count("ticket/status")
+            self.send_json(
+                handler, {"id": parts[1], "status": self.ticket_status(parts[1], True)}
+            )
+        elif method == "GET" and parts[:2] == ["result", "download"]:
+            self.count("result/download")
+            ticket = self.tickets[parts[2]]
+            archive = self.archive
+            if archive is None:
+                archive = make_result_archive(
+                    ticket["query"], ticket["mode"], ticket["use_pairing"]
+                )
+            self.send(handler, 200, archive, "application/octet-stream")
+        elif method == "GET" and parts[0] == "template":
+            self.count("template")
+            self.send(
+                handler,
+                200,
+                make_template_archive(parts[1].split(",")),
+                "application/octet-stream",
+            )
+        else:
+            self.send(handler, 404, b"", "text/plain")
+
+    def ticket_status(self, ticket_id: str, poll: bool) -> str:
+        with self.lock:
+            ticket = self.tickets.get(ticket_id)
+            if ticket is None:
+                return "UNKNOWN"
+            if poll:
+                ticket["polls"] += 1
+            if ticket["polls"] >= self.polls_until_complete:
+                return "COMPLETE"
+            return "RUNNING"
+
+    def send_json(
+        self,
+        handler: BaseHTTPRequestHandler,
+        data: Dict,
+        headers: Optional[Dict[str, str]] = None,
+    ):
+        self.send(handler, 200, json.dumps(data).encode(), "application/json", headers)
+
+    def send(
+        self,
+        handler: BaseHTTPRequestHandler,
+        code: int,
+        body: bytes,
+        content_type: str,
+        headers: Optional[Dict[str, str]] = None,
+    ):
+        handler.send_response(code)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            handler.send_header(key, value)
+        handler.end_headers()
+        handler.wfile.write(body)
+        with self.lock:
+            self.bytes_sent += len(body)
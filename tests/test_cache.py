@@ -0,0 +1,215 @@
+import os
+from pathlib import Path
+
+from colabfold.cache import DiskCache, MSACache, join_a3m_blocks, split_a3m_blocks
+from colabfold.colabfold import run_mmseqs2
+from colabfold.mmseqs.client import MMseqs2Client
+from tests.mock_server import MockMSAServer
+
+
+def test_disk_cache_lru_eviction(tmp_path):
+    cache = DiskCache(tmp_path, max_size=350)
+    for i in range(3):
+        cache.put(f"key{i}", b"x" * 100)
+        os.utime(cache.path(f"key{i}"), (i, i))
+    # key0 is used again, so key1 is the least recently used entry
+    assert cache.get("key0") == b"x" * 100
+    cache.put("key3", b"x" * 100)
+
+    assert cache.get("key1") is None
+    assert cache.get("key0") is not None
+    assert cache.get("key3") is not None
+    assert cache.size <= 350
+
+
+def test_a3m_blocks_roundtrip():
+    a3m = (
+        ">101\nPIAQIHILEGRSDEQK\n>UniRef100_A0A\nPIAQIHILEGRSDEQK\n\x00"
+        ">101\nPIAQIHILEGRSDEQK\n>ENV\npiaqihilegr\n"
+    )
+    blocks = split_a3m_blocks(a3m)
+    assert join_a3m_blocks(blocks, 101, "\x00") == a3m
+    assert join_a3m_blocks(blocks, 102, "\x00") == a3m.replace(">101", ">102")
+
+
+def test_run_mmseqs2_cache(tmp_path):
+    seqs = ["MRILPISTIKG", "MPYTVRFTTTA"]
+    with MockMSAServer() as server, MMseqs2Client(
+        server.url, "colabfold/test"
+    ) as client:
+        cache = MSACache(tmp_path.joinpath("cache"), 10**9, db_version="2024-01")
+        uncached = run_mmseqs2(seqs, str(tmp_path.joinpath("uncached")), client=client)
+        first = run_mmseqs2(
+            seqs, str(tmp_path.joinpath("first")), client=client, cache=cache
+        )
+        # the cached sequence is the second one here, only the new one is searched
+        second = run_mmseqs2(
+            ["GSHMKLVRTA", "MRILPISTIKG"],
+            str(tmp_path.joinpath("second")),
+            client=client,
+            cache=cache,
+        )
+        paired = run_mmseqs2(
+            seqs,
+            str(tmp_path.joinpath("first")),
+            use_pairing=True,
+            client=client,
+            cache=cache,
+        )
+        paired_again = run_mmseqs2(
+            seqs,
+            str(tmp_path.joinpath("third")),
+            use_pairing=True,
+            client=client,
+            cache=cache,
+        )
+
+    assert first == uncached
+    assert second[0].startswith(">101\nGSHMKLVRTA\n")
+    assert second[1] == first[0].replace(">101\n", ">102\n")
+    assert paired == paired_again
+    # uncached, first, the new sequence of second and one pairing ticket
+    assert server.requests["ticket/msa"] == 3
+    assert server.requests["ticket/pair"] == 1
+
+
+def test_msa_cache_keyed_by_db_version(tmp_path):
+    blocks = [">101\nMRILP\n"]
+    MSACache(tmp_path, 10**9, db_version="2024-01").put_blocks(
+        "a3m", "env", ["MRILP"], blocks
+    )
+    assert (
+        MSACache(tmp_path, 10**9, db_version="2024-01").get_blocks(
+            "a3m", "env", ["MRILP"]
+        )
+        == blocks
+    )
+    # entries of other database versions are not used
+    assert (
+        MSACache(tmp_path, 10**9, db_version="2024-06").get_blocks(
+            "a3m", "env", ["MRILP"]
+        )
+        is None
+    )
+
+
+def test_run_mmseqs2_templates_shared(tmp_path):
+    seqs = ["MRILPISTIKG", "MPYTVRFTTTA"]
+    with MockMSAServer() as server, MMseqs2Client(
+        server.url, "colabfold/test"
+    ) as client:
+        cache = MSACache(tmp_path.joinpath("cache"), 10**9)
+        _, first = run_mmseqs2(
+            seqs,
+            str(tmp_path.joinpath("first")),
+            use_templates=True,
+            client=client,
+            cache=cache,
+        )
+        _, second = run_mmseqs2(
+            seqs[::-1],
+            str(tmp_path.joinpath("second")),
+            use_templates=True,
+            client=client,
+            cache=cache,
+        )
+
+    # both queries are fetched in one request, the second job only links them
+    assert server.requests["template"] == 1
+    template_path = Path(first[0])
+    assert sorted(f.name for f in template_path.iterdir()) == [
+        "1abc.cif",
+        "pdb70_a3m.ffdata",
+        "pdb70_a3m.ffindex",
+        "pdb70_cs219.ffdata",
+        "pdb70_cs219.ffindex",
+    ]
+    assert template_path.joinpath("pdb70_a3m.ffindex").read_text() == "1abc_A\t0\t14\n"
+    assert template_path.joinpath("pdb70_a3m.ffdata").read_text() == ">1abc_A\nAAAA\n\0"
+    assert template_path.joinpath("1abc.cif").read_text() == "data_1abc\n"
+    assert template_path.joinpath("pdb70_a3m.ffindex").resolve() == (
+        Path(second[1]).joinpath("pdb70_a3m.ffindex").resolve()
+    )
+
+
+def test_run_mmseqs2_relinks_evicted_templates(tmp_path):
+    seqs = ["MRILPISTIKG", "MPYTVRFTTTA"]
+    prefix = str(tmp_path.joinpath("job"))
+    with MockMSAServer() as server, MMseqs2Client(
+        server.url, "colabfold/test"
+    ) as client:
+        cache = MSACache(tmp_path.joinpath("cache"), 10**9)
+        _, first = run_mmseqs2(
+            seqs, prefix, use_templates=True, client=client, cache=cache
+        )
+        # everything is evicted, the template directories of the job point nowhere
+        cache.max_size = 0
+        cache.put("other", b"x")
+        assert not Path(first[0]).joinpath("pdb70_a3m.ffindex").exists()
+        cache.max_size = 10**9
+        _, second = run_mmseqs2(
+            seqs, prefix, use_templates=True, client=client, cache=cache
+        )
+
+    assert second == first
+    assert (
+        Path(second[0]).joinpath("pdb70_a3m.ffindex").read_text() == "1abc_A\t0\t14\n"
+    )
+    assert Path(second[1]).joinpath("2abc.cif").read_text() == "data_2abc\n"
+    # the templates were downloaded again
+    assert server.requests["template"] == 2
+
+
+def test_template_store_unavailable_and_eviction(tmp_path):
+    import io
+    from concurrent.futures import ThreadPoolExecutor
+
+    from colabfold.mmseqs.templates import TemplateStore
+    from tests.mock_server import make_template_archive
+
+    class Response:
+        def __init__(self, data):
+            self.raw = io.BytesIO(data)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+    class Client:
+        # the server only knows 1abc
+        executor = ThreadPoolExecutor(1)
+        requested = []
+
+        def request_templates(self, pdb_ids):
+            self.requested.append(pdb_ids)
+            return Response(
+                make_template_archive(
+                    [pdb_id for pdb_id in pdb_ids if pdb_id.startswith("1abc")]
+                )
+            )
+
+    cache = MSACache(tmp_path, 10**9)
+    store = TemplateStore(cache.template_store_dir, on_added=cache._added)
+    client = Client()
+    store.fetch(client, ["1abc_A", "2def_B"])
+    store.fetch(client, ["1abc_A", "2def_B"])
+    # the missing template is not requested again
+    assert client.requested == [["1abc_A", "2def_B"]]
+    assert store.missing(["1abc_A", "2def_B"]) == []
+
+    # the set is stored under the templates it contains
+    template_set = store.template_set(["1abc_A", "2def_B"])
+    assert template_set == store.template_set(["1abc_A"])
+    assert template_set.joinpath("pdb70_a3m.ffindex").read_text() == "1abc_A\t0\t14\n"
+    assert template_set.joinpath("1abc.cif").read_text() == "data_1abc\n"
+
+    # the store is part of the cache size and evicted with the MSAs
+    assert template_set in cache._entries()
+    cache.put("msa", b"x" * 100)
+    assert cache.size > 100
+    cache.max_size = 150
+    cache.put("newer", b"x" * 100)
+    assert not template_set.exists()
+    assert cache.get("newer") is not None
@@ -0,0 +1,401 @@
+import logging
+import threading
+import time
+
+from colabfold.cache import join_a3m_blocks
+from colabfold.colabfold import run_mmseqs2
+from colabfold.mmseqs.client import (
+    Backoff,
+    MMseqs2Client,
+    SearchJob,
+    extract_members,
+    index_a3m,
+    read_a3m_blocks,
+)
+from colabfold.mmseqs.rate_limit import RateLimiter
+from tests.mock_server import MockMSAServer, make_result_archive
+
+
+def test_search_many_tickets(tmp_path):
+    with MockMSAServer() as server, MMseqs2Client(
+        server.url, "colabfold/test", max_workers=4
+    ) as client:
+        jobs = [
+            SearchJob(
+                [f"ACDEFGHIK{'L' * i}"], "env", False, tmp_path.joinpath(f"{i}.tar.gz")
+            )
+            for i in range(12)
+        ]
+        client.search(jobs)
+
+    assert all(job.error is None for job in jobs)
+    assert all(job.tar_gz_file.is_file() for job in jobs)
+    assert server.requests == {"ticket/msa": 12, "result/download": 12}
+    # 24 requests over a pool of at most 4 keep-alive connections
+    assert server.connections <= 4
+
+
+def test_search_polls_with_backoff(tmp_path):
+    backoff = Backoff(initial=0.01, maximum=0.05, jitter=0)
+    with MockMSAServer(polls_until_complete=3) as server, MMseqs2Client(
+        server.url, "colabfold/test", backoff=backoff
+    ) as client:
+        jobs = [
+            SearchJob(
+                [f"ACDEFGHIK{'L' * i}"], "env", False, tmp_path.joinpath(f"{i}.tar.gz")
+            )
+            for i in range(4)
+        ]
+        client.search(jobs)
+
+    assert all(job.error is None for job in jobs)
+    # RUNNING, RUNNING, COMPLETE for each ticket, no polls after completion
+    assert server.requests["ticket/status"] == 12
+    assert [backoff.delay(i) for i in range(4)] == [0.01, 0.015, 0.0225, 0.03375]
+    assert backoff.delay(10) == 0.05
+    assert backoff.delay(0, retry_after=2) == 2
+
+
+def test_search_ticket_timeout(tmp_path):
+    backoff = Backoff(initial=0.01, maximum=0.02)
+    with MockMSAServer(polls_until_complete=10**6) as server, MMseqs2Client(
+        server.url, "colabfold/test", backoff=backoff, ticket_timeout=0.2
+    ) as client:
+        [job] = client.search(
+            [SearchJob(["ACDEFGHIK"], "env", False, tmp_path.joinpath("out.tar.gz"))]
+        )
+
+    assert isinstance(job.error, TimeoutError)
+    assert not job.tar_gz_file.is_file()
+
+
+def test_search_resumes_ticket(tmp_path):
+    backoff = Backoff(initial=0.01, maximum=0.02)
+    job = SearchJob(["ACDEFGHIK"], "env", False, tmp_path.joinpath("out.tar.gz"))
+    with MockMSAServer(polls_until_complete=10**6) as server:
+        # the first run is interrupted before the ticket finished
+        with MMseqs2Client(
+            server.url, "colabfold/test", backoff=backoff, ticket_timeout=0.1
+        ) as client:
+            client.search([job])
+        assert job.ticket_file.is_file()
+
+        server.polls_until_complete = 0
+        restarted = SearchJob(
+            ["ACDEFGHIK"], "env", False, tmp_path.joinpath("out.tar.gz")
+        )
+        with MMseqs2Client(server.url, "colabfold/test", backoff=backoff) as client:
+            client.search([restarted])
+
+    assert restarted.error is None
+    assert restarted.ticket_id == job.ticket_id
+    assert restarted.tar_gz_file.is_file()
+    assert not restarted.ticket_file.is_file()
+    assert server.requests["ticket/msa"] == 1
+
+
+def test_search_resubmits_expired_ticket(tmp_path):
+    job = SearchJob(["ACDEFGHIK"], "env", False, tmp_path.joinpath("out.tar.gz"))
+    with MockMSAServer() as server, MMseqs2Client(
+        server.url, "colabfold/test", backoff=Backoff(initial=0.01)
+    ) as client:
+        job.ticket_id, job.endpoint = "expired", client.endpoints[0]
+        job.save_ticket()
+        job.ticket_id, job.endpoint = None, None
+        client.search([job])
+
+    assert job.error is None
+    assert job.ticket_id != "expired"
+    assert server.requests == {
+        "ticket/status": 1,
+        "ticket/msa": 1,
+        "result/download": 1,
+    }
+
+
+def test_search_keeps_no_ticket_without_id(tmp_path, monkeypatch):
+    job = SearchJob(["ACDEFGHIK"], "env", False, tmp_path.joinpath("out.tar.gz"))
+    with MMseqs2Client("http://localhost:1", "colabfold/test") as client:
+        # a stale ticket of an earlier submit of the same query
+        job.ticket_id, job.endpoint = "stale", client.endpoints[0]
+        job.save_ticket()
+        job.ticket_id, job.endpoint = None, None
+        monkeypatch.setattr(job, "load_ticket", lambda: None)
+        monkeypatch.setattr(
+            client, "submit", lambda *args, **kwargs: {"status": "ERROR"}
+        )
+        client.search([job])
+
+    assert job.error is not None
+    assert job.ticket_id is None
+    assert not job.ticket_file.exists()
+
+
+def test_search_spreads_over_endpoints(tmp_path):
+    with MockMSAServer(polls_until_complete=2) as a, MockMSAServer(
+        polls_until_complete=2
+    ) as b:
+        with MMseqs2Client(
+            f"{a.url},{b.url}", "colabfold/test", backoff=Backoff(initial=0.01)
+        ) as client:
+            jobs = [
+                SearchJob(
+                    [f"ACDEFGHIK{'L' * i}"],
+                    "env",
+                    False,
+                    tmp_path.joinpath(f"{i}.tar.gz"),
+                )
+                for i in range(8)
+            ]
+            client.search(jobs)
+            assert [endpoint.outstanding for endpoint in client.endpoints] == [0, 0]
+
+    assert all(job.error is None and job.tar_gz_file.is_file() for job in jobs)
+    assert a.requests["ticket/msa"] == 4
+    assert b.requests["ticket/msa"] == 4
+
+
+def test_search_fails_over_to_healthy_endpoint(tmp_path, monkeypatch):
+    backoff = Backoff(initial=0.01, maximum=0.02)
+    with MockMSAServer(polls_until_complete=10**6) as a, MockMSAServer() as b:
+        # a stops answering while the ticket is running
+        ticket_status = a.ticket_status
+
+        def ticket_status_then_down(ticket_id, poll):
+            a.down = poll
+            return ticket_status(ticket_id, poll)
+
+        monkeypatch.setattr(a, "ticket_status", ticket_status_then_down)
+        with MMseqs2Client(
+            f"{a.url},{b.url}", "colabfold/test", backoff=backoff
+        ) as client:
+            job = SearchJob(
+                ["ACDEFGHIK"], "env", False, tmp_path.joinpath("out.tar.gz")
+            )
+            client.search([job])
+            assert not client.endpoints[0].healthy()
+
+    assert job.error is None
+    assert job.tar_gz_file.is_file()
+    assert a.requests["ticket/msa"] == 1
+    assert b.requests["ticket/msa"] == 1
+
+
+def test_rate_limiter_shared_between_instances(tmp_path):
+    # separate instances lock the file independently, like separate processes
+    limiters = [RateLimiter(tmp_path.joinpath("rate_limit"), rate=20) for _ in range(2)]
+    start = time.monotonic()
+    threads = [
+        threading.Thread(target=lambda l=limiter: [l.acquire() for _ in range(5)])
+        for limiter in limiters
+    ]
+    [thread.start() for thread in threads]
+    [thread.join() for thread in threads]
+
+    # 10 tokens at 20/s with a burst of one
+    assert time.monotonic() - start >= 9 / 20
+    assert sum(limiter.waited for limiter in limiters) > 0
+
+
+def test_search_reports_rate_limit_wait(tmp_path, caplog):
+    caplog.set_level(logging.INFO)
+    limiter = RateLimiter(tmp_path.joinpath("rate_limit"), rate=10)
+    with MockMSAServer() as server, MMseqs2Client(
+        server.url, "colabfold/test", rate_limiter=limiter
+    ) as client:
+        jobs = [
+            SearchJob(
+                [f"ACDEFGHIK{'L' * i}"], "env", False, tmp_path.joinpath(f"{i}.tar.gz")
+            )
+            for i in range(3)
+        ]
+        client.search(jobs)
+
+    assert all(job.error is None for job in jobs)
+    assert limiter.waited >= 0.15
+    assert "for the shared MSA submission rate limit" in caplog.text
+
+
+def test_run_mmseqs2_return_shape(tmp_path):
+    seqs = ["MRILPISTIKG", "MPYTVRFTTTA", "MRILPISTIKG"]
+    with MockMSAServer() as server, MMseqs2Client(
+        server.url, "colabfold/test"
+    ) as client:
+        a3m_lines = run_mmseqs2(seqs, str(tmp_path.joinpath("job")), client=client)
+        paired = run_mmseqs2(
+            seqs[:2], str(tmp_path.joinpath("job")), use_pairing=True, client=client
+        )
+
+    assert len(a3m_lines) == 3
+    assert a3m_lines[0] == a3m_lines[2]
+    assert a3m_lines[0].startswith(">101\nMRILPISTIKG\n>UniRef100_101\n")
+    assert ">ENV_101\n" in a3m_lines[0]
+    assert a3m_lines[1].startswith(">102\nMPYTVRFTTTA\n")
+    assert paired[1].startswith(">102\nMPYTVRFTTTA\n>UP102\n")
+    # deduplicated before submitting
+    assert server.requests["ticket/msa"] == 1
+
+
+def test_selective_extraction_and_index(tmp_path):
+    query = "".join(f">{101 + i}\nMRILPISTIKG{'A' * i}\n" for i in range(5))
+    tmp_path.joinpath("out.tar.gz").write_bytes(
+        make_result_archive(query, "env", False)
+    )
+    extract_members(tmp_path.joinpath("out.tar.gz"), tmp_path, ["uniref.a3m"])
+
+    assert [f.name for f in tmp_path.iterdir() if f.suffix != ".gz"] == ["uniref.a3m"]
+    a3m_file = tmp_path.joinpath("uniref.a3m")
+    index = index_a3m(a3m_file)
+    assert sorted(index) == [101, 102, 103, 104, 105]
+    blocks = read_a3m_blocks(a3m_file, index, [103])
+    assert list(blocks) == [103]
+    assert join_a3m_blocks(blocks[103], 103) == (
+        ">103\nMRILPISTIKGAA\n>UniRef100_103\nmRILPISTIKGAA\n"
+    )
+
+
+def test_search_survives_faulty_server(tmp_path):
+    archive = make_result_archive(">101\nACDEFGHIK\n", "env", False)
+    backoff = Backoff(initial=0.01, maximum=0.02)
+    with MockMSAServer(
+        polls_until_complete=1,
+        error_rate=0.2,
+        ratelimit_rate=0.3,
+        retry_after=0.01,
+        archive=archive,
+    ) as server, MMseqs2Client(server.url, "colabfold/test", backoff=backoff) as client:
+        jobs = [
+            SearchJob(
+                [f"ACDEFGHIK{'L' * i}"], "env", False, tmp_path.joinpath(f"{i}.tar.gz")
+            )
+            for i in range(20)
+        ]
+        client.search(jobs)
+
+    assert all(job.error is None for job in jobs)
+    assert all(job.tar_gz_file.read_bytes() == archive for job in jobs)
+    assert server.requests["dropped"] > 0 and server.requests["ratelimit"] > 0
+    assert server.bytes_sent >= 20 * len(archive)
+
+
+def test_benchmark_msa_client():
+    from tests.benchmark_msa_client import benchmark
+
+    result = benchmark(10, 1, 4, 1, 0.0, 0.0, 0.0, 0.01)
+    assert result["tickets"] == 10 and result["failed"] == 0
+    assert result["p50"] <= result["p99"] <= result["max"]
+
+
+def test_request_retries_back_off(monkeypatch):
+    import pytest
+    import requests
+
+    backoff = Backoff(initial=0.01, maximum=0.02)
+    with MMseqs2Client(
+        "http://localhost:1", "colabfold/test", backoff=backoff
+    ) as client:
+        calls = []
+        sleeps = []
+        errors = []
+
+        def request(*args, **kwargs):
+            calls.append(time.monotonic())
+            if errors:
+                raise errors.pop(0)
+            return requests.Response()
+
+        monkeypatch.setattr(client.session, "request", request)
+        monkeypatch.setattr(time, "sleep", sleeps.append)
+        monkeypatch.setattr(client, "_json", lambda res: {"status": "RUNNING"})
+
+        # timeouts and connection errors are retried for longer than other errors, e.g.
+        # during a network outage
+        errors[:] = [requests.exceptions.Timeout()] * 10 + [
+            requests.exceptions.ConnectionError()
+        ] * 10
+        assert client.status("ticket") == {"status": "RUNNING"}
+        assert len(calls) == 21
+        assert len(sleeps) == 20 and all(0 < t <= 0.024 for t in sleeps)
+
+        # other errors only max_request_retries times
+        calls.clear()
+        errors[:] = [requests.exceptions.InvalidURL()] * 10
+        with pytest.raises(requests.exceptions.InvalidURL):
+            client.status("ticket")
+        assert len(calls) == client.max_request_retries + 1
+
+        # a request on a ticket stops at the deadline of the ticket
+        calls.clear()
+        errors[:] = [requests.exceptions.Timeout()] * 10
+        with pytest.raises(TimeoutError):
+            client.status("ticket", deadline=time.monotonic() - 1)
+        assert len(calls) == 1
+
+
+def test_close_clients():
+    from colabfold.mmseqs.client import close_clients, get_client
+
+    client = get_client("http://localhost:1", "colabfold/test")
+    assert get_client("http://localhost:1", "colabfold/test") is client
+    close_clients()
+    assert client.executor._shutdown
+    # a closed client is not handed out again
+    new_client = get_client("http://localhost:1", "colabfold/test")
+    assert new_client is not client
+    close_clients()
+
+
+def test_run_mmseqs2_ticket_timeout(tmp_path):
+    import pytest
+
+    from colabfold.mmseqs.client import close_clients, get_client
+
+    with MockMSAServer(polls_until_complete=10**6) as server:
+        # run_mmseqs2 uses the shared client, as run(msa_ticket_timeout=...) sets it
+        client = get_client(server.url, "colabfold/test", ticket_timeout=0.2)
+        client.backoff = Backoff(initial=0.01, maximum=0.02)
+        try:
+            with pytest.raises(TimeoutError):
+                run_mmseqs2(
+                    ["ACDEFGHIK"],
+                    str(tmp_path.joinpath("job")),
+                    host_url=server.url,
+                    user_agent="colabfold/test",
+                )
+        finally:
+            close_clients()
+    assert server.requests["ticket/msa"] == 1
+
+
+def test_concurrent_searches_share_the_schedule(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+
+    backoff = Backoff(initial=0.01, maximum=0.02)
+    with MockMSAServer(polls_until_complete=3) as server, MMseqs2Client(
+        server.url, "colabfold/test", backoff=backoff
+    ) as client:
+        # the threads that hand the due tickets to the workers of the client
+        threads = set()
+        executor_map = client.executor.map
+
+        def recording_map(fn, *iterables):
+            threads.add(threading.current_thread().name)
+            return executor_map(fn, *iterables)
+
+        client.executor.map = recording_map
+        jobs = [
+            SearchJob(
+                [f"ACDEFGHIK{'L' * i}"], "env", False, tmp_path.joinpath(f"{i}.tar.gz")
+            )
+            for i in range(6)
+        ]
+        # one search per thread, like the prefetch threads of colabfold_batch
+        with ThreadPoolExecutor(3) as executor:
+            list(
+                executor.map(lambda n: client.search(jobs[2 * n : 2 * n + 2]), range(3))
+            )
+
+    assert all(job.error is None and job.tar_gz_file.is_file() for job in jobs)
+    assert threads == {"mmseqs2-scheduler"}
+    assert client.scheduler is None and client.schedule == []
+    assert server.requests["ticket/status"] == 18
@@ -3,14 +3,17 @@ from unittest import mock
 import haiku
 import logging
 import pytest
+import random
 import re
 from absl import logging as absl_logging
 from functools import lru_cache
 from zipfile import ZipFile
 
+from alphafold.data import pipeline
 from alphafold.model.data import get_model_haiku_params
 from alphafold.model.tf import utils
-from colabfold.batch import msa_to_str, unserialize_msa, get_queries
+from colabfold.batch import msa_to_str, unserialize_msa, get_queries, split_msa_row, split_msa_rows
+from colabfold.batch import complex_msa_features, pair_msa
 from colabfold.batch import run
 from colabfold.download import download_alphafold_params
 from tests.mock import MockRunModel, MMseqs2Mock
@@ -508,3 +511,219 @@ def test_msa_serialization(pytestconfig):
     assert not paired_alignment
     assert query_sequence_unique_ret == [query_sequence]
     assert query_sequence_cardinality_ret == [1]
+
+def test_split_msa_rows():
+    rng = random.Random(0)
+    query_seq_len = [5, 0, 3, 4]
+    rows = ["", "AAAAACCCGGGG", "aaAAAAAccCCCgGGGGgg", "-----c---CC--", "AAAAA", "AAAAAC", "AAAAAß-CCGGGG"]
+    for _ in range(200):
+        rows.append("".join(rng.choice("ACDa-c") for _ in range(rng.randint(0, 20))))
+    chains, has_amino_acid = split_msa_rows(rows, query_seq_len)
+    for row, row_chains, row_has_amino_acid in zip(rows, chains, has_amino_acid.tolist()):
+        assert (row_chains, row_has_amino_acid) == split_msa_row(row, query_seq_len)
+    assert split_msa_rows(rows[:-1], query_seq_len)[0] == chains[:-1]
+
+
+def test_complex_msa_features():
+    rng = random.Random(0)
+    headers = ["UniRef100_A0A", "tr|A0A146SKV9|A0A146SKV9_FUNHE", "sp|P0C2L1|A3X1_LOXLA", ""]
+
+    def random_msa(seq, rows):
+        lines = [f">{101}\n{seq}\n"]
+        for _ in range(rows):
+            row = "".join(rng.choice(["", "", "", "a", "cd"]) + rng.choice("ACD-") for _ in seq)
+            lines.append(f">{rng.choice(headers)}\n{row}{rng.choice(['', 'ga'])}\n")
+        return "".join(lines)
+
+    for query_seqs_unique, query_seqs_cardinality in [
+        (["MRILP", "GSH", "AAAA"], [1, 2, 1]),
+        (["MRILP", "GSH"], [1, 1]),
+        (["MRILP"], [3]),
+    ]:
+        paired_rows = rng.randint(1, 10)
+        paired = [random_msa(seq, paired_rows) for seq in query_seqs_unique]
+        unpaired = [random_msa(seq, rng.randint(0, 10)) for seq in query_seqs_unique]
+        full_sequence = "".join(
+            seq * n for seq, n in zip(query_seqs_unique, query_seqs_cardinality)
+        )
+        for paired_msa, unpaired_msa in [(paired, unpaired), (None, unpaired), (paired, None)]:
+            a3m = f">0\n{full_sequence}\n" + pair_msa(
+                query_seqs_unique, query_seqs_cardinality, paired_msa, unpaired_msa
+            )
+            expected = pipeline.make_msa_features([pipeline.parsers.parse_a3m(a3m)])
+            features = complex_msa_features(
+                query_seqs_unique, query_seqs_cardinality, paired_msa, unpaired_msa
+            )
+            for key in expected:
+                assert features[key].dtype == expected[key].dtype
+                assert (features[key] == expected[key]).all()
+
+
+def test_mock_template_views():
+    import numpy as np
+    from colabfold.alphafold.msa import make_fixed_size
+    from colabfold.batch import mk_mock_template
+
+    first = mk_mock_template("MRILP")
+    second = mk_mock_template(["MRI", "LP"])
+    assert first["template_all_atom_positions"] is second["template_all_atom_positions"]
+    assert first["template_all_atom_positions"].shape == (1, 5, 37, 3)
+    assert not first["template_aatype"].flags.writeable
+    assert (first["template_aatype"].argmax(-1) == 0).all()
+    assert (first["template_confidence_scores"] == 1).all()
+
+    schema = {"template_aatype": [None, "num residues placeholder", None]}
+    aatype = {"template_aatype": first["template_aatype"]}
+    fixed = make_fixed_size(dict(aatype), schema, 0, 0, num_res=5)
+    # already the right size, not copied
+    assert fixed["template_aatype"] is first["template_aatype"]
+    padded = make_fixed_size(dict(aatype), schema, 0, 0, num_res=8)
+    assert padded["template_aatype"].shape == (1, 8, 22)
+    assert (padded["template_aatype"][:, 5:] == 0).all()
+
+
+def test_homomer_multimer_features():
+    import numpy as np
+    from colabfold.batch import build_monomer_feature, build_multimer_feature, mk_mock_template
+    from colabfold.batch import process_multimer_features
+
+    rng = random.Random(0)
+    query = "".join(rng.choices("ACDEFGHIKLMNPQRSTVWY", k=25))
+    for num_copies, num_rows in [(1, 10), (3, 10), (4, 2100)]:
+        unpaired = f">101\n{query}\n" + "".join(
+            f">U{i}\n{''.join(rng.choice([c, '-', 'A']) for c in query)}\n" for i in range(num_rows)
+        )
+        feature_dict = build_monomer_feature(query, unpaired, mk_mock_template(query))
+        feature_dict.update(build_multimer_feature(f">101\n{query}\n"))
+        chain_ids = "ABCD"[:num_copies]
+        # the copies share one dict as in generate_input_feature, which merges them by tiling
+        shared = process_multimer_features({chain: feature_dict for chain in chain_ids})
+        # separate dicts go through merge_chain_features of AlphaFold
+        merged = process_multimer_features({chain: dict(feature_dict) for chain in chain_ids})
+        assert shared.keys() == merged.keys()
+        for key in merged:
+            assert np.asarray(shared[key]).dtype == np.asarray(merged[key]).dtype, key
+            np.testing.assert_array_equal(shared[key], merged[key], err_msg=key)
+
+
+def test_pad_input_multimer():
+    import numpy as np
+    from colabfold.batch import build_monomer_feature, build_multimer_feature, mk_mock_template
+    from colabfold.batch import crop_multimer_result, pad_input_multimer, process_multimer_features
+
+    rng = random.Random(0)
+    features_for_chain = {}
+    for chain_id, length in zip("AB", [20, 13]):
+        query = "".join(rng.choices("ACDEFGHIKLMNPQRSTVWY", k=length))
+        feature_dict = build_monomer_feature(query, f">101\n{query}\n", mk_mock_template(query))
+        feature_dict.update(build_multimer_feature(f">101\n{query}\n"))
+        features_for_chain[chain_id] = feature_dict
+    features = process_multimer_features(features_for_chain, min_num_seq=8)
+
+    padded = pad_input_multimer(features, 40, 16)
+    assert padded.keys() == features.keys()
+    assert padded["aatype"].shape == (40,)
+    assert padded["msa"].shape == padded["msa_mask"].shape == (16, 40)
+    assert padded["template_all_atom_positions"].shape == (4, 40, 37, 3)
+    assert padded["all_atom_mask"].shape == (40, 37)
+    assert padded["cluster_bias_mask"].shape == (16,)
+    # the real residues and rows are unchanged, the padding is masked out
+    for key in features:
+        if np.ndim(features[key]) > 0:
+            real = padded[key][tuple(slice(0, n) for n in np.shape(features[key]))]
+            np.testing.assert_array_equal(real, features[key], err_msg=key)
+    assert (padded["seq_mask"][33:] == 0).all()
+    assert (padded["msa_mask"][:, 33:] == 0).all() and (padded["msa_mask"][8:] == 0).all()
+    assert (padded["template_all_atom_mask"][:, 33:] == 0).all()
+    # the padding is a chain of its own
+    assert (padded["asym_id"][33:] == 3).all() and (padded["entity_id"][33:] == 3).all()
+
+    result = {
+        "plddt": np.ones(40),
+        "predicted_aligned_error": np.ones((40, 40)),
+        "ptm": np.float16(0.5),
+        "distogram": {"logits": np.ones((40, 40, 64)), "bin_edges": np.ones(63)},
+        "masked_msa": {"logits": np.ones((16, 40, 22))},
+        "structure_module": {"final_atom_positions": np.ones((40, 37, 3))},
+    }
+    cropped = crop_multimer_result(result, 33)
+    assert cropped["plddt"].shape == (33,)
+    assert cropped["predicted_aligned_error"].shape == (33, 33)
+    assert cropped["ptm"] == result["ptm"]
+    assert cropped["distogram"]["logits"].shape == (33, 33, 64)
+    assert cropped["distogram"]["bin_edges"].shape == (63,)
+    assert cropped["masked_msa"]["logits"].shape == (16, 33, 22)
+    assert cropped["structure_module"]["final_atom_positions"].shape == (33, 37, 3)
+
+
+def test_padded_multimer_prediction(tmp_path):
+    """A small multimer model with random params predicts the same for the real residues of
+    padded and unpadded inputs"""
+    import jax
+    import numpy as np
+    from alphafold.model import config, model
+    from colabfold.batch import build_monomer_feature, build_multimer_feature, mk_mock_template
+    from colabfold.batch import predict_structure, process_multimer_features
+
+    rng = random.Random(0)
+    lengths = [12, 9]
+    features_for_chain = {}
+    for chain_id, length in zip("AB", lengths):
+        query = "".join(rng.choices("ACDEFGHIKLMNPQRSTVWY", k=length))
+        # homologs, so that the sampled MSA rows make a difference
+        homologs = [
+            "".join(c if rng.random() < 0.7 else rng.choice("ACDEFGHIKLMNPQRSTVWY-") for c in query)
+            for _ in range(7)
+        ]
+        a3m = f">101\n{query}\n" + "".join(f">{n}\n{row}\n" for n, row in enumerate(homologs))
+        feature_dict = build_monomer_feature(query, a3m, mk_mock_template(query))
+        feature_dict.update(build_multimer_feature(a3m))
+        features_for_chain[chain_id] = feature_dict
+    features = process_multimer_features(features_for_chain, min_num_seq=8)
+    seq_len = sum(lengths)
+
+    cfg = config.model_config("model_1_multimer_v3")
+    cfg.model.num_recycle = 0
+    cfg.model.stop_at_score = 100
+    cfg.model.rank_by = "multimer"
+    evoformer = cfg.model.embeddings_and_evoformer
+    evoformer.num_msa = 4
+    evoformer.num_extra_msa = 4
+    evoformer.evoformer_num_block = 1
+    evoformer.extra_msa_stack_num_block = 1
+    evoformer.template.enabled = False
+    cfg.model.heads.structure_module.num_layer = 1
+    # in bfloat16, the sums over the padded axes are rounded differently
+    cfg.model.global_config.bfloat16 = False
+    model_runner = model.RunModel(cfg, None)
+    prev = {
+        "prev_msa_first_row": np.zeros([seq_len, 256]),
+        "prev_pair": np.zeros([seq_len, seq_len, 128]),
+        "prev_pos": np.zeros([seq_len, 37, 3]),
+    }
+    # random params of the right shapes, without running the (slow) initialization
+    shapes = jax.eval_shape(
+        lambda key: model_runner.init(key, {**features, "prev": prev}), jax.random.PRNGKey(0)
+    )
+    leaves, tree = jax.tree_util.tree_flatten(shapes)
+    np_rng = np.random.default_rng(0)
+    params = haiku.data_structures.to_mutable_dict(
+        jax.tree_util.tree_unflatten(
+            tree, [(0.1 * np_rng.normal(size=leaf.shape)).astype(leaf.dtype) for leaf in leaves]
+        )
+    )
+
+    outputs = []
+    for pad_len in [seq_len, seq_len + 5]:
+        result_dir = tmp_path.joinpath(str(pad_len))
+        result_dir.mkdir()
+        predict_structure(
+            "query", result_dir, dict(features), is_complex=True, use_templates=False,
+            sequences_lengths=lengths, pad_len=pad_len, model_type="alphafold2_multimer_v3",
+            model_runner_and_params=[("model_1", model_runner, params)],
+        )
+        outputs.append(
+            [result_dir.joinpath(f"query_{x}_rank_001_alphafold2_multimer_v3_model_1_seed_000.{ext}").read_text()
+             for x, ext in [("unrelaxed", "pdb"), ("scores", "json")]]
+        )
+    assert outputs[0] == outputs[1]
@@ -0,0 +1,37 @@
+import os
+import subprocess
+import sys
+
+SCRIPT = """
+import sys
+import jax
+import jax.numpy as jnp
+from colabfold.compilation_cache import enable_compilation_cache
+
+stats = enable_compilation_cache(sys.argv[1], min_compile_time_secs=0)
+jax.jit(lambda x: jnp.tanh(x @ x.T).sum())(jnp.ones((32, 16))).block_until_ready()
+print(stats.hits, stats.misses)
+"""
+
+
+def test_compilation_cache_across_processes(tmp_path):
+    # the persistent cache is only used on CPU with the XLA runtime
+    env = {
+        **os.environ,
+        "XLA_FLAGS": "--xla_cpu_use_xla_runtime=true",
+        "JAX_PLATFORMS": "cpu",
+    }
+    counts = []
+    for _ in range(2):
+        output = subprocess.run(
+            [sys.executable, "-c", SCRIPT, str(tmp_path)],
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        counts.append(tuple(map(int, output.split())))
+    (first_hits, first_misses), (second_hits, second_misses) = counts
+    assert first_hits == 0 and first_misses > 0
+    assert second_hits == first_misses and second_misses == 0
+    assert any(tmp_path.iterdir())
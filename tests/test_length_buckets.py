@@ -0,0 +1,59 @@
+import itertools
+import random
+
+import pytest
+
+from colabfold.length_buckets import (
+    BucketPlan,
+    evaluate_plan,
+    greedy_pad_lengths,
+    plan_length_buckets,
+)
+
+
+def brute_force_plan(lengths, predictions_per_query):
+    distinct = sorted(set(lengths))
+    best = None
+    for num_buckets in range(1, len(distinct) + 1):
+        for shorter in itertools.combinations(distinct[:-1], num_buckets - 1):
+            plan = BucketPlan(list(shorter) + [distinct[-1]], 0.0, 0.0)
+            pad_lengths = [plan.pad_len(length) for length in lengths]
+            cost = evaluate_plan(
+                lengths, pad_lengths, predictions_per_query
+            ).estimated_seconds
+            if best is None or cost < best[0] - 1e-9:
+                best = (cost, plan.buckets)
+    return best
+
+
+def test_plan_length_buckets_optimal():
+    rng = random.Random(0)
+    for _ in range(20):
+        lengths = [
+            rng.choice([rng.randint(10, 100), rng.randint(100, 1500)])
+            for _ in range(rng.randint(1, 12))
+        ]
+        predictions_per_query = rng.choice([1, 5, 25])
+        plan = plan_length_buckets(lengths, predictions_per_query)
+        cost, buckets = brute_force_plan(lengths, predictions_per_query)
+        assert plan.estimated_seconds == pytest.approx(cost)
+        assert plan.buckets[-1] == max(lengths)
+        assert all(plan.pad_len(length) >= length for length in lengths)
+
+
+def test_plan_length_buckets_tradeoff():
+    lengths = [100, 150, 1000]
+    # padding 100 to 150 costs less than compiling for 100, unless predicted often
+    assert plan_length_buckets(lengths, 1).buckets == [150, 1000]
+    assert plan_length_buckets(lengths, 1000).buckets == [100, 150, 1000]
+    assert plan_length_buckets([], 1).buckets == []
+    with pytest.raises(ValueError):
+        plan_length_buckets(lengths).pad_len(1001)
+
+
+def test_greedy_pad_lengths():
+    # the padding of run with --recompile-padding
+    assert greedy_pad_lengths([10, 13], 10) == [13, 13]
+    assert greedy_pad_lengths([10, 15, 21, 30], 10) == [20, 20, 30, 30]
+    assert greedy_pad_lengths([100, 110, 125], 1.1) == [111, 111, 125]
+    assert evaluate_plan([10, 13], [13, 13]).compiles == 1
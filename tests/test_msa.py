@@ -37,4 +37,99 @@ def test_get_msa_and_templates(pytestconfig, caplog, tmp_path):
         assert query_seqs_unique == [Q60262]
         assert query_seqs_cardinality == [1]
 
-    assert caplog.messages == []
\ No newline at end of file
+    assert caplog.messages == []
+
+def test_run_msa_only_prefetch(pytestconfig, caplog, tmp_path):
+    import logging
+    from colabfold.batch import run
+
+    caplog.set_level(logging.INFO)
+    queries = [("5AWL_1", "YYDPETGTWY", None), ("6A5J", "IKKILSKIKKLLK", None)]
+    mmseqs2mock = MMseqs2Mock(pytestconfig.rootpath, "batch")
+    with mock.patch("colabfold.colabfold.run_mmseqs2", mmseqs2mock.mock_run_mmseqs2):
+        run(queries, tmp_path, num_models=0, is_complex=False, msa_prefetch=2)
+
+    assert "Query 1/2: 5AWL_1 (length 10)" in caplog.messages
+    assert caplog.messages.index("Query 1/2: 5AWL_1 (length 10)") < caplog.messages.index(
+        "Query 2/2: 6A5J (length 13)"
+    )
+    for jobname in ["5AWL_1", "6A5J"]:
+        assert tmp_path.joinpath(f"{jobname}.a3m").is_file()
+        assert tmp_path.joinpath(f"{jobname}.msa", "meta.json").is_file()
+
+
+def test_run_msa_only_feature_workers(pytestconfig, caplog, tmp_path):
+    import logging
+    from colabfold.batch import run
+
+    caplog.set_level(logging.INFO)
+    queries = [("5AWL_1", "YYDPETGTWY", None), ("6A5J", "IKKILSKIKKLLK", None)]
+    mmseqs2mock = MMseqs2Mock(pytestconfig.rootpath, "batch")
+    features = []
+    shared_memory = tmp_path.joinpath("shm")
+    shared_memory.mkdir()
+    with mock.patch("colabfold.colabfold.run_mmseqs2", mmseqs2mock.mock_run_mmseqs2), mock.patch(
+        "colabfold.workers.shared_memory_dir", lambda: shared_memory
+    ):
+        run(
+            queries, tmp_path, num_models=0, is_complex=False, msa_prefetch=1, feature_workers=2,
+            feature_dict_callback=features.append, msa_max_rows=1,
+        )
+
+    assert [feature["sequence"][0] for feature in features] == [b"YYDPETGTWY", b"IKKILSKIKKLLK"]
+    assert features[0]["msa"].shape[1] == 10
+    # the log records of the workers reach the log of the run
+    assert "Filtered the unpaired MSA of 6A5J" in caplog.text
+    # no shared arrays are left behind
+    assert list(shared_memory.iterdir()) == []
+    for jobname in ["5AWL_1", "6A5J"]:
+        assert tmp_path.joinpath(f"{jobname}_coverage.png").is_file()
+
+
+def test_run_msa_only_feature_cache(pytestconfig, caplog, tmp_path):
+    import logging
+
+    import numpy as np
+    from colabfold.batch import run
+
+    caplog.set_level(logging.INFO)
+    queries = [("5AWL_1", "YYDPETGTWY", None)]
+    mmseqs2mock = MMseqs2Mock(pytestconfig.rootpath, "batch")
+    features = []
+    with mock.patch("colabfold.colabfold.run_mmseqs2", mmseqs2mock.mock_run_mmseqs2):
+        # the third run loads the cached features in a worker process
+        for result_dir, feature_workers in [("first", 0), ("second", 0), ("third", 1)]:
+            run(
+                queries, tmp_path.joinpath(result_dir), num_models=0, is_complex=False,
+                feature_workers=feature_workers, feature_cache_dir=tmp_path.joinpath("cache"),
+                feature_dict_callback=features.append,
+            )
+
+    # the second run in this process, the third one in a worker process
+    assert caplog.messages.count("Loaded the input features of 5AWL_1 from the feature cache") == 2
+    for cached in features[1:]:
+        assert cached.keys() == features[0].keys()
+        for key in features[0]:
+            np.testing.assert_array_equal(cached[key], features[0][key])
+
+
+def test_run_msa_only_msa_filter(pytestconfig, caplog, tmp_path):
+    import logging
+    from colabfold.batch import run
+
+    caplog.set_level(logging.INFO)
+    queries = [("6A5J", "IKKILSKIKKLLK", None)]
+    mmseqs2mock = MMseqs2Mock(pytestconfig.rootpath, "batch")
+    features = []
+    with mock.patch("colabfold.colabfold.run_mmseqs2", mmseqs2mock.mock_run_mmseqs2):
+        for msa_max_rows in [None, 1]:
+            run(
+                queries, tmp_path, num_models=0, is_complex=False, msa_max_rows=msa_max_rows,
+                feature_dict_callback=features.append,
+            )
+
+    assert features[0]["msa"].shape[0] == 2
+    # only the query is left
+    assert features[1]["msa"].shape[0] == 1
+    assert (features[1]["msa"] == features[0]["msa"][:1]).all()
+    assert any(message.startswith("Filtered the unpaired MSA of 6A5J") for message in caplog.messages)
@@ -0,0 +1,111 @@
+import random
+
+import numpy as np
+from alphafold.data import pipeline
+
+from colabfold.batch import (
+    generate_input_feature,
+    get_queries,
+    make_msa_features,
+    msa_to_str,
+    unserialize_msa,
+)
+from colabfold.msa_container import BinaryMSA, load_msa_container, save_msa_container
+
+UNPAIRED = [
+    ">101\nAAAAAAAA\n>tr|A0A146SKV9|A0A146SKV9_FUNHE desc\nAACCcccVVAAxx\n",
+    ">102\nCCCC\n>UP1\nCCCC\n>UP2\nCaCaCC\n",
+]
+PAIRED = [">101\nAAAAAAAA\n>UP1\nVVaVVAAAA\n", ">102\nCCCC\n>UP2\nGGGG\n"]
+
+
+def test_binary_msa_roundtrip():
+    for a3m in UNPAIRED + PAIRED:
+        msa = BinaryMSA.from_a3m(a3m)
+        assert msa.to_a3m() == a3m
+        expected = pipeline.make_msa_features([pipeline.parsers.parse_a3m(a3m)])
+        features = msa.msa_features()
+        assert features.keys() == expected.keys()
+        for key in expected:
+            assert features[key].dtype == expected[key].dtype
+            np.testing.assert_array_equal(features[key], expected[key])
+
+
+def test_msa_container(tmp_path):
+    msa = msa_to_str(UNPAIRED, PAIRED, ["AAAAAAAA", "CCCC"], [2, 1])
+    unpacked = unserialize_msa([msa], ["AAAAAAAA", "AAAAAAAA", "CCCC"])
+    save_msa_container(tmp_path.joinpath("job.msa"), *unpacked)
+
+    (
+        unpaired_msa,
+        paired_msa,
+        query_seqs_unique,
+        query_seqs_cardinality,
+        template_features,
+    ) = load_msa_container(tmp_path.joinpath("job.msa"))
+    assert isinstance(unpaired_msa[0].residues, np.memmap)
+    assert [m.to_a3m() for m in unpaired_msa] == unpacked[0]
+    assert [m.to_a3m() for m in paired_msa] == unpacked[1]
+    assert (query_seqs_unique, query_seqs_cardinality) == (["AAAAAAAA", "CCCC"], [2, 1])
+    assert template_features[0].keys() == unpacked[4][0].keys()
+
+    # the features are computed from the container directly
+    for model_type in ["alphafold2_ptm", "alphafold2_multimer_v3"]:
+        expected, _ = generate_input_feature(
+            unpacked[2],
+            unpacked[3],
+            unpacked[0],
+            unpacked[1],
+            unpacked[4],
+            True,
+            model_type,
+            512,
+        )
+        features, _ = generate_input_feature(
+            query_seqs_unique,
+            query_seqs_cardinality,
+            unpaired_msa,
+            paired_msa,
+            template_features,
+            True,
+            model_type,
+            512,
+        )
+        assert features.keys() == expected.keys()
+        for key in expected:
+            np.testing.assert_array_equal(features[key], expected[key])
+
+    queries, is_complex = get_queries(tmp_path)
+    assert queries == [
+        ("job", ["AAAAAAAA", "AAAAAAAA", "CCCC"], tmp_path.joinpath("job.msa"))
+    ]
+    assert is_complex
+
+
+def test_msa_features_match_alphafold():
+    rng = random.Random(0)
+    headers = [
+        "UniRef100_A0A",
+        "tr|A0A146SKV9|A0A146SKV9_FUNHE/1-20 desc",
+        " sp|P0C2L1|A3X1_LOXLA",
+        "101",
+        "",
+    ]
+    for _ in range(50):
+        length = rng.randint(1, 30)
+        rows = []
+        for _ in range(rng.randint(1, 20)):
+            row = "".join(
+                rng.choice("acdxy") * rng.choice([0, 0, 0, 1, 3])
+                + rng.choice("ACDXUZ-")
+                for _ in range(length)
+            ) + rng.choice(["", "aa"])
+            # sequences split over several lines are parsed too
+            split = rng.randint(0, len(row))
+            rows.append(f">{rng.choice(headers)}\n{row[:split]}\n{row[split:]}\n")
+        a3m = "".join(rows)
+        expected = pipeline.make_msa_features([pipeline.parsers.parse_a3m(a3m)])
+        features = make_msa_features(a3m)
+        for key in expected:
+            assert features[key].dtype == expected[key].dtype
+            np.testing.assert_array_equal(features[key], expected[key])
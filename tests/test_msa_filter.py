@@ -0,0 +1,143 @@
+import random
+
+import numpy as np
+
+from colabfold.msa_container import BinaryMSA
+from colabfold.msa_filter import MSAFilter, reduce_redundancy
+
+
+def reference_filter(rows, min_coverage, min_identity, max_seq_id, max_rows):
+    """Per row loop over the match columns of the A3M rows"""
+    matches = ["".join(c for c in row if not c.islower()) for row in rows]
+    query = matches[0]
+
+    def identity(a, b):
+        both = [(x, y) for x, y in zip(a, b) if x != "-" and y != "-"]
+        return sum(x == y for x, y in both) / max(len(both), 1)
+
+    kept = []
+    for n, row in enumerate(matches):
+        covered = sum(c != "-" for c in row)
+        if n > 0 and (
+            covered / len(query) < min_coverage or identity(row, query) < min_identity
+        ):
+            continue
+        if any(identity(row, matches[k]) > max_seq_id for k in kept):
+            continue
+        kept.append(n)
+    return kept[:max_rows]
+
+
+def random_a3m(rng, length, num_rows):
+    query = "".join(rng.choices("ACDEFGHIKLMNPQRSTVWY", k=length))
+    rows = [query]
+    for _ in range(num_rows):
+        parent = rng.choice(rows)
+        row = []
+        for c in parent.translate(str.maketrans("", "", "acdefghiklmnpqrstvwy")):
+            r = rng.random()
+            if r < 0.1:
+                row.append("-")
+            elif r < 0.25:
+                row.append(rng.choice("ACDEFGHIKLMNPQRSTVWYX"))
+            else:
+                row.append(c)
+            if rng.random() < 0.02:
+                row.append(rng.choice("acdefg"))
+        if rng.random() < 0.3:
+            start = rng.randint(0, length // 2)
+            row = ["-"] * start + [c for c in row if not c.islower()][start:]
+        rows.append("".join(row))
+    return rows
+
+
+def test_msa_filter_matches_reference():
+    rng = random.Random(0)
+    for length, num_rows in [(30, 50), (12, 300), (40, 600)]:
+        rows = random_a3m(rng, length, num_rows)
+        a3m = "".join(f">{n}\n{row}\n" for n, row in enumerate(rows))
+        msa = BinaryMSA.from_a3m(a3m)
+        for settings in [
+            (0.5, 0.0, 1.0, None),
+            (0.0, 0.6, 1.0, None),
+            (0.0, 0.0, 0.8, None),
+            (0.3, 0.3, 0.9, 40),
+            (0.0, 0.0, 1.0, 10),
+        ]:
+            expected = reference_filter(rows, *settings)
+            filtered = MSAFilter(*settings)(msa)
+            assert filtered.descriptions() == [str(n) for n in expected], settings
+            assert filtered.to_a3m() == "".join(f">{n}\n{rows[n]}\n" for n in expected)
+
+
+def test_reduce_redundancy_across_blocks():
+    rng = random.Random(1)
+    rows = random_a3m(rng, 20, 100)
+    msa = BinaryMSA.from_a3m("".join(f">{n}\n{row}\n" for n, row in enumerate(rows)))
+    candidates = np.arange(len(msa))
+    whole = reduce_redundancy(msa.residues, candidates, 0.7)
+    # comparing across blocks gives the same rows as comparing within one block
+    assert (
+        whole.tolist()
+        == reduce_redundancy(msa.residues, candidates, 0.7, block_size=7).tolist()
+    )
+    assert whole[0] == 0
+    assert (
+        reduce_redundancy(
+            msa.residues, candidates, 0.7, max_rows=5, block_size=3
+        ).tolist()
+        == whole[:5].tolist()
+    )
+
+
+def test_msa_filter_inactive():
+    a3m = ">101\nACDE\n>1\nAC-E\n"
+    assert not MSAFilter().is_active()
+    assert MSAFilter()(a3m).to_a3m() == a3m
+    assert MSAFilter().apply(None) is None
+
+
+def test_reduce_redundancy_large_msa():
+    from colabfold.msa_filter import GAP, one_hot
+
+    # families of a few hundred sequences with 30 to 100% identity to the query
+    rng = np.random.default_rng(0)
+    length, num_rows, num_families = 300, 10000, 400
+    alphabet = np.frombuffer(b"ACDEFGHIKLMNPQRSTVWY", dtype=np.uint8)
+    query = rng.choice(alphabet, length)
+    mutated = rng.random((num_families, length)) < rng.uniform(
+        0, 0.7, (num_families, 1)
+    )
+    families = np.where(mutated, rng.choice(alphabet, (num_families, length)), query)
+    residues = families[rng.integers(0, num_families, num_rows)]
+    residues = np.where(
+        rng.random(residues.shape) < 0.05,
+        rng.choice(alphabet, residues.shape),
+        residues,
+    )
+    residues = np.where(rng.random(residues.shape) < 0.1, GAP, residues).astype(
+        np.uint8
+    )
+    residues[0] = query
+
+    def identities(a, b):
+        matches = one_hot(a) @ one_hot(b).T
+        overlap = (a != GAP).astype(np.float32) @ (b != GAP).astype(np.float32).T
+        return matches / np.maximum(overlap, 1)
+
+    candidates = np.arange(num_rows)
+    kept = reduce_redundancy(residues, candidates, 0.8)
+    assert kept[0] == 0
+    assert np.all(np.diff(kept) > 0)
+    # the kept rows are not redundant, each removed row is redundant to a kept row
+    similar = identities(residues[kept], residues[kept]) > 0.8
+    assert not np.triu(similar, 1).any()
+    removed = np.setdiff1d(candidates, kept)
+    redundant = identities(residues[removed], residues[kept]) > 0.8
+    assert (redundant & (kept[None, :] < removed[:, None])).any(axis=1).all()
+
+    # with fewer representatives than kept rows, rows are compared with the first ones
+    bounded = reduce_redundancy(residues, candidates, 0.8, max_representatives=100)
+    assert (
+        bounded[: np.searchsorted(bounded, kept[100])].tolist() == kept[:100].tolist()
+    )
@@ -0,0 +1,146 @@
+import json
+import os
+import subprocess
+import sys
+
+SCRIPT = """
+import json
+import sys
+from pathlib import Path
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+
+from colabfold.batch import predict_structure
+from colabfold.multi_device import DevicePool
+
+LENGTH = 6
+
+
+class Runner:
+    # the parts of RunModel that predict_structure uses, one jitted model for all params
+    def __init__(self):
+        self.params = None
+        self.apply = jax.jit(
+            lambda params, seed: jax.nn.sigmoid(
+                params["w"] * (jnp.arange(LENGTH) + seed)
+            )
+        )
+
+    def process_features(self, feature_dict, random_seed):
+        return {key: np.asarray(value)[None] for key, value in feature_dict.items()}
+
+    def predict(self, feat, random_seed, return_representations, callback):
+        plddt = self.apply(self.params, random_seed)
+        device = list(plddt.devices())[0].id if hasattr(plddt, "devices") else -1
+        plddt = 100 * np.asarray(plddt)
+        result = {
+            "plddt": plddt,
+            "mean_plddt": plddt.mean(),
+            "ranking_confidence": plddt.mean(),
+            "structure_module": {
+                "final_atom_positions": np.ones((LENGTH, 37, 3)),
+                "final_atom_mask": np.ones((LENGTH, 37)),
+            },
+            "device": device,
+        }
+        callback(result, 0)
+        return result, 0
+
+
+devices = []
+def prediction_callback(protein, lengths, result, features, tag):
+    devices.append(int(result["device"]))
+
+runner = Runner()
+model_runner_and_params = [
+    (f"model_{n}", runner, {"w": np.float32(0.1 * n)}) for n in range(1, 4)
+]
+feature_dict = {
+    "aatype": np.zeros(LENGTH, dtype=np.int32),
+    "residue_index": np.arange(LENGTH),
+    "asym_id": np.zeros(LENGTH),
+}
+outputs = {}
+for mode in ["sequential", "devices"]:
+    result_dir = Path(sys.argv[1]) / mode
+    result_dir.mkdir()
+    devices.clear()
+    pool = DevicePool() if mode == "devices" else None
+    results = predict_structure(
+        "query", result_dir, feature_dict, is_complex=False, use_templates=False,
+        sequences_lengths=[LENGTH], pad_len=LENGTH, model_type="alphafold2_ptm",
+        model_runner_and_params=model_runner_and_params, num_seeds=2,
+        prediction_callback=prediction_callback, device_pool=pool,
+    )
+    if pool is not None:
+        placed = len(pool.placed)
+        pool.shutdown()
+    outputs[mode] = {
+        "rank": results["rank"],
+        "metric": [m["print_line"] for m in results["metric"]],
+        "files": sorted(f.name for f in result_dir.iterdir()),
+        "scores": [
+            json.loads(f.read_text()) for f in sorted(result_dir.glob("*scores*.json"))
+        ],
+        "devices": list(devices),
+    }
+outputs["num_devices"] = len(jax.local_devices())
+outputs["placed"] = placed
+print(json.dumps(outputs))
+"""
+
+
+def test_predict_structure_on_devices(tmp_path):
+    env = {
+        **os.environ,
+        "XLA_FLAGS": "--xla_force_host_platform_device_count=2",
+        "JAX_PLATFORMS": "cpu",
+    }
+    output = subprocess.run(
+        [sys.executable, "-c", SCRIPT, str(tmp_path)],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    outputs = json.loads(output.splitlines()[-1])
+    assert outputs["num_devices"] == 2
+    sequential, devices = outputs["sequential"], outputs["devices"]
+    assert len(sequential["rank"]) == 6
+    for key in ["rank", "metric", "files", "scores"]:
+        assert sequential[key] == devices[key], key
+    # the work items alternate between the devices, params are placed once per device
+    assert set(sequential["devices"]) == {0}
+    assert devices["devices"] == [0, 1, 0, 1, 0, 1]
+    assert outputs["placed"] == 6
+
+
+def test_imap_waits_for_running_items():
+    import threading
+    import time
+
+    from colabfold.multi_device import DevicePool
+
+    started, finished = [], []
+    release = threading.Event()
+
+    def fn(item, device):
+        started.append(item)
+        if item > 0:
+            release.wait(5)
+            time.sleep(0.1)
+        finished.append(item)
+        return item
+
+    with DevicePool(devices=["a", "b"]) as pool:
+        predictions = pool.imap(fn, range(4))
+        assert next(predictions) == (0, 0)
+        # item 1 is still running when the iteration is closed
+        while len(started) < 2:
+            time.sleep(0.01)
+        release.set()
+        predictions.close()
+        assert finished == [0, 1]
+        assert started == [0, 1]
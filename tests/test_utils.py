@@ -1,6 +1,9 @@
+import gzip
+
 import pytest
 
-from colabfold.batch import get_queries, convert_pdb_to_mmcif, validate_and_fix_mmcif
+from colabfold.batch import A3MPath, get_queries, convert_pdb_to_mmcif, validate_and_fix_mmcif, unserialize_msa
+from colabfold.utils import unique_sequences
 
 
 def test_get_queries_fasta_dir(pytestconfig, caplog):
@@ -38,11 +41,13 @@ def test_get_queries_csv(pytestconfig, caplog, tmp_path):
 
 
 def test_a3m_input(pytestconfig, caplog, tmp_path):
-    queries, is_complex = get_queries(pytestconfig.rootpath.joinpath("test-data/a3m"))
+    a3m_dir = pytestconfig.rootpath.joinpath("test-data/a3m")
+    queries, is_complex = get_queries(a3m_dir)
 
+    # the a3m files of a directory are read when the job starts
     assert queries == [
-        ("5AWL1", "YYDPETGTWY", [">101\nYYDPETGTWY"]),
-        ("6A5J", "IKKILSKIKKLLK", [">101\nIKKILSKIKKLLK\n>101\nIKKILSKIKKLLK"]),
+        ("5AWL1", "YYDPETGTWY", A3MPath(a3m_dir.joinpath("5AWL1.a3m"), ">101")),
+        ("6A5J", "IKKILSKIKKLLK", A3MPath(a3m_dir.joinpath("6A5J.a3m"), ">101")),
     ]
     assert not is_complex
 
@@ -138,3 +143,38 @@ def test_convert_pdb_to_mmcif_parse_with_alphafold(pytestconfig, tmp_path):
     )
 
     assert len(parsing_result.errors) == 0
+
+
+def test_unique_sequences():
+    unique, index, cardinality = unique_sequences(["MRIL", "gsHM ", "MRIL", "GSHM", "PIAQ"])
+    assert unique == ["MRIL", "GSHM", "PIAQ"]
+    assert index == [0, 1, 0, 1, 2]
+    assert cardinality == [2, 2, 1]
+
+    # linear in the number of sequences
+    unique, index, cardinality = unique_sequences([f"MRIL{'A' * (i % 1000)}" for i in range(100000)])
+    assert len(unique) == 1000 and cardinality == [100] * 1000 and index[1001] == 1
+
+
+def test_get_queries_lazy_and_compressed(tmp_path):
+    complex_a3m = "#4,3\t1,1\n>101\t102\nAAAACCC\n>101\nAAAA\n>102\nCCC\n"
+    with gzip.open(tmp_path.joinpath("complex.a3m.gz"), "wt") as f:
+        f.write(complex_a3m)
+    tmp_path.joinpath("single.a3m").write_text(">101\nGSHMKL\n>UP1\nGSaHMKL\n")
+    with gzip.open(tmp_path.joinpath("query.fasta.gz"), "wt") as f:
+        f.write(">query\nMRILPIS\n")
+
+    queries, is_complex = get_queries(tmp_path)
+
+    assert [(jobname, seq) for jobname, seq, _ in queries] == [
+        ("single", "GSHMKL"),
+        ("complex", "AAAACCC"),
+        ("query", "MRILPIS"),
+    ]
+    assert is_complex
+    assert queries[2][2] is None
+    # the a3m files are only read when the job needs them
+    tmp_path.joinpath("single.a3m").write_text(">101\nGSHMKL\n")
+    assert queries[0][2] == A3MPath(tmp_path.joinpath("single.a3m"), ">101")
+    assert unserialize_msa(queries[0][2], "GSHMKL")[0] == [">101\nGSHMKL"]
+    assert queries[1][2] == A3MPath(tmp_path.joinpath("complex.a3m.gz"), "#4,3\t1,1")
@@ -0,0 +1,64 @@
+def test_prefetch_order_and_errors():
+    import threading
+    import time
+    from colabfold.workers import prefetch
+
+    running, max_running = 0, 0
+    lock = threading.Lock()
+
+    def fetch(i):
+        nonlocal running, max_running
+        with lock:
+            running += 1
+            max_running = max(max_running, running)
+        time.sleep(0.01 * (5 - i % 5))
+        with lock:
+            running -= 1
+        if i == 3:
+            raise ValueError("bad query")
+        return i * i
+
+    results = list(prefetch(range(10), fetch, 2))
+    assert [item for item, _, _ in results] == list(range(10))
+    assert [result for _, result, _ in results] == [
+        i * i if i != 3 else None for i in range(10)
+    ]
+    assert isinstance(results[3][2], ValueError)
+    assert all(error is None for i, _, error in results if i != 3)
+    assert max_running <= 2
+
+
+def test_shared_feature_arrays():
+    import os
+
+    import numpy as np
+    from colabfold.workers import SharedArray, load_shared_arrays, share_arrays
+
+    features = {
+        "msa": np.arange(100000, dtype=np.int32).reshape(1000, 100),
+        "seq_length": np.array([100]),
+    }
+    shared = share_arrays(features)
+    assert isinstance(shared["msa"], SharedArray)
+    assert shared["seq_length"] is features["seq_length"]
+
+    loaded = load_shared_arrays(shared)
+    assert not os.path.exists(shared["msa"].path)
+    np.testing.assert_array_equal(loaded["msa"], features["msa"])
+    # copy on write, the features can still be modified in place
+    loaded["msa"][0, 0] = -1
+
+
+def test_shared_msas(tmp_path):
+    from colabfold.workers import SharedMSA, load_shared_msas, share_msas
+    from colabfold.msa_container import BinaryMSA
+
+    a3m = ">101\nACDEF\n" + "".join(f">{n}\nAC-EF\n" for n in range(20000))
+    msas = [BinaryMSA.from_a3m(a3m), ">101\nMRILP\n"]
+    shared = share_msas(msas, tmp_path)
+    assert isinstance(shared[0], SharedMSA) and shared[1] == msas[1]
+    assert any(tmp_path.iterdir())
+    loaded = load_shared_msas(shared)
+    assert loaded[0].to_a3m() == a3m and loaded[1] == msas[1]
+    assert list(tmp_path.iterdir()) == []
+    assert share_msas(None, tmp_path) is None